@@ -1,284 +1,519 @@
 from langgraph.graph import StateGraph
-from typing import List, TypedDict
+from typing import Annotated, List, Optional, TypedDict
 import json
-from langchain_core.messages import HumanMessage
-from sql_search import get_sql_tools
+import logging
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from langchain_core.runnables import RunnableLambda
+from sql_search import get_sql_tools, start_metric_cube
 from rag_search import get_rag_tools
-from tools import decide_tools, fix_rag_result
-from langchain_google_vertexai import VertexAI
-from langgraph.checkpoint.memory import MemorySaver
+from tools import run_in_parallel, arun_in_parallel
+from planner import QueryPlan, plan_query, aplan_query, plan_queries
+from context_builder import build_context
+from llm_cache import cached_batch_as_completed
+from conversation_state import PER_TURN_KEYS, turn_facts, compact_history, clip_followup, state_report
+import tracing
+from sql_fast_path import parse_question
+from checkpointer import get_checkpointer, new_thread_id
 from langchain.chat_models import init_chat_model
-from prompt import LLM_SQL_SYS_PROMPT, USER_DECIDE_SEARCH_PROMPT, MULTI_RAG_PROMPT, FINAL_GENERATE_PROMPT, FIRST_ASKED_PROMPT, INVALID_QUERY_PROMPT
+from prompt import FINAL_GENERATE_PROMPT, INVALID_QUERY_PROMPT
 from config import (PROJECT_ID, REGION, BUCKET, INDEX_ID, 
                     ENDPOINT_ID, BUCKET_URI, 
-                    MODEL_NAME, EMBEDDING_MODEL_NAME, MODEL_PROVIDER
+                    MODEL_NAME, EMBEDDING_MODEL_NAME, MODEL_PROVIDER,
+                    RAG_MAX_WORKERS, RAG_SUBQUERY_TIMEOUT, SQL_QUERY_TIMEOUT, BATCH_MAX_CONCURRENCY
                     )
-from IPython.display import Image, display
 
 
 
+def merge_tool_results(left: Optional[List[dict]], right: Optional[List[dict]]) -> List[dict]:
+    """tool_results 的 reducer：平行分支各自回傳的結果串接合併；傳入 None 代表新一輪開始，清空結果"""
+    if right is None:
+        return []
+    return (left or []) + right
+
+
 class AgentState(TypedDict):
     query: str
     adjusted_query: str
+    sql_query: str  # planner 產生的 SQL 問句
+    direct_answer: str  # SQL fast path 已能直接回答時的答案
+    rag_queries: List[dict]  # planner 拆分後的 RAG 子查詢與過濾條件 (RAG_Search tool 的輸入)
     tools: List[str]
-    tool_results: List[str]
+    # 每個工具呼叫一筆：{"tool", "query", "answer"} (RAG 另有 "sources"、"metadata"、"filters"；失敗時為 "error")
+    tool_results: Annotated[List[dict], merge_tool_results]
     final_answer: str  # 這裡的 key 改為 final_answer 避免衝突
+    # ✅ 每個對話各自的狀態 (不放在 Agent 物件上，Agent 由所有 session 共用)
+    is_first: bool  # 是否為新的一輪提問
+    is_end: bool  # 本輪是否直接結束 (需要使用者補充資訊)
+    is_fiscal: Optional[bool]
+    is_usd: Optional[bool]
+    history_summary: str  # 前幾輪壓縮成的事實 (每行一筆)，取代完整的歷史結果
+    turn: int  # 已完成的輪數
+
+
+# ✅ stream_run 回報給 UI 的節點進度
+NODE_PROGRESS = {
+    "plan": "Planning the query",
+    "summarize": "Summarizing",
+    "sql_action": "Querying SQL database",
+    "rag_action": "Retrieving earnings call transcripts",
+    "action": "Checking the question",
+    "generate_final_response": "Generating answer",
+}
+# 會把 LLM token 串流給 UI 的節點 (產生最終回答的節點)
+STREAMED_NODES = {"generate_final_response", "action"}
+
+
+logger = logging.getLogger(__name__)
+
+
+def _node(name, func, afunc):
+    """graph 節點：sync 與 async 實作各自包成一個 span"""
+    return RunnableLambda(tracing.traced("node", name)(func), afunc=tracing.traced("node", name)(afunc), name=name)
 
 
 class Agent:
-    def __init__(self, model, sql_tools, rag_tools, role, mode):
+    def __init__(self, model, sql_tools, rag_tools, role, mode, checkpointer=None):
         self.role = role #
         self.mode = mode #
         self.model = model
-        self.is_first = True
-        self.is_FISCAL = None
-        self.is_USD = None
-        self.is_end = False
         self.tools = sql_tools + rag_tools  
         self.tool_dict = {t.name: t for t in self.tools}
 
         # LangGraph: 建立 StateGraph
         graph = StateGraph(state_schema=AgentState)
-        graph.add_node("decide", self.start_chat)
-        graph.add_node("summarize", self.summarize)
-        graph.add_node("adjust_sql_query", self.adjust_sql_query)  # ✅ 新增 SQL 調整 Node
-        graph.add_node("adjust_rag_query", self.adjust_rag_query)  # ✅ 新增 RAG 調整 Node
-        graph.add_node("sql_action", self.take_action_sql)
-        graph.add_node("rag_action", self.take_action_rag)
-        graph.add_node("action", self.take_action)
-        graph.add_node("generate_final_response", self.generate_final_response)  # ✅ 修正名稱避免衝突
-        graph.add_node("end", lambda state: state)
-
-        # 設定決策流程
+        # ✅ 每個 node 同時提供 sync 與 async 實作：graph.invoke 走 sync，graph.ainvoke 走 async
+        graph.add_node("plan", _node("plan", self.plan, self.aplan))
+        graph.add_node("summarize", _node("summarize", self.summarize, self.asummarize))
+        graph.add_node("sql_action", _node("sql_action", self.take_action_sql, self.atake_action_sql))
+        graph.add_node("rag_action", _node("rag_action", self.take_action_rag, self.atake_action_rag))
+        graph.add_node("action", _node("action", self.take_action, self.atake_action))
+        graph.add_node("generate_final_response", _node("generate_final_response", self.generate_final_response, self.agenerate_final_response))  # ✅ 修正名稱避免衝突
+        graph.add_node("end", _node("end", self.finish_turn, self.afinish_turn))
+
+        # 設定決策流程：一次 plan 之後 SQL 與 RAG 兩條分支平行展開，
+        # 各自的結果經由 tool_results reducer 合併，兩邊都完成後才進入 generate_final_response
         graph.add_conditional_edges(
-            "decide",
-            lambda state: "summarize" if self.mode == "summarize" 
-                    else "end" if self.is_end
-                    else "adjust_sql_query" if (self.is_sql_query(state) or self.is_rag_query(state)) 
-                    else "action"
+            "plan",
+            self.route_after_plan,
+            ["summarize", "end", "sql_action", "rag_action", "action"],
         )
-        graph.add_edge("adjust_sql_query", "sql_action")
-        graph.add_edge("sql_action", "adjust_rag_query")
-        graph.add_edge("adjust_rag_query", "rag_action")
-        graph.add_edge("rag_action", "generate_final_response")
+        graph.add_edge(["sql_action", "rag_action"], "generate_final_response")
         graph.add_edge("action", "end")
         graph.add_edge("generate_final_response", "end")
 
-        graph.set_entry_point("decide")
-        memory = MemorySaver()
-        self.graph = graph.compile(checkpointer=memory)
-        try:
-            display(Image(graph.get_graph().draw_mermaid_png()))
-        except Exception:
-            # This requires some extra dependencies and is optional
-            pass
-
-    def start_chat(self, state: AgentState) -> AgentState:
-        """決定應該使用哪些工具"""
-        print("In Start Chat")
+        graph.set_entry_point("plan")
+        # 對話狀態存在共用的 checkpointer (只保留最近幾個 checkpoint，批次寫入 SQLite，閒置對話會移出記憶體)
+        self.graph = graph.compile(checkpointer=checkpointer if checkpointer is not None else get_checkpointer())
+
+    def draw_graph(self, path=None):
+        """輸出 graph 的 mermaid PNG (需要額外套件，可能會連網路渲染)，不在建立 Agent 時執行"""
+        png = self.graph.get_graph().draw_mermaid_png()
+        if path:
+            with open(path, "wb") as f:
+                f.write(png)
+        return png
+
+    def plan(self, state: AgentState) -> AgentState:
+        """一次 structured output 呼叫決定工具、財年 / 幣值、SQL 問句與 RAG 子查詢 (含過濾條件)"""
+        logger.debug("In Plan")
         if self.mode == "summarize": # 第一層判斷 chat mode or summarize mode
-            return state
-
-        if not self.is_first: # 第二層判斷是否新的一輪開始
-            query = state["query"] + "\n" +  state["adjusted_query"]   ## 幫確認
-        else:
-            query = state["query"]
-        prompt = FIRST_ASKED_PROMPT.format(query=query)
-        result = llm.invoke(prompt).content
-        print(result)
-        data = {}
-        json_str = result.replace('```json', '').replace('```', '').strip()
-        # 分行處理字串
-        for line in json_str.splitlines():
-            # 跳過不包含冒號的行
-            if ':' not in line:
-                continue
-            # 分割鍵和值
-            key, value = line.split(':', 1)
-            # 移除多餘的符號和空白
-            key = key.strip().strip('"')
-            value = value.strip().strip('",[] ')
-            # 將值存入字典
-            data[key] = value
-        if not (data["fiscal"] and data["USD"]):
-            self.is_end = True
-            if not (data["fiscal"] or data["USD"]):
-                final_answer = "請問您的年度是使用財年或者歷年，以及希望呈現的幣值(USD/TWD)?"
-            elif not data["fiscal"]:
-                final_answer = "請問您的年度是使用財年或者歷年?"
-            elif not data["USD"]:
-                final_answer = "希望呈現的幣值(USD/TWD)?"
-            state["final_answer"] = final_answer
-
-            state["adjusted_query"] = query
-
-            self.is_first = False
-
-            return state
-        self.is_FISCAL = data["fiscal"]
-        self.is_USD = data["USD"]
-        state["tools"] = data["tools"]
-        state["query"] = query
-        self.is_end = False
-        self.is_first = False
-        
-        
-        return state
+            return {}
+        query = self._plan_query_text(state)
+        return self._apply_plan(plan_query(self.model, query), query)
+
+    async def aplan(self, state: AgentState) -> AgentState:
+        logger.debug("In Plan")
+        if self.mode == "summarize":
+            return {}
+        query = self._plan_query_text(state)
+        return self._apply_plan(await aplan_query(self.model, query), query)
+
+    def _plan_query_text(self, state: AgentState):
+        if not state.get("is_first", True): # 第二層判斷是否新的一輪開始
+            # 補充的回答接在待確認的問句後面，只保留原始問題與最近的補充
+            return clip_followup(state["query"] + "\n" +  state["adjusted_query"])   ## 幫確認
+        return state["query"]
+
+    def _apply_plan(self, plan: QueryPlan, query):
+        logger.info("Plan: %s", plan.model_dump_json())
+        clarification = plan.clarification
+        if plan.fiscal is None and plan.usd is None:
+            clarification = "請問您的年度是使用財年或者歷年，以及希望呈現的幣值(USD/TWD)?"
+        elif plan.fiscal is None:
+            clarification = "請問您的年度是使用財年或者歷年?"
+        elif plan.usd is None:
+            clarification = "希望呈現的幣值(USD/TWD)?"
+        if clarification:
+            # 未指定財年 / 歷年或幣值時先反問使用者，補充的回答會接在原問句後重新規劃
+            return {"final_answer": clarification, "adjusted_query": query, "is_end": True, "is_first": False}
+
+        update = {"tools": plan.tools, "query": query, "is_fiscal": plan.fiscal, "is_usd": plan.usd,
+                  "is_end": False, "is_first": False}
+        if "sql_db_query" in plan.tools:
+            # 標準問句交給 SQL fast path，保留原問句讓 fast path 能辨識
+            update["sql_query"] = query if parse_question(query) is not None else (plan.sql_question or query)
+        if "RAG_Search" in plan.tools:
+            # planner 已解析出每個子查詢的公司 / 年份 / 季度，RAG tool 不必再呼叫 LLM 擷取
+            update["rag_queries"] = [dict(q.model_dump(), extract_filters=False)
+                                     for q in plan.rag_queries if q.query.strip()] or [{"query": query}]
+        return update
+
+    def route_after_plan(self, state: AgentState):
+        """plan 之後的路由：需要查資料時同時展開 SQL 與 RAG 兩條分支"""
+        if self.mode == "summarize":
+            return "summarize"
+        if state.get("is_end"):
+            return "end"
+        if self.is_sql_query(state) or self.is_rag_query(state):
+            # 兩條分支都會執行，不需要的一方直接略過，讓 join 節點能等到兩邊完成
+            return ["sql_action", "rag_action"]
+        return "action"
     
     def summarize(self, state: AgentState) -> AgentState:
         """將 tools 查詢結果與 user 問題整合，再交給 LLM 重新回答"""
-        print("In Summarize")
-        query = state["query"]
-        tool_results = "\n".join(state["tool_results"])
+        logger.debug("In Summarize")
+        final_answer = self.model.invoke(self._final_prompt(state))
+        return {"final_answer": final_answer.content}
 
-        prompt = FINAL_GENERATE_PROMPT.format(query=query, tool_results=tool_results)
-        # print('final round query:', prompt)
-        
-        final_answer = self.model.invoke(prompt)
-        state["final_answer"] = final_answer.content
-        return state
+    async def asummarize(self, state: AgentState) -> AgentState:
+        logger.debug("In Summarize")
+        final_answer = await self.model.ainvoke(self._final_prompt(state))
+        return {"final_answer": final_answer.content}
+
+    def _final_prompt(self, state: AgentState):
+        query = state["query"]
+        # ✅ 去除重複 chunk 與 repr 雜訊、依相關度在 token 預算內組出 context
+        tool_results, report = build_context(query, state["tool_results"], history=state.get("history_summary"))
+        logger.info("Final context: %s", report)
+        tracing.annotate(context_tokens=report["tokens_after"], context_tokens_saved=report["tokens_saved"],
+                         context_chunks=report["chunks_used"])
+        return FINAL_GENERATE_PROMPT.format(query=query, tool_results=tool_results)
 
     def is_sql_query(self, state: AgentState) -> bool:
-        """檢查是否需要 Call SQL tool 調整"""
-        return "sql_db_query" in state["tools"]
+        """檢查是否需要 Call SQL tool 調整 (Agent 沒有這個工具時略過)"""
+        return "sql_db_query" in state["tools"] and "sql_db_query" in self.tool_dict
     
     def is_rag_query(self, state: AgentState) -> bool:
-        """檢查是否需要 Call SQL tool 調整"""
-        return "RAG_Search" in state["tools"]
-
-    def adjust_sql_query(self, state: AgentState) -> AgentState:
-        """調整 SQL Query，使其更加明確"""
-        print("In Adjust SQL Query")
-        if not self.is_sql_query(state):
-            return state
-        
-        query = state["query"]
-        prompt = LLM_SQL_SYS_PROMPT.format(query=query)
-        adjusted_query = self.model.invoke(prompt).content
-        print(f"Adjusted SQL query: {adjusted_query}\n")
-        return {"query": query, "adjusted_query": adjusted_query, "tools": state["tools"], "tool_results": [], "final_answer": ""}
- 
-
-    def adjust_rag_query(self, state: AgentState) -> AgentState:
-        """調整 RAG Query，使其更加明確"""
-        print("In Adjust RAG Query")
-        if not self.is_rag_query(state):
-            return state
-        
-        query = state["query"]
-        prompt = MULTI_RAG_PROMPT.format(query=query)
-        is_multi_rag = self.model.invoke(prompt)
-        multi_rag = fix_rag_result(is_multi_rag.content)
-
-        adjusted_query = ""
-        for each_query in multi_rag["Split Queries"]:
-
-            adjusted_query += each_query+'\n'
-        
-        print(f"Adjusted SQL query: {adjusted_query}\n")
-        state["adjusted_query"] = adjusted_query
-        return state
-        # return {"query": query, "adjusted_query": adjusted_query, "tools": state["tools"], "tool_results": [], "final_answer": ""}
+        """檢查是否需要 Call RAG tool 調整 (Agent 沒有這個工具時略過)"""
+        return "RAG_Search" in state["tools"] and "RAG_Search" in self.tool_dict
 
     def take_action_sql(self, state: AgentState) -> AgentState:
         """執行查詢工具"""
-        print("In Take Action SQL")
+        logger.debug("In Take Action SQL")
         if not self.is_sql_query(state):
-            return state
+            return {}
         
-        query = state["adjusted_query"]
-        tool_names = state["tools"]
-        results = state["tool_results"]
+        query = state["sql_query"]
         
         name = "sql_db_query"
         tool = self.tool_dict.get(name)
             # user_query = SQL_SYS_PROMPT + query
         tool_result = tool.run(query)
-        results.append(f"{name} tool reponse : {tool_result['structured_response']}")
+        return self._sql_results(name, query, tool_result)
+
+    async def atake_action_sql(self, state: AgentState) -> AgentState:
+        logger.debug("In Take Action SQL")
+        if not self.is_sql_query(state):
+            return {}
+        name = "sql_db_query"
+        tool_result = await self.tool_dict[name].arun(state["sql_query"])
+        return self._sql_results(name, state["sql_query"], tool_result)
+
+    def _sql_results(self, name, query, tool_result):
+        results = [{"tool": name, "query": query, "answer": tool_result["structured_response"]}]
             
-        print(f"--- {name} tool results:", results)
-        state["tool_results"] = results
-        return state
-        # return {"query": state["query"], "adjusted_query": query, "tools": tool_names, "tool_results": results, "final_answer": ""}
+        logger.debug("%s tool results: %s", name, results)
+        # ✅ 只回傳本分支新增的結果，由 reducer 與 RAG 分支的結果合併
+        if tool_result.get("fast_path"):
+            return {"tool_results": results, "direct_answer": tool_result["structured_response"]}
+        return {"tool_results": results}
     
     def take_action_rag(self, state: AgentState) -> AgentState:
         """執行查詢工具"""
-        print("In Take Action RAG")
+        logger.debug("In Take Action RAG")
         if not self.is_rag_query(state):
-            return state
+            return {}
         
-        queries = state["adjusted_query"]
-        results = state["tool_results"]
         name = "RAG_Search"
         tool = self.tool_dict.get(name)
 
-        for query in queries.split('\n'):
-            
-            # user_query = SQL_SYS_PROMPT + query
-            tool_result = tool.run(query)
-            results.append(f"{name} tool reponse : {tool_result['structured_response']}")
+        # ✅ 子查詢 (含過濾條件) 平行執行並保持原順序
+        sub_queries = state["rag_queries"]
+        tool_outputs = run_in_parallel(tool.run, sub_queries,
+                                       max_workers=RAG_MAX_WORKERS, timeout=RAG_SUBQUERY_TIMEOUT)
+        return self._rag_results(name, sub_queries, tool_outputs)
+
+    async def atake_action_rag(self, state: AgentState) -> AgentState:
+        logger.debug("In Take Action RAG")
+        if not self.is_rag_query(state):
+            return {}
+        name = "RAG_Search"
+        sub_queries = state["rag_queries"]
+        tool_outputs = await arun_in_parallel(self.tool_dict[name].arun, sub_queries,
+                                              max_concurrency=RAG_MAX_WORKERS, timeout=RAG_SUBQUERY_TIMEOUT)
+        return self._rag_results(name, sub_queries, tool_outputs)
+
+    def _rag_results(self, name, sub_queries, tool_outputs):
+        results = []
+        for sub_query, tool_result in zip(sub_queries, tool_outputs):
+            if isinstance(tool_result, Exception):
+                results.append({"tool": name, "query": sub_query["query"], "error": str(tool_result)})
+            else:
+                # 只保留回答與 chunk 文字 / metadata，不帶 source_documents 等重複內容
+                results.append({"tool": name, "query": sub_query["query"], "answer": tool_result["answer"],
+                                "sources": tool_result.get("sources", []), "metadata": tool_result.get("metadata", []),
+                                "filters": tool_result.get("extracted_info")})
         
         # llm
-        print(f"--- {name} tool results:", results)
-        state["tool_results"] = results
-        return state
-        # return {"query": state["query"], "adjusted_query": queries, "tools": tool_names, "tool_results": results, "final_answer": ""}
+        logger.debug("%s tool results: %s", name, [r.get("answer", r.get("error")) for r in results])
+        return {"tool_results": results}
     
     def take_action(self, state: AgentState) -> AgentState:
         """執行查詢工具"""
-        print("In Take Action")
+        logger.debug("In Take Action")
         query = state["query"]
         prompt = INVALID_QUERY_PROMPT.format(query=query)
 
         
-        result = llm.invoke(prompt).content
+        result = self.model.invoke(prompt).content
             
-        print("--- action results:", result)
-        state["final_answer"] = result
-        return state
+        logger.debug("action results: %s", result)
+        return {"final_answer": result}
         # return {"query": query, "adjusted_query": state["adjusted_query"], "tools": state["tools"], "tool_results": state["tool_results"], "final_answer": result}
 
+    async def atake_action(self, state: AgentState) -> AgentState:
+        logger.debug("In Take Action")
+        result = (await self.model.ainvoke(INVALID_QUERY_PROMPT.format(query=state["query"]))).content
+        logger.debug("action results: %s", result)
+        return {"final_answer": result}
+
     def generate_final_response(self, state: AgentState) -> AgentState:
         """將 tools 查詢結果與 user 問題整合，再交給 LLM 重新回答"""
-        print("In Generate Final Response")
+        logger.debug("In Generate Final Response")
 
-        self.is_first = True # 重置狀態
-
-        query = state["query"]
-        tool_results = "\n".join(state["tool_results"])
+        if state.get("direct_answer") and not self.is_rag_query(state):
+            # 只用到 SQL fast path 時答案已完整，不必再呼叫 LLM
+            return {"final_answer": state["direct_answer"], "is_first": True}  # 重置狀態
 
-        prompt = FINAL_GENERATE_PROMPT.format(query=query, tool_results=tool_results)
-        # print('final round query:', prompt)
-        
-        final_answer = self.model.invoke(prompt)
-        state["final_answer"] = final_answer.content
-        return state
+        final_answer = self.model.invoke(self._final_prompt(state))
+        return {"final_answer": final_answer.content, "is_first": True}  # 重置狀態
         # return {"query": query, "tools": state["tools"], "tool_results": state["tool_results"], "final_answer": final_answer}
 
-    def run(self, query: str, state: AgentState):
-        """對外的介面，餵入 query 後跑 graph，回傳最後 response"""
-        print("In Run")
+    async def agenerate_final_response(self, state: AgentState) -> AgentState:
+        logger.debug("In Generate Final Response")
+        if state.get("direct_answer") and not self.is_rag_query(state):
+            return {"final_answer": state["direct_answer"], "is_first": True}
+        final_answer = await self.model.ainvoke(self._final_prompt(state))
+        return {"final_answer": final_answer.content, "is_first": True}
+
+    def finish_turn(self, state: AgentState) -> AgentState:
+        """一輪結束：本輪的問答壓縮成幾行事實併入 history_summary，清掉只屬於本輪的欄位，
+        讓 checkpoint 與 session 中帶到下一輪的狀態大小固定，不隨輪數成長"""
+        turn = state.get("turn", 0) + 1
+        update = {"turn": turn, "tool_results": None, "sql_query": "", "direct_answer": "", "rag_queries": [], "tools": []}
+        if not state.get("is_end"):  # 需要使用者補充資訊時，等補充完成的那一輪再記錄
+            facts = turn_facts(turn, state["query"], state.get("final_answer", ""), state.get("tool_results"))
+            update["history_summary"] = compact_history(state.get("history_summary", ""), facts)
+        report = state_report({**state, **update, "tool_results": []})
+        logger.info("Session state: turn %s, %s bytes (carried %s / %s)", turn, report["state_bytes"],
+                    report["carried_bytes"], report["carried_limit_bytes"])
+        tracing.annotate(state_bytes=report["state_bytes"], carried_bytes=report["carried_bytes"])
+        return update
+
+    async def afinish_turn(self, state: AgentState) -> AgentState:
+        return self.finish_turn(state)
+
+    def _prepare_state(self, query: str, state: AgentState):
         if state is None:
             state: AgentState = {"query": query, "tools": [], "tool_results": [], "final_answer": ""}
         state["query"] = query
+        state.setdefault("adjusted_query", "")
+        state.setdefault("is_first", True)
+        state.setdefault("history_summary", "")
+        state.setdefault("turn", 0)
+        state["is_end"] = False
+        # ✅ 新的一輪：清空只屬於上一輪的欄位 (tool_results 的 None 會由 reducer 轉為空 list)
+        for key in PER_TURN_KEYS:
+            state[key] = "" if key in ("sql_query", "direct_answer") else []
+        state["tool_results"] = None
+        return state
+
+    def run(self, query: str, state: AgentState, thread_id: Optional[str] = None):
+        """對外的介面，餵入 query 後跑 graph，回傳最後 response；Agent 由多個 session 共用，thread_id 需區分對話"""
+        logger.debug("In Run")
+        thread_id = thread_id or new_thread_id()  # 沒有指定對話時不與其他呼叫共用狀態
+        state = self._prepare_state(query, state)
         #print("Updated AgentState =", state) 
-        end_state = self.graph.invoke(state, config={"configurable": {"thread_id": "unique_thread_id"}})
+        with tracing.span("run", "request", thread_id=thread_id):
+            end_state = self.graph.invoke(state, config={"configurable": {"thread_id": thread_id}})
         #print("Final AgentState =", end_state) 
         return end_state["final_answer"], end_state
 
-llm = init_chat_model(MODEL_NAME, model_provider=MODEL_PROVIDER)
+    async def arun(self, query: str, state: AgentState, thread_id: Optional[str] = None):
+        """run 的 async 版本：同一個 event loop 可同時服務多個對話 (thread_id 需各自不同)"""
+        logger.debug("In Async Run")
+        thread_id = thread_id or new_thread_id()
+        state = self._prepare_state(query, state)
+        with tracing.span("arun", "request", thread_id=thread_id):
+            end_state = await self.graph.ainvoke(state, config={"configurable": {"thread_id": thread_id}})
+        return end_state["final_answer"], end_state
+
+    def stream_run(self, query: str, state: AgentState, thread_id: Optional[str] = None):
+        """串流版的 run：依序 yield 節點進度 (progress)、最終回答的 token (token)，最後是 done (含完整 state)"""
+        logger.debug("In Stream Run")
+        thread_id = thread_id or new_thread_id()
+        state = self._prepare_state(query, state)
+        config = {"configurable": {"thread_id": thread_id}}
+        # generator 可能在不同的 context 被關閉，因此這個 span 不設為目前的 span，只記錄整體時間
+        request_span = tracing.span("stream_run", "request", thread_id=thread_id)
+        start = time.perf_counter()
+        first_token_s = None
+        for mode, chunk in self.graph.stream(state, config=config, stream_mode=["debug", "messages"]):
+            if mode == "debug":
+                # 節點開始執行時通知 UI 目前的步驟
+                if chunk["type"] == "task" and chunk["payload"]["name"] in NODE_PROGRESS:
+                    name = chunk["payload"]["name"]
+                    yield {"type": "progress", "node": name, "message": NODE_PROGRESS[name]}
+                continue
+            message, metadata = chunk
+            # 只轉送產生最終回答的節點的 token，其他節點 (判斷工具、改寫查詢) 的 LLM 輸出不顯示
+            if metadata.get("langgraph_node") in STREAMED_NODES and isinstance(message.content, str) and message.content:
+                if first_token_s is None:
+                    first_token_s = time.perf_counter() - start
+                yield {"type": "token", "content": message.content}
+
+        end_state = self.graph.get_state(config).values
+        total_s = time.perf_counter() - start
+        logger.info("Time to first token: %s s, total: %.3f s", first_token_s if first_token_s is None else round(first_token_s, 3), total_s)
+        request_span.set(time_to_first_token_s=first_token_s, total_s=total_s).finish()
+        yield {"type": "done", "final_answer": end_state["final_answer"], "state": end_state,
+               "state_report": state_report(end_state), "time_to_first_token_s": first_token_s, "total_s": total_s}
+
+    def run_batch(self, queries, max_concurrency: int = BATCH_MAX_CONCURRENCY):
+        """一批互不相關的問題 (每題都是新的對話，不寫入 checkpointer)：計畫、工具、最終回答三個階段各自對整批執行，
+        LLM 以 batch 有限併發呼叫，整批中相同的計畫、SQL 問句、RAG 子查詢與 prompt 只執行一次。
+        每題完成時 yield {"index", "query", "final_answer", "state"} (依完成順序；失敗時另有 "error")"""
+        queries = list(queries)
+        # generator 可能在不同的 context 被關閉，因此這個 span 不設為目前的 span
+        request_span = tracing.span("run_batch", "request", questions=len(queries))
+        start = time.perf_counter()
+        states = [self._prepare_state(query, None) for query in queries]
+        try:
+            # ✅ 1. 計畫：需要使用者補充資訊或計畫失敗的問題在這裡就結束
+            pending = []
+            for i, plan in enumerate(plan_queries(self.model, queries, max_concurrency)):
+                if isinstance(plan, Exception):
+                    yield self._batch_result(i, states[i], error=plan)
+                    continue
+                states[i].update(self._apply_plan(plan, queries[i]))
+                if states[i]["is_end"]:
+                    yield self._batch_result(i, states[i])
+                else:
+                    pending.append(i)
+
+            # ✅ 2. 工具：整批的 SQL 問句與 RAG 子查詢各自去重，兩種工具同時執行；
+            # 與 route_after_plan 相同，沒有用到 (或 Agent 沒有) 的工具整個階段略過
+            sql_inputs = list(dict.fromkeys(states[i]["sql_query"] for i in pending if self.is_sql_query(states[i])))
+            rag_inputs = {json.dumps(q, sort_keys=True): q for i in pending if self.is_rag_query(states[i])
+                          for q in states[i]["rag_queries"]}
+            sql_outputs, rag_outputs = {}, {}
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                sql_future = None
+                if sql_inputs:
+                    sql_future = executor.submit(contextvars.copy_context().run, run_in_parallel,
+                                                 self.tool_dict["sql_db_query"].run, sql_inputs, max_concurrency,
+                                                 SQL_QUERY_TIMEOUT)
+                if rag_inputs:
+                    rag_outputs = dict(zip(rag_inputs, run_in_parallel(self.tool_dict["RAG_Search"].run, list(rag_inputs.values()),
+                                                                       max_workers=max_concurrency, timeout=RAG_SUBQUERY_TIMEOUT)))
+                if sql_future is not None:
+                    sql_outputs = dict(zip(sql_inputs, sql_future.result()))
+
+            prompts, template_ids, waiting = [], [], []
+            for i in pending:
+                state = states[i]
+                state["tool_results"] = []
+                if self.is_sql_query(state):
+                    output = sql_outputs[state["sql_query"]]
+                    if isinstance(output, Exception):
+                        state["tool_results"] += [{"tool": "sql_db_query", "query": state["sql_query"], "error": str(output)}]
+                    else:
+                        update = self._sql_results("sql_db_query", state["sql_query"], output)
+                        state["tool_results"] += update["tool_results"]
+                        state["direct_answer"] = update.get("direct_answer", "")
+                if self.is_rag_query(state):
+                    outputs = [rag_outputs[json.dumps(q, sort_keys=True)] for q in state["rag_queries"]]
+                    state["tool_results"] += self._rag_results("RAG_Search", state["rag_queries"], outputs)["tool_results"]
+                if state["direct_answer"] and not self.is_rag_query(state):
+                    # 只用到 SQL fast path 時答案已完整，不必再呼叫 LLM
+                    state["final_answer"] = state["direct_answer"]
+                    yield self._batch_result(i, state)
+                    continue
+                if self.is_sql_query(state) or self.is_rag_query(state):
+                    prompts.append(self._final_prompt(state))
+                    template_ids.append("FINAL_GENERATE_PROMPT")
+                else:
+                    prompts.append(INVALID_QUERY_PROMPT.format(query=state["query"]))
+                    template_ids.append("INVALID_QUERY_PROMPT")
+                waiting.append(i)
+
+            # ✅ 3. 最終回答：相同的 prompt 只送一次，每題一完成就回傳
+            for j, response in cached_batch_as_completed(self.model, template_ids, prompts, max_concurrency,
+                                                         use_cache=False):
+                i = waiting[j]
+                if isinstance(response, Exception):
+                    yield self._batch_result(i, states[i], error=response)
+                else:
+                    states[i]["final_answer"] = response
+                    yield self._batch_result(i, states[i])
+
+            report = {"questions": len(queries), "unique_questions": len(set(queries)), "sql_queries": len(sql_inputs),
+                      "rag_queries": len(rag_inputs), "final_prompts": len(prompts), "unique_final_prompts": len(set(prompts))}
+            logger.info("Batch: %s, %.3f s", report, time.perf_counter() - start)
+            request_span.set(**report)
+        finally:
+            request_span.finish()
+
+    def _batch_result(self, index, state, error=None):
+        state["is_first"] = True  # 重置狀態
+        result = {"index": index, "query": state["query"], "final_answer": state.get("final_answer", ""), "state": state}
+        if error is not None:
+            logger.warning("Batch question %d failed: %s", index, error)
+            result["error"] = str(error)
+        return result
+
+
+@lru_cache(maxsize=None)
+def get_llm():
+    """第一次建立 Agent 時才初始化模型，import 本模組不連線"""
+    return init_chat_model(MODEL_NAME, model_provider=MODEL_PROVIDER)
+
 
 sql_tool = get_sql_tools()
 rag_tool = get_rag_tools()
-print("SQL Tools:", sql_tool, "\nRAG Tools:", rag_tool)
+logger.debug("SQL Tools: %s, RAG Tools: %s", sql_tool, rag_tool)
+
+_agent_cache = {}
+_agent_cache_lock = threading.Lock()
+
 # 新增create_agent函數讓 app.py 可以使用    
 def create_agent(role, mode):
-    #print(role, mode)
-    return Agent(model=llm, sql_tools=sql_tool, rag_tools=rag_tool, role=role, mode=mode) 
+    """取得 (role, mode) 對應的 Agent；編譯好的 graph 在整個 process 共用，只在第一次建立"""
+    key = (role, mode)
+    with _agent_cache_lock:
+        if key not in _agent_cache:
+            start_metric_cube()  # 在背景建立 metric cube，不必等到第一個查詢才開始
+            _agent_cache[key] = Agent(model=get_llm(), sql_tools=sql_tool, rag_tools=rag_tool, role=role, mode=mode)
+        return _agent_cache[key]
 if __name__ == "__main__":
+    tracing.setup_logging()
     # 建立 Agent 物件
     # llm = init_chat_model(MODEL_NAME, model_provider=MODEL_PROVIDER)
-    # agent = Agent(model=llm, sql_tools=get_sql_tools(), rag_tools=get_rag_tools())
+    # agent = Agent(model=get_llm(), sql_tools=get_sql_tools(), rag_tools=get_rag_tools())
 
     test_queries = [
         "What is Amazon's Revenue in 2022 Q1?",       # show 單一公司單一指標
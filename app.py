@@ -1,26 +1,16 @@
 import streamlit as st
 from streamlit_chat import message
-from langchain.chat_models import init_chat_model
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 from agent_modify import create_agent, AgentState
-from config import PROJECT_ID,REGION,BUCKET,BUCKET_URI,INDEX_ID,ENDPOINT_ID,DB_HOST,DB_PORT,DATABASE,_USER,_PASSWORD,MODEL_NAME,MODEL_PROVIDER, EMBEDDING_MODEL_NAME
-import psycopg2
-from sqlalchemy import create_engine
-db_url = f'postgresql+psycopg2://{_USER}:{_PASSWORD}@{DB_HOST}:{DB_PORT}/{DATABASE}'
-engine = create_engine(db_url)
-
-conn = psycopg2.connect(
-    dbname=DATABASE,
-    user=_USER,
-    password=_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT
-)
-cursor = conn.cursor()
+from config import PROJECT_ID,REGION,BUCKET,BUCKET_URI,INDEX_ID,ENDPOINT_ID,DB_HOST,DB_PORT,DATABASE,_USER,_PASSWORD,MODEL_NAME,MODEL_PROVIDER, EMBEDDING_MODEL_NAME, COMPANY_OPTIONS
+from sqlalchemy.exc import IntegrityError
+from db import fetch_user, insert_user
+import tracing
+from checkpointer import session_thread_id
+from conversation_state import carried_state
+from config import TRACING_ENABLED
 
 import bcrypt
+import uuid
 
 def hash_password(password):
     return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
@@ -32,19 +22,13 @@ def save_user(username, password, role):
     """儲存使用者到 PostgreSQL"""
     hashed_pw = hash_password(password)  # 加密密碼
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password, role) VALUES (%s, %s, %s)", 
-            (username, hashed_pw, role)
-        )
-        conn.commit()
-    except psycopg2.IntegrityError:
-        conn.rollback()
+        insert_user(username, hashed_pw, role)  # 每個請求各自從連線池取得連線
+    except IntegrityError:
         st.error("Username already exists. Try another one.")
 
 def authenticate_user(username, password):
     """從 SQL 驗證使用者"""
-    cursor.execute("SELECT password, role FROM users WHERE username = %s", (username,))
-    result = cursor.fetchone()
+    result = fetch_user(username)
     
     if result:
         hashed_pw, role = result
@@ -62,6 +46,16 @@ MODE = {"💬 Chat Mode":"Chat Mode", "📈 Report Mode":"Report Mode"}
 # llm = init_chat_model("gemini-1.5-pro", model_provider="google_vertexai")
 
 
+@st.cache_resource
+def init_observability():
+    """logging 與追蹤只在 process 啟動時設定一次 (Streamlit 每次互動都會重新執行本檔)"""
+    tracing.setup_logging()
+    if TRACING_ENABLED:
+        tracing.enable_tracing()
+
+
+init_observability()
+
 # 初始化 session_state 變數
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
@@ -69,10 +63,19 @@ if "agent_state" not in st.session_state:
     st.session_state.agent_state = AgentState(
         query="",
         adjusted_query="",
+        sql_query="",
+        direct_answer="",
+        rag_queries=[],
         tools=[],
         tool_results=[],
-        final_answer=""
+        final_answer="",
+        is_first=True,
+        is_end=False,
+        history_summary="",
+        turn=0,
     )
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex  # 每個瀏覽器 session 各自的對話紀錄
 
 
 def main():
@@ -91,6 +94,10 @@ def main():
     # Display the selected user role in the sidebar
     st.sidebar.write(f"Current User Role: {USERROLE[user_role]}")
     st.sidebar.write(f"Current Page: {page}")
+    if "state_report" in st.session_state:
+        report = st.session_state["state_report"]
+        st.sidebar.caption(f"Session state: turn {report['turn']}, {report['carried_bytes']} / "
+                           f"{report['carried_limit_bytes']} bytes carried, {report['history_facts']} facts")
 
     if page == "💬 Chat Mode":
         st.subheader("💬 AI ChatBot query")
@@ -101,8 +108,6 @@ def main():
             st.session_state['history'] = []
         if 'waiting_for_response' not in st.session_state:
             st.session_state['waiting_for_response'] = None  # 存放等待 AI 回應的訊息  
-        # 初始化 Agent
-        agent = create_agent(role=user_role, mode=mode)
 
         message("Hello! How can I assist you today?", avatar_style="thumbs")
 
@@ -111,6 +116,8 @@ def main():
         chat_container = st.container()
         with chat_container:
             for i, entry in enumerate(st.session_state['history']):
+                if entry["content"] == "⏳ ..." and st.session_state['waiting_for_response']:
+                    continue  # 等待中的回應改由下方的串流區塊顯示
                 if entry["role"] == "user" and entry["type"] == "text":
                     message(entry["content"], is_user=True, key=f"user_{i}")
                 elif entry["role"] == "bot" and entry["type"] == "text":
@@ -120,15 +127,31 @@ def main():
                     message(img_html, key=f"img_{i}", allow_html=True, avatar_style="thumbs")  # **顯示圖片**
 
 
-        # **處理等待中的 AI 回應**
+        # **處理等待中的 AI 回應** (以串流逐步顯示進度與回答)
         if st.session_state['waiting_for_response']:
             user_input = st.session_state['waiting_for_response']
             # 先更新 query
             st.session_state.agent_state["query"] = user_input
-            # **執行 agent**
-            final_answer, end_state = agent.run(user_input, st.session_state.agent_state)
+            # **執行 agent** (只在有待處理的問題時取得，編譯好的 graph 由 create_agent 快取)
+            agent = create_agent(role=user_role, mode=mode)
+            with chat_container:
+                placeholder = st.empty()
+            streamed = ""
+            final_answer, end_state = "", {}
+            for event in agent.stream_run(user_input, st.session_state.agent_state,
+                                          thread_id=session_thread_id(username, st.session_state["session_id"])):
+                if event["type"] == "progress":
+                    if not streamed:
+                        placeholder.markdown(f"⏳ {event['message']}...")
+                elif event["type"] == "token":
+                    streamed += event["content"]
+                    placeholder.markdown(streamed + "▌")
+                elif event["type"] == "done":
+                    final_answer, end_state = event["final_answer"], event["state"]
+                    st.session_state["state_report"] = event["state_report"]
+            placeholder.markdown(final_answer)
             # **更新 `AgentState`**
-            st.session_state.agent_state.update(end_state)  # 直接用 `end_state` 覆蓋原本的 state
+            st.session_state.agent_state.update(carried_state(end_state))  # 只帶入跨輪保留的部分 (大小有上限)
             st.session_state.agent_state["final_answer"] = final_answer  # 確保 `final_answer` 也更新
             # **找到最後一筆 "⏳ ..." 並更新**
             for i in range(len(st.session_state['history']) - 1, -1, -1):
@@ -166,41 +189,47 @@ def main():
         st.subheader("📈 Summarized report")
 
         # **available companies based on user role**
-        company_options = {
-            "KR": ["Samsung"],
-            "CN": ["Baidu", "Tencent"],
-            "GB": ["Amazon","AMD","Amkor","Apple","Applied Material","Baidu","Broadcom","Cirrus Logic","Google","Himax","Intel","KLA","Marvell","Microchip","Microsoft","Nvidia","ON Semi","Qorvo","Qualcomm","Samsung","STM","Tencent","Texas Instruments","TSMC","Western Digital"]
-        }
-        available_companies = company_options[user_role]
+        available_companies = COMPANY_OPTIONS[user_role]
 
         # **Select company**
         company = st.selectbox("Select company", available_companies)
 
-        # **Select quarter**
+        # ✅ 報表由 report_cache 預先計算，背景執行緒在 fin_data 有新資料時增量更新；這裡只讀快取，不查資料庫也不呼叫 LLM
+        from db import engine
+        from report_cache import get_report_cache, report_unit, MARGIN_COLUMNS
+        report_cache = get_report_cache()
+        report_cache.start_refresh_loop(engine)
+        report, version = report_cache.get(company)
+        if report is None:
+            st.info(f"{company} 的報表產生中，請稍後重新整理")
+            return
+
+        # **Select period**
+        year = st.selectbox("Select year", sorted(report["calendar_year"].unique(), reverse=True))
         quarter = st.selectbox("Select quarter", ["Q1", "Q2", "Q3", "Q4"])
+        period = f"{year} {quarter}"
+        history = report[report["calendar_year"] * 4 + report["calendar_qtr"] <= year * 4 + int(quarter[1])]
+        if history.empty or history["period"].iloc[-1] != period:
+            st.warning(f"{company} 沒有 {period} 的資料")
+            return
 
-        # **data**
-        np.random.seed(42)
-        data = {
-            "Month": ["Jan", "Feb", "Mar"] if quarter == "Q1" else
-                    ["Apr", "May", "Jun"] if quarter == "Q2" else
-                    ["Jul", "Aug", "Sep"] if quarter == "Q3" else
-                    ["Oct", "Nov", "Dec"],
-            "Revenue ($M)": np.random.randint(50, 200, size=3),
-            "Profit ($M)": np.random.randint(10, 100, size=3)
-        }
-
-        df = pd.DataFrame(data)
+        # 圖表在 chart service 的 worker 中以 Agg 繪製，依 (公司, 期間, 指標, 資料版本) 快取 PNG
+        from chart_service import get_chart_service
+        charts = get_chart_service()
 
-        st.write(f"### 📌 {company} - {quarter} 財務數據")
-        
-        st.dataframe(df)
+        unit = report_unit(history.tail(4))
+        st.write(f"### 📌 {company} - {period} 財務數據 (USD{' ' + unit if unit else ''})")
+        st.dataframe(history.tail(4).set_index("period").drop(columns=["calendar_year", "calendar_qtr", "val_unit"]).T)
 
         # **plot**
-        st.subheader(f"📈 {company} - {quarter} 收入與利潤趨勢")
-        fig, ax = plt.subplots()
-        df.set_index("Month").plot(ax=ax, marker='o')
-        st.pyplot(fig)
+        trend = history.tail(8).set_index("period")
+        st.subheader(f"📈 {company} - 近 {len(trend)} 季收入與利潤趨勢")
+        # 兩張圖同時送進 worker，再依序等待
+        revenue_chart = charts.submit(company, period, trend, ["Revenue", "Operating Income"], version)
+        margin_chart = charts.submit(company, period, trend, MARGIN_COLUMNS, version)
+        st.image(revenue_chart.result())
+        st.subheader(f"📈 {company} - 近 {len(trend)} 季利潤率 (%)")
+        st.image(margin_chart.result())
 
 def login_or_signup():
     st.title("🔑 Login or Create Account")
@@ -0,0 +1,101 @@
+"""Report Mode 圖表 benchmark：比較舊做法 (每次 rerun 都 plt.subplots() + df.plot()，figure 不關閉) 與 chart_service
+
+模擬多次 Report Mode rerun (每次兩張圖，公司 / 期間輪流)，報告每次 rerun 的繪圖延遲、
+tracemalloc 記憶體成長與 pyplot 中殘留的 figure 數。報表資料來自 SQLite 假 fin_data 建立的 report cache。
+執行方式 (repo 根目錄)：python -m benchmarks.charts --reruns 200
+"""
+import argparse
+import gc
+import io
+import json
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from chart_service import ChartService
+from report_cache import MARGIN_COLUMNS, ReportCache
+from benchmarks.fakes import make_fin_data_engine
+
+COMPANIES = ["Apple", "AMD", "Intel", "Nvidia", "TSMC", "Qualcomm"]
+CHARTS = [["Revenue", "Operating Income"], MARGIN_COLUMNS]
+plt.rcParams["figure.max_open_warning"] = 0  # 舊做法本來就會累積 figure，這裡只量測不警告
+
+
+def page_views(cache, reruns, distinct):
+    """(公司, 期間, 近 8 季資料, 資料版本)；只有 distinct 種不同的頁面，其餘是重複開啟 (rerun)"""
+    pages = []
+    for company in COMPANIES:
+        report, version = cache.get(company)
+        for end in range(8, len(report) + 1):
+            trend = report.iloc[end - 8:end].set_index("period")
+            pages.append((company, trend.index[-1], trend, version))
+    pages = pages[:distinct]
+    return [pages[i % len(pages)] for i in range(reruns)]
+
+
+def pyplot_rerun(view):
+    """舊做法：st.pyplot(fig) 會把 figure 存成 PNG，但 figure 從未關閉"""
+    company, period, trend, version = view
+    for metrics in CHARTS:
+        fig, ax = plt.subplots()
+        trend[metrics].plot(ax=ax, marker='o')
+        fig.savefig(io.BytesIO(), format="png")
+
+
+def service_rerun(service, view):
+    company, period, trend, version = view
+    futures = [service.submit(company, period, trend, metrics, version) for metrics in CHARTS]
+    for future in futures:
+        future.result()
+
+
+def measure(name, rerun, views):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        latencies = []
+        for view in views:
+            start = time.perf_counter()
+            rerun(view)
+            latencies.append(time.perf_counter() - start)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "mode": name,
+        "reruns": len(views),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+        "first_rerun_ms": round(latencies[0] * 1000, 2),
+        "total_s": round(sum(latencies), 3),
+        "memory_growth_kb": round((current - base) / 1024, 1),
+        "peak_memory_kb": round((peak - base) / 1024, 1),
+        "open_pyplot_figures": len(plt.get_fignums()),
+    }
+
+
+def main(reruns=200, distinct=20, workers=2, cache_size=256):
+    cache = ReportCache(":memory:")
+    cache.refresh(make_fin_data_engine(COMPANIES))
+    views = page_views(cache, reruns, distinct)
+    results = [measure("pyplot (before)", pyplot_rerun, views)]
+    plt.close("all")
+    service = ChartService(max_size=cache_size, workers=workers)
+    results.append(measure("chart_service", lambda view: service_rerun(service, view), views))
+    results[-1]["cache"] = service.cache_info()
+    service.close()
+    return {"reruns": reruns, "distinct_pages": distinct, "workers": workers, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20, help="distinct (company, period) pages among the reruns")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--cache-size", type=int, default=256)
+    args = parser.parse_args()
+    print(json.dumps(main(args.reruns, args.distinct, args.workers, args.cache_size), indent=2, ensure_ascii=False))
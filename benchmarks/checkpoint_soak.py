@@ -0,0 +1,105 @@
+"""對話狀態長時間測試 (soak)：大量對話、每個對話多輪，比較 MemorySaver 與 CompactingSaver 的記憶體成長
+
+模型與工具以 benchmarks.fakes 的假物件取代；每一輪結束後以 tracemalloc 取樣目前記憶體用量。
+MemorySaver 保存每個 checkpoint，記憶體隨輪數線性成長；CompactingSaver 只保留最近幾個 checkpoint，
+閒置的對話寫入 SQLite 後移出記憶體，記憶體應維持平穩。
+執行方式 (repo 根目錄)：python -m benchmarks.checkpoint_soak --conversations 200 --turns 5
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import llm_cache
+from langgraph.checkpoint.memory import MemorySaver
+from llm_cache import LLMCache
+from agent_modify import Agent
+from checkpointer import CompactingSaver, session_thread_id
+from benchmarks.fakes import ScriptedChatModel, make_fake_tools
+
+QUESTION = "How did Apple's revenue change in 2022 Q{qtr} and what did management say about demand? (turn {turn})"
+
+
+def new_state():
+    return {"query": "", "adjusted_query": "", "tools": [], "tool_results": [], "final_answer": "",
+            "is_first": True, "is_end": False}
+
+
+def soak(agent, checkpointer, conversations, turns, active, samples):
+    """同一時間有 active 個對話輪流發問，每個對話問 turns 輪後結束 (之後不再使用)"""
+    tracemalloc.start()
+    try:
+        history, answered = [], 0
+        start = time.perf_counter()
+        for first in range(0, conversations, active):
+            batch = range(first, min(first + active, conversations))
+            states = {i: new_state() for i in batch}
+            for turn in range(turns):
+                for i in batch:
+                    query = QUESTION.format(qtr=turn % 4 + 1, turn=turn)
+                    _, states[i] = agent.run(query, states[i], thread_id=session_thread_id(f"user{i}", "soak"))
+                    answered += 1
+            if isinstance(checkpointer, CompactingSaver):
+                checkpointer.flush()
+            gc.collect()
+            history.append(tracemalloc.get_traced_memory()[0])
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    step = max(1, len(history) // samples)
+    # 前 1/4 當作暖機，之後的成長才代表對話狀態的累積
+    warm = history[len(history) // 4]
+    result = {
+        "questions": answered,
+        "elapsed_s": round(elapsed, 2),
+        "memory_kb": [round(m / 1024, 1) for m in history[::step]],
+        "growth_after_warmup_kb": round((history[-1] - warm) / 1024, 1),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+    if isinstance(checkpointer, CompactingSaver):
+        result["checkpointer"] = checkpointer.memory_stats()
+    else:
+        result["checkpointer"] = {"checkpoints_in_memory": sum(len(c) for ns in checkpointer.storage.values()
+                                                               for c in ns.values()),
+                                  "blobs_in_memory": len(checkpointer.blobs)}
+    return result
+
+
+def main(conversations=200, turns=5, active=10, samples=10, keep_last=3, llm_latency=0.0, tool_latency=0.0):
+    llm_cache._llm_cache = LLMCache(path=":memory:")
+    sql_tools, rag_tools = make_fake_tools(tool_latency, tool_latency)
+    model = ScriptedChatModel(latency=llm_latency)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        savers = {
+            "memory_saver": MemorySaver(),
+            # idle_timeout=0：每次 flush 都把已寫入 SQLite 的對話移出記憶體，模擬長時間運作後的穩定狀態
+            "compacting_saver": CompactingSaver(path=os.path.join(tmp, "checkpoints.sqlite"), keep_last=keep_last,
+                                                flush_interval=None, idle_timeout=0),
+        }
+        for name, saver in savers.items():
+            agent = Agent(model=model, sql_tools=sql_tools, rag_tools=rag_tools, role="GB", mode="Chat Mode",
+                          checkpointer=saver)
+            results[name] = soak(agent, saver, conversations, turns, active, samples)
+        savers["compacting_saver"].close()
+        results["compacting_saver"]["sqlite_kb"] = round(os.path.getsize(os.path.join(tmp, "checkpoints.sqlite")) / 1024, 1)
+    return {"conversations": conversations, "turns": turns, "active": active, "keep_last": keep_last,
+            "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5, help="questions per conversation")
+    parser.add_argument("--active", type=int, default=10, help="conversations in progress at the same time")
+    parser.add_argument("--samples", type=int, default=10, help="memory samples to report")
+    parser.add_argument("--keep-last", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--tool-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    print(json.dumps(main(args.conversations, args.turns, args.active, args.samples, args.keep_last,
+                          args.llm_latency, args.tool_latency), indent=2, ensure_ascii=False))
@@ -0,0 +1,59 @@
+"""本地實體擷取 benchmark：以標註資料量測 company / year / quarter 準確率、吞吐量，以及仍需呼叫 LLM 的比例
+
+執行方式 (repo 根目錄)：python -m benchmarks.entity_extractor
+"""
+import argparse
+import json
+import os
+import time
+from entity_extractor import extract_filters
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "entity_queries.jsonl")
+FIELDS = ["company", "year", "quarter"]
+
+
+def load_labeled(path=DATA_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(path=DATA_PATH, repeat=200):
+    labeled = load_labeled(path)
+    correct = {name: 0 for name in FIELDS}
+    exact, fallbacks, errors = 0, 0, []
+    for row in labeled:
+        predicted = dict(zip(FIELDS, extract_filters(row["query"])))
+        hits = [predicted[name] == row[name] for name in FIELDS]
+        for name, hit in zip(FIELDS, hits):
+            correct[name] += hit
+        exact += all(hits)
+        if not any(predicted.values()):
+            fallbacks += 1  # 找不到任何實體時 rag_search 才會呼叫 LLM
+        if not all(hits):
+            errors.append({"query": row["query"], "expected": {n: row[n] for n in FIELDS}, "predicted": predicted})
+
+    queries = [row["query"] for row in labeled]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            extract_filters(query)
+    elapsed = time.perf_counter() - start
+    n_calls = repeat * len(queries)
+
+    return {
+        "n_queries": len(labeled),
+        "accuracy": {name: round(correct[name] / len(labeled), 4) for name in FIELDS},
+        "exact_match": round(exact / len(labeled), 4),
+        "llm_fallback_rate": round(fallbacks / len(labeled), 4),
+        "throughput_qps": round(n_calls / elapsed),
+        "latency_us": round(elapsed / n_calls * 1e6, 2),
+        "errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.data, args.repeat), indent=2, ensure_ascii=False))
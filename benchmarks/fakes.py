@@ -0,0 +1,218 @@
+"""benchmark 用的假模型與假工具：以固定延遲模擬網路等待，回應依 prompt 模板決定，不需要 GCP 或資料庫"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, List, Optional, Tuple, Union
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain.tools import StructuredTool, Tool
+from context_builder import estimate_tokens
+
+# (prompt 中的特徵字串, 回應)；依序比對，第一個符合的就是回應；回應也可以是 callable(prompt) -> str
+DEFAULT_SCRIPT = [
+    ("### Produce the plan:",  # PLANNER_PROMPT (structured output)
+     '{"tools": ["sql_db_query", "RAG_Search"], "fiscal": false, "usd": true, '
+     '"sql_question": "What was Apple\'s `Revenue` in calendar year 2022 Q1, in USD and local currency?", '
+     '"rag_queries": [{"query": "What did Apple say about demand in 2022 Q1?", '
+     '"company_name": "Apple", "calendar_year": 2022, "calendar_qtr": "Q1"}], "clarification": null}'),
+    ("### Available Data Sources:",  # FIRST_ASKED_PROMPT
+     '```json\n{\n  "tools": ["sql_db_query", "RAG_Search"],\n  "fiscal": true,\n  "USD": true\n}\n```'),
+    ("**Generate Split Queries:**",  # MULTI_RAG_PROMPT
+     '```json\n{\n  "Extracted Info": {"Company Name": ["Apple"], "CALENDAR_YEAR": ["2022"], "CALENDAR_QTR": ["Q1"]},\n'
+     '  "Multiple Values Exist": "No",\n  "Split Queries": [\n    "What did Apple say about demand in 2022 Q1?"\n  ]\n}\n```'),
+    ("CALENDAR_QTR: <Extracted Quarter or None>",  # RAG_SPLIT_QUERY_PROMPT
+     "Company Name: Apple\nCALENDAR_YEAR: 2022\nCALENDAR_QTR: Q1"),
+    ("user query:",  # LLM_SQL_SYS_PROMPT
+     "What was Apple's `Revenue` in calendar year 2022 Q1, in USD and local currency?"),
+]
+DEFAULT_ANSWER = ("Apple reported revenue of USD 97,278 million in 2022 Q1, and management said demand "
+                  "remained strong across products and services during the earnings call.")
+
+
+class UsageMeter:
+    """統計 LLM 呼叫次數與 prompt / response token 數 (本地估算)；可由多個模型、多個執行緒共用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.response_tokens = 0
+
+    def record(self, prompt, response):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += estimate_tokens(prompt)
+            self.response_tokens += estimate_tokens(response)
+
+    def snapshot(self):
+        with self._lock:
+            return {"llm_calls": self.calls, "prompt_tokens": self.prompt_tokens, "response_tokens": self.response_tokens}
+
+
+class ScriptedChatModel(BaseChatModel):
+    """依 script 回應的 chat model；每次呼叫等待 latency 秒 (sync 用 time.sleep，async 用 asyncio.sleep)"""
+
+    script: List[Tuple[str, Union[str, Callable[[str], str]]]] = DEFAULT_SCRIPT
+    default: str = DEFAULT_ANSWER
+    latency: float = 0.2
+    token_latency: float = 0.0  # 串流時每個 token 之間的間隔
+    model_name: str = "scripted-chat"
+    meter: Optional[Any] = None  # UsageMeter
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    def _respond(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        response = self.default
+        for marker, scripted in self.script:
+            if marker in prompt:
+                response = scripted(prompt) if callable(scripted) else scripted
+                break
+        if self.meter is not None:
+            self.meter.record(prompt, response)
+        return response
+
+    def bind_tools(self, tools, **kwargs):
+        """SQL ReAct agent 需要 bind_tools；假模型不會呼叫工具，直接回答"""
+        return self
+
+    def with_structured_output(self, schema, **kwargs):
+        """回應 (JSON) 直接解析成 schema，模擬 schema-constrained 的 structured output"""
+        return RunnableLambda(lambda prompt: schema.model_validate_json(self.invoke(prompt).content),
+                              afunc=self._astructured(schema))
+
+    def _astructured(self, schema):
+        async def _parse(prompt):
+            return schema.model_validate_json((await self.ainvoke(prompt)).content)
+        return _parse
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for word in self._respond(messages).split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            time.sleep(self.token_latency)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for word in self._respond(messages).split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self.token_latency)
+
+
+def make_fake_tools(sql_latency=0.3, rag_latency=0.3):
+    """與 sql_search / rag_search 相同名稱與回傳格式的假工具 (各自有 sync 與 async 實作)"""
+
+    def sql_query(query):
+        time.sleep(sql_latency)
+        return {"structured_response": "Apple Revenue in 2022 Q1: USD 97278 (Million)"}
+
+    async def asql_query(query):
+        await asyncio.sleep(sql_latency)
+        return {"structured_response": "Apple Revenue in 2022 Q1: USD 97278 (Million)"}
+
+    def rag_query(query: str, company_name: Optional[str] = None, calendar_year: Optional[int] = None,
+                  calendar_qtr: Optional[str] = None, extract_filters: bool = True):
+        time.sleep(rag_latency)
+        return {"answer": f"Management discussed: {query}", "sources": [], "metadata": []}
+
+    async def arag_query(query: str, company_name: Optional[str] = None, calendar_year: Optional[int] = None,
+                         calendar_qtr: Optional[str] = None, extract_filters: bool = True):
+        await asyncio.sleep(rag_latency)
+        return {"answer": f"Management discussed: {query}", "sources": [], "metadata": []}
+
+    sql_tools = [Tool(name="sql_db_query", func=sql_query, coroutine=asql_query, description="fake SQL tool")]
+    rag_tools = [StructuredTool.from_function(name="RAG_Search", func=rag_query, coroutine=arag_query,
+                                              description="fake RAG tool")]
+    return sql_tools, rag_tools
+
+
+class HashEmbeddings(Embeddings):
+    """以 token hash 產生的固定向量 (feature hashing)，相同文字得到相同向量、共用字詞的文字彼此相近"""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+FIN_DATA_METRICS = ["Revenue", "Cost of Goods Sold", "Operating Income", "Operating Expense", "Tax Expense", "Total Asset"]
+
+
+def _fraction(*key):
+    """由 key 的 hash 得到 [0, 1) 之間的固定數值"""
+    digest = hashlib.md5("|".join(map(str, key)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") / 2 ** 32
+
+
+def make_fin_data_engine(companies, years=range(2019, 2025)):
+    """記憶體中的 SQLite fin_data (欄位與正式資料表相同)，數值由公司 / 期間的 hash 決定，每次建立都相同"""
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    rows = []
+    for company in companies:
+        for year in years:
+            for qtr in range(1, 5):
+                revenue = round(1000 + 90000 * _fraction(company, year, qtr), 1)
+                cogs = round(revenue * (0.3 + 0.4 * _fraction(company, year, qtr, "cogs")), 1)
+                operating_income = round((revenue - cogs) * (0.2 + 0.6 * _fraction(company, year, qtr, "op")), 1)
+                values = {
+                    "Revenue": revenue,
+                    "Cost of Goods Sold": cogs,
+                    "Operating Income": operating_income,
+                    "Operating Expense": round(revenue - cogs - operating_income, 1),
+                    "Tax Expense": round(operating_income * 0.15, 1),
+                    "Total Asset": round(revenue * 4, 1),
+                }
+                rows.extend({"company_name": company, "index": metric, "calendar_year": year, "calendar_qtr": qtr,
+                             "usd_value": values[metric], "local_value": values[metric], "local_currency": "USD",
+                             "val_unit": "Million"} for metric in FIN_DATA_METRICS)
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE fin_data (id INTEGER PRIMARY KEY AUTOINCREMENT, company_name VARCHAR, "index" VARCHAR, '
+            'calendar_year INTEGER, calendar_qtr INTEGER, usd_value NUMERIC, local_currency VARCHAR, '
+            'val_unit VARCHAR, local_value NUMERIC)'))
+        conn.execute(text(
+            'INSERT INTO fin_data (company_name, "index", calendar_year, calendar_qtr, usd_value, local_currency, '
+            'val_unit, local_value) VALUES (:company_name, :index, :calendar_year, :calendar_qtr, :usd_value, '
+            ':local_currency, :val_unit, :local_value)'), rows)
+    return engine
@@ -0,0 +1,90 @@
+"""Agent 負載測試：比較 sync 路徑 (一個 worker 一次處理一個問題) 與 async 路徑 (單一 event loop 同時處理多個對話) 的吞吐量
+
+模型與工具以 benchmarks.fakes 的固定延遲假物件取代，量測的是執行架構本身的差異。
+執行方式 (repo 根目錄)：python -m benchmarks.load_test --conversations 50 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import llm_cache
+from llm_cache import LLMCache
+from agent_modify import Agent
+from checkpointer import CompactingSaver
+from benchmarks.fakes import ScriptedChatModel, make_fake_tools
+
+QUESTION = "How did Apple's revenue change in 2022 Q1 and what did management say about demand? (conversation {i})"
+
+
+def new_state():
+    return {"query": "", "adjusted_query": "", "tools": [], "tool_results": [], "final_answer": "",
+            "is_first": True, "is_end": False}
+
+
+def summarize(name, latencies, elapsed):
+    return {
+        "mode": name,
+        "conversations": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_qps": round(len(latencies) / elapsed, 2),
+        "latency_p50_s": round(float(np.percentile(latencies, 50)), 3),
+        "latency_p95_s": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def run_sync(agent, n, threads=1):
+    """threads=1：單一 worker 依序處理；threads>1：以執行緒池模擬多個 sync worker"""
+    def _one(i):
+        start = time.perf_counter()
+        agent.run(QUESTION.format(i=f"sync-{threads}-{i}"), new_state(), thread_id=f"sync-{threads}-{i}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(_one, range(n)))
+    return summarize("sync" if threads == 1 else f"sync x{threads} threads", latencies, time.perf_counter() - start)
+
+
+async def run_async(agent, n, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await agent.arun(QUESTION.format(i=f"async-{i}"), new_state(), thread_id=f"async-{i}")
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(_one(i) for i in range(n)))
+    return summarize(f"async (concurrency {concurrency})", latencies, time.perf_counter() - start)
+
+
+def main(conversations=50, concurrency=50, threads=0, llm_latency=0.2, tool_latency=0.3):
+    # 每個對話 (含不同模式之間) 的問題都不同，且使用記憶體快取，避免命中或寫入正式的 LLM 快取
+    llm_cache._llm_cache = LLMCache(path=":memory:")
+    sql_tools, rag_tools = make_fake_tools(tool_latency, tool_latency)
+    agent = Agent(model=ScriptedChatModel(latency=llm_latency), sql_tools=sql_tools, rag_tools=rag_tools,
+                  role="GB", mode="Chat Mode", checkpointer=CompactingSaver(path=None, flush_interval=None))
+
+    results = [run_sync(agent, conversations)]
+    if threads > 1:
+        results.append(run_sync(agent, conversations, threads))
+    results.append(asyncio.run(run_async(agent, conversations, concurrency)))
+    baseline = results[0]["throughput_qps"]
+    for result in results:
+        result["speedup_vs_sync"] = round(result["throughput_qps"] / baseline, 2)
+    return {"llm_latency_s": llm_latency, "tool_latency_s": tool_latency, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=0, help="also run the sync path on N threads")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--tool-latency", type=float, default=0.3)
+    args = parser.parse_args()
+    print(json.dumps(main(args.conversations, args.concurrency, args.threads, args.llm_latency, args.tool_latency),
+                     indent=2, ensure_ascii=False))
@@ -0,0 +1,56 @@
+"""長對話測試：同一個對話連續問很多輪，確認 prompt 大小與跨輪保留的狀態不隨輪數成長
+
+每一輪記錄 prompt token 數 (本地估算)、對話狀態與跨輪保留部分的 bytes，報告第 1 輪與最後一輪的差異。
+模型與工具以 benchmarks.fakes 的假物件取代。
+執行方式 (repo 根目錄)：python -m benchmarks.long_conversation --turns 50
+"""
+import argparse
+import json
+import llm_cache
+from llm_cache import LLMCache
+from agent_modify import Agent
+from checkpointer import CompactingSaver, new_thread_id
+from conversation_state import carried_state, state_report
+from benchmarks.fakes import ScriptedChatModel, UsageMeter, make_fake_tools
+
+COMPANIES = ["Apple", "AMD", "Intel", "Nvidia", "TSMC", "Qualcomm", "Samsung", "Micron"]
+QUESTION = "How did {company}'s revenue change in {year} Q{qtr} and what did management say about demand?"
+
+
+def main(turns=50, samples=10):
+    llm_cache._llm_cache = LLMCache(path=":memory:")
+    meter = UsageMeter()
+    sql_tools, rag_tools = make_fake_tools(0, 0)
+    agent = Agent(model=ScriptedChatModel(latency=0, meter=meter), sql_tools=sql_tools, rag_tools=rag_tools,
+                  role="GB", mode="Chat Mode", checkpointer=CompactingSaver(path=None, flush_interval=None))
+    thread_id = new_thread_id()
+    state, rows = {}, []
+    for turn in range(turns):
+        query = QUESTION.format(company=COMPANIES[turn % len(COMPANIES)], year=2019 + turn % 6, qtr=turn % 4 + 1)
+        meter.reset()
+        _, end_state = agent.run(query, state, thread_id=thread_id)
+        state = carried_state(end_state)  # 與 app.py 相同：只把跨輪保留的部分帶到下一輪
+        report = state_report(end_state)
+        rows.append({"turn": turn + 1, "prompt_tokens": meter.snapshot()["prompt_tokens"],
+                     "state_bytes": report["state_bytes"], "carried_bytes": report["carried_bytes"],
+                     "history_facts": report["history_facts"]})
+    step = max(1, len(rows) // samples)
+    first, last = rows[0], rows[-1]
+    return {
+        "turns": turns,
+        "carried_limit_bytes": state_report(state)["carried_limit_bytes"],
+        "first_turn": first,
+        "last_turn": last,
+        "max_prompt_tokens": max(r["prompt_tokens"] for r in rows),
+        "max_carried_bytes": max(r["carried_bytes"] for r in rows),
+        "prompt_growth_ratio": round(last["prompt_tokens"] / first["prompt_tokens"], 2),
+        "samples": rows[::step],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=10, help="turns to include in the report")
+    args = parser.parse_args()
+    print(json.dumps(main(args.turns, args.samples), indent=2, ensure_ascii=False))
@@ -0,0 +1,96 @@
+"""RAG pipeline 併發測試：同時送出大量不同公司 / 期間過濾條件的查詢，確認每個查詢只拿到自己條件的 chunk
+
+以本地向量索引 (HashEmbeddings) 與假模型取代 Vertex AI，sync (執行緒) 與 async 兩條路徑都會檢查。
+執行方式 (repo 根目錄)：python -m benchmarks.rag_concurrency --queries 400 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import COMPANY_OPTIONS
+from local_vector_store import LocalVectorStore
+import rag_search
+from benchmarks.fakes import HashEmbeddings, ScriptedChatModel
+
+YEARS = [2021, 2022, 2023]
+QUARTERS = ["Q1", "Q2", "Q3", "Q4"]
+
+
+def build_store(chunks_per_call=4):
+    """每家公司每一季的法說會各 chunks_per_call 個 chunk，內容相近，只靠 metadata 過濾區分"""
+    texts, metadatas = [], []
+    for company in COMPANY_OPTIONS["GB"]:
+        for year in YEARS:
+            for qtr in QUARTERS:
+                for i in range(chunks_per_call):
+                    texts.append(f"Earnings call chunk {i}: management discussed demand, margins and the outlook.")
+                    metadatas.append({"Company Name": company, "CALENDAR_YEAR": year, "CALENDAR_QTR": qtr})
+    store = LocalVectorStore(HashEmbeddings())
+    store.add_texts(texts, metadatas)
+    store.index.build()
+    return store
+
+
+def make_queries(n, seed=0):
+    rng = random.Random(seed)
+    return [(company, year, qtr, f"What did {company} say about demand in {year} {qtr}?")
+            for company, year, qtr in ((rng.choice(COMPANY_OPTIONS["GB"]), rng.choice(YEARS), rng.choice(QUARTERS))
+                                       for _ in range(n))]
+
+
+def check(expected, result):
+    """回傳不屬於這個查詢條件的 chunk 數 (沒有取回任何 chunk 也算一次錯誤)"""
+    company, year, qtr = expected
+    if not result["metadata"]:
+        return 1
+    return sum(1 for m in result["metadata"]
+               if (m["Company Name"], int(m["CALENDAR_YEAR"]), m["CALENDAR_QTR"]) != (company, year, qtr))
+
+
+def run_sync(queries, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda q: rag_search.query_rag_tool(q[3]), queries))
+    elapsed = time.perf_counter() - start
+    leaked = sum(check(q[:3], r) for q, r in zip(queries, results))
+    return {"mode": f"sync x{concurrency} threads", "queries": len(queries), "leaked_chunks": leaked,
+            "elapsed_s": round(elapsed, 3), "throughput_qps": round(len(queries) / elapsed, 1)}
+
+
+async def run_async(queries, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(query):
+        async with semaphore:
+            return await rag_search.aquery_rag_tool(query)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_one(q[3]) for q in queries))
+    elapsed = time.perf_counter() - start
+    leaked = sum(check(q[:3], r) for q, r in zip(queries, results))
+    return {"mode": f"async (concurrency {concurrency})", "queries": len(queries), "leaked_chunks": leaked,
+            "elapsed_s": round(elapsed, 3), "throughput_qps": round(len(queries) / elapsed, 1)}
+
+
+def main(n_queries=400, concurrency=32, llm_latency=0.02):
+    rag_search.set_rag_resources(vector_store=build_store(), qa_llm=ScriptedChatModel(latency=llm_latency))
+    queries = make_queries(n_queries)
+    try:
+        results = [run_sync(queries, concurrency), asyncio.run(run_async(queries, concurrency))]
+    finally:
+        rag_search.set_rag_resources()
+    return {"ok": all(r["leaked_chunks"] == 0 for r in results), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    report = main(args.queries, args.concurrency, args.llm_latency)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(0 if report["ok"] else 1)
@@ -0,0 +1,254 @@
+"""離線端對端 benchmark：以假模型、hash embedding、本地向量索引與 SQLite fin_data 重播固定的問題集
+
+報告每個問題集的節點延遲、LLM 呼叫次數、prompt / response token 數 (本地估算)、記憶體峰值 (tracemalloc)，
+以及逐題執行 (Agent.run 的 graph) 與整批執行 (Agent.run_batch) 的吞吐量 (questions / minute)。
+不需要 Vertex AI、Matching Engine 或 Cloud SQL。
+執行方式 (repo 根目錄)：python -m benchmarks.run --output .cache/bench.json
+與先前的報告比較：python -m benchmarks.run --baseline .cache/bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+import llm_cache
+import rag_search
+import sql_search
+import tracing
+from llm_cache import LLMCache
+from agent_modify import Agent
+from checkpointer import CompactingSaver
+from config import COMPANY_OPTIONS
+from entity_extractor import extract_entities
+from local_vector_store import LocalVectorStore
+from sql_fast_path import parse_question
+from benchmarks.fakes import (DEFAULT_SCRIPT, HashEmbeddings, ScriptedChatModel, UsageMeter,
+                              make_fin_data_engine)
+
+# ✅ 與 agent_modify.py 測試區塊相同的問題集，再加上多公司的法說會問題
+QUERY_SETS = {
+    "sigle_value_query": [
+        "What is Amazon's Revenue in 2022 Q1?",
+        "What is AMD's Operating Income in 2023 Q3?",
+    ],
+    "trend_anlysis_query": [
+        "Did Intel's Gross Profit Margin increase in 2020 Q4?",
+        "Did Samsung's Operating Expense decrease in 2020 Q3?",
+    ],
+    "time_based_comparison_query": [
+        "Is Qualcomm's Total Asset in 2023 Q1 higher than in 2022 Q1?",
+        "Is TSMC's Operating Margin in 2021 Q2 higher than in 2020 Q2?",
+        "Is Microsoft's Tax Expense in 2024 Q1 lower than in 2023 Q4?",
+        "Is Google's Revenue in 2022 Q2 higher than in 2021 Q2?",
+        "Is Apple's Operating Income in 2021 Q1 higher than in 2020 Q1?",
+        "Was Broadcom's Cost of Goods Sold lower in 2020 Q2 compared to Q1?",
+    ],
+    "multi_company_rag_query": [
+        "What did Apple, Nvidia and TSMC say about AI demand in 2023 Q2?",
+        "Compare what AMD and Intel said about data center demand in 2022 Q4.",
+        "Summarize the earnings calls of Samsung, Micron and Qualcomm in 2023 Q1.",
+        "How did Amazon and Google describe cloud growth in their 2022 Q3 earnings calls, and what was their Revenue?",
+    ],
+}
+YEARS = range(2019, 2025)
+TOPICS = ["AI accelerators", "data center", "smartphones", "PCs", "cloud", "automotive", "inventory", "pricing"]
+_RAG_RE = re.compile(r"\b(say|said|describe|discuss|comment|mention|earnings calls?|transcripts?|outlook)\b", re.IGNORECASE)
+_USER_QUERY_RE = re.compile(r"### User Query:\n(.*?)\n\n###", re.DOTALL)
+
+
+def plan_for(prompt):
+    """依 PLANNER_PROMPT 中的問題產生計畫 (取代真正的 planner LLM)：有指標的走 SQL，問法說會內容的依公司拆成 RAG 子查詢"""
+    query = _USER_QUERY_RE.search(prompt).group(1).strip()
+    entities = extract_entities(query)
+    tools = []
+    if parse_question(query) is not None or re.search(r"revenue|income|expense|margin|asset|cost", query, re.IGNORECASE):
+        tools.append("sql_db_query")
+    rag_queries = []
+    if _RAG_RE.search(query):
+        tools.append("RAG_Search")
+        year = entities.years[0] if entities.years else None
+        qtr = entities.quarters[0] if entities.quarters else None
+        rag_queries = [{"query": f"What did {company} say in its {year} {qtr} earnings call? ({query})",
+                        "company_name": company, "calendar_year": year, "calendar_qtr": qtr}
+                       for company in entities.companies]
+    return json.dumps({"tools": tools, "fiscal": False, "usd": True, "sql_question": query,
+                       "rag_queries": rag_queries, "clarification": None})
+
+
+def build_vector_store(companies, chunks_per_call=6):
+    """每家公司每一季 chunks_per_call 個 chunk，內容依公司 / 期間 / 主題而不同"""
+    texts, metadatas = [], []
+    for company in companies:
+        for year in YEARS:
+            for qtr in range(1, 5):
+                for i in range(chunks_per_call):
+                    topic = TOPICS[(i + qtr) % len(TOPICS)]
+                    texts.append(f"{company} {year} Q{qtr} earnings call, part {i}: management discussed {topic} demand, "
+                                 f"gross margin trends and the outlook for the next quarter in detail.")
+                    metadatas.append({"Company Name": company, "CALENDAR_YEAR": year, "CALENDAR_QTR": f"Q{qtr}"})
+    store = LocalVectorStore(HashEmbeddings())
+    store.add_texts(texts, metadatas)
+    store.index.build()
+    return store
+
+
+class NodeTimer(BaseCallbackHandler):
+    """以 callback 記錄每個 graph 節點的執行時間 (平行分支各自計時)"""
+
+    def __init__(self):
+        self._starts = {}
+        self.durations = defaultdict(list)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # 節點內同名的 RunnableLambda 是節點本身的子 run，不重複計時
+        if node and kwargs.get("name") == node and parent_run_id not in self._starts:
+            self._starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id in self._starts:
+            node, start = self._starts.pop(run_id)
+            self.durations[node].append(time.perf_counter() - start)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+
+def new_state():
+    return {"query": "", "adjusted_query": "", "tools": [], "tool_results": [], "final_answer": "",
+            "is_first": True, "is_end": False}
+
+
+def replay(agent, queries, meter, name):
+    """依序執行問題集 (每個問題是新的對話)，回傳延遲與 LLM 用量"""
+    llm_cache._llm_cache = LLMCache(path=":memory:")  # 每次重播都從空的快取開始，結果可重現
+    meter.reset()
+    timer = NodeTimer()
+    latencies = []
+    for i, query in enumerate(queries):
+        config = {"configurable": {"thread_id": f"{name}-{i}"}, "callbacks": [timer]}
+        start = time.perf_counter()
+        agent.graph.invoke(agent._prepare_state(query, new_state()), config=config)
+        latencies.append(time.perf_counter() - start)
+    nodes = {node: {"calls": len(d), "total_ms": round(sum(d) * 1000, 2), "mean_ms": round(float(np.mean(d)) * 1000, 2),
+                    "max_ms": round(max(d) * 1000, 2)}
+             for node, d in sorted(timer.durations.items())}
+    return {"queries": len(queries),
+            "questions_per_minute": round(len(queries) / sum(latencies) * 60, 1),
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+            "latency_max_ms": round(max(latencies) * 1000, 2),
+            "total_ms": round(sum(latencies) * 1000, 2),
+            "nodes": nodes,
+            **meter.snapshot()}
+
+
+def replay_batch(agent, queries, meter, max_concurrency):
+    """以 Agent.run_batch 一次執行整批問題，回傳吞吐量、每題完成時間與 LLM 用量"""
+    llm_cache._llm_cache = LLMCache(path=":memory:")
+    meter.reset()
+    start = time.perf_counter()
+    completed = [time.perf_counter() - start for _ in agent.run_batch(queries, max_concurrency=max_concurrency)]
+    elapsed = time.perf_counter() - start
+    return {"queries": len(queries),
+            "questions_per_minute": round(len(queries) / elapsed * 60, 1),
+            "first_result_ms": round(completed[0] * 1000, 2) if completed else None,
+            "total_ms": round(elapsed * 1000, 2),
+            **meter.snapshot()}
+
+
+def peak_memory_kb(agent, queries, meter, name):
+    """另外重播一次量測 tracemalloc 峰值 (tracemalloc 會拖慢執行，不與延遲量測同時進行)"""
+    tracemalloc.start()
+    try:
+        replay(agent, queries, meter, f"{name}-memory")
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def main(llm_latency=0.0, sets=None, batch_concurrency=8):
+    companies = COMPANY_OPTIONS["GB"]
+    meter = UsageMeter()
+    script = [("### Produce the plan:", plan_for)] + DEFAULT_SCRIPT[1:]
+    model = ScriptedChatModel(script=script, latency=llm_latency, meter=meter)
+
+    sql_search.set_sql_resources(sql_engine=make_fin_data_engine(companies, YEARS), llm=model)
+    rag_search.set_rag_resources(vector_store=build_vector_store(companies), qa_llm=model)
+    try:
+        # 對話狀態只放記憶體，不寫入正式的 .cache/checkpoints.sqlite
+        agent = Agent(model=model, sql_tools=sql_search.get_sql_tools(), rag_tools=rag_search.get_rag_tools(),
+                      role="GB", mode="Chat Mode", checkpointer=CompactingSaver(path=None, flush_interval=None))
+        sql_search.start_metric_cube()
+        sql_search.cube_ready(timeout=60)  # cube 在背景建立，等它完成再開始計時，各輪都走同一條路徑
+        results, all_queries = {}, []
+        for name, queries in QUERY_SETS.items():
+            if sets and name not in sets:
+                continue
+            replay(agent, queries, meter, f"{name}-warmup")  # 第一次執行包含延遲載入，不計入
+            results[name] = replay(agent, queries, meter, name)
+            results[name]["peak_memory_kb"] = peak_memory_kb(agent, queries, meter, name)
+            results[name]["batch"] = replay_batch(agent, queries, meter, batch_concurrency)
+            all_queries += queries
+        # 所有問題集合成一批 (夜間報告 / 評估的用法)，與逐題執行的總和比較
+        sequential_ms = sum(r["total_ms"] for r in results.values())
+        batch_all = replay_batch(agent, all_queries, meter, batch_concurrency)
+        batch_all["sequential_questions_per_minute"] = round(len(all_queries) / sequential_ms * 60000, 1) if sequential_ms else None
+    finally:
+        sql_search.set_sql_resources()
+        rag_search.set_rag_resources()
+    return {"python": sys.version.split()[0], "llm_latency_s": llm_latency, "batch_concurrency": batch_concurrency,
+            "results": results, "batch_all": batch_all}
+
+
+def compare(report, baseline, tolerance):
+    """與 baseline 比較：LLM 呼叫次數與 token 數不可增加，延遲與記憶體不可超過 baseline 的 (1 + tolerance) 倍"""
+    problems = []
+    for name, result in report["results"].items():
+        base = (baseline or {}).get("results", {}).get(name)
+        if not base:
+            continue
+        for key in ("llm_calls", "prompt_tokens", "response_tokens"):
+            if result[key] > base[key]:
+                problems.append(f"{name}: {key} {result[key]} > baseline {base[key]}")
+        for key in ("latency_p50_ms", "peak_memory_kb"):
+            if result[key] > base[key] * (1 + tolerance):
+                problems.append(f"{name}: {key} {result[key]} > baseline {base[key]} (+{tolerance:.0%})")
+        if "batch" in base and result["batch"]["llm_calls"] > base["batch"]["llm_calls"]:
+            problems.append(f"{name}: batch llm_calls {result['batch']['llm_calls']} > baseline {base['batch']['llm_calls']}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated latency of every LLM call (s)")
+    parser.add_argument("--sets", nargs="*", choices=list(QUERY_SETS), help="only replay these query sets")
+    parser.add_argument("--output", help="write the JSON report to this path")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed latency / memory regression (0.2 = 20%%)")
+    parser.add_argument("--batch-concurrency", type=int, default=8, help="max_concurrency for Agent.run_batch")
+    parser.add_argument("--trace", help="also record spans to this JSON-lines file (metrics go next to it as .prom)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.trace:
+        tracing.enable_tracing(args.trace, os.path.splitext(args.trace)[0] + ".prom")
+    with contextlib.redirect_stdout(sys.stderr):  # agent 的執行紀錄不混入 JSON 報告
+        report = main(args.llm_latency, args.sets, args.batch_concurrency)
+    tracing.flush()
+    problems = compare(report, baseline, args.tolerance)
+    report["problems"] = problems
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,111 @@
+"""啟動時間 benchmark：以 python -X importtime 量測 import 各模組的時間，並確認 import 期間沒有任何網路連線
+
+執行方式 (repo 根目錄)：python -m benchmarks.startup --output .cache/startup.json
+與先前的報告比較：python -m benchmarks.startup --baseline .cache/startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# 在子行程中先把 socket 連線換成會記錄並拒絕的版本，再 import 目標模組
+_CHILD_CODE = """
+import json, socket, sys, time
+attempts = []
+def _deny(kind):
+    def _blocked(*args, **kwargs):
+        attempts.append({"call": kind, "args": repr(args[1:] if kind == "socket.connect" else args)[:200]})
+        raise OSError("network access disabled during startup benchmark")
+    return _blocked
+socket.socket.connect = _deny("socket.connect")
+socket.create_connection = _deny("socket.create_connection")
+socket.getaddrinfo = _deny("socket.getaddrinfo")
+error = None
+start = time.perf_counter()
+try:
+    import {module}
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - start
+print("@@STARTUP@@" + json.dumps({"wall_s": elapsed, "network_calls": attempts, "error": error}))
+"""
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的輸出：import time: self [us] | cumulative | imported package"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({"module": name.strip(), "depth": (len(name) - len(name.lstrip())) // 2,
+                     "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return rows
+
+
+def profile(module="agent_modify", top=25):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _CHILD_CODE.replace("{module}", module)],
+                          capture_output=True, text=True, cwd=os.getcwd())
+    result = {}
+    for line in proc.stdout.splitlines():
+        if line.startswith("@@STARTUP@@"):
+            result = json.loads(line[len("@@STARTUP@@"):])
+    rows = parse_importtime(proc.stderr)
+    # 最上層 (depth 0) 的 cumulative 加總即為整體 import 時間
+    total_ms = sum(r["cumulative_ms"] for r in rows if r["depth"] == 0)
+    project = {os.path.splitext(f)[0] for f in os.listdir(".") if f.endswith(".py")}
+    return {
+        "module": module,
+        "python": sys.version.split()[0],
+        "wall_s": round(result.get("wall_s", 0.0), 3),
+        "importtime_total_ms": round(total_ms, 1),
+        "modules_imported": len(rows),
+        "network_calls": result.get("network_calls", []),
+        "error": result.get("error") or (None if proc.returncode == 0 else proc.stderr.strip().splitlines()[-1]),
+        "project_modules": sorted(
+            ({"module": r["module"], "self_ms": round(r["self_ms"], 1), "cumulative_ms": round(r["cumulative_ms"], 1)}
+             for r in rows if r["module"] in project),
+            key=lambda r: -r["cumulative_ms"]),
+        "slowest": [{"module": r["module"], "cumulative_ms": round(r["cumulative_ms"], 1)}
+                    for r in sorted(rows, key=lambda r: -r["cumulative_ms"])[:top]],
+    }
+
+
+def compare(report, baseline, tolerance):
+    """與 baseline 比較，回傳退步的項目"""
+    problems = []
+    if report["network_calls"]:
+        problems.append(f"{len(report['network_calls'])} network call(s) during import")
+    if report["error"]:
+        problems.append(f"import failed: {report['error']}")
+    if baseline:
+        limit = baseline["importtime_total_ms"] * (1 + tolerance)
+        if report["importtime_total_ms"] > limit:
+            problems.append(f"import time {report['importtime_total_ms']}ms > baseline "
+                            f"{baseline['importtime_total_ms']}ms (+{tolerance:.0%})")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="agent_modify")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--output", help="write the JSON report to this path")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed import time regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report = profile(args.module, args.top)
+    problems = compare(report, baseline, args.tolerance)
+    report["problems"] = problems
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,93 @@
+"""本地向量索引 benchmark：比較 IVF (先過濾再 ANN) 與暴力搜尋的 recall@10 與延遲
+
+執行方式 (repo 根目錄)：python -m benchmarks.vector_index --n-docs 50000 --dim 256
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+import numpy as np
+from config import COMPANY_OPTIONS
+from local_vector_store import LocalVectorIndex
+
+YEARS = [2020, 2021, 2022, 2023, 2024]
+QUARTERS = ["Q1", "Q2", "Q3", "Q4"]
+
+
+def make_corpus(n_docs, dim, n_topics=512, seed=0):
+    """產生帶有主題群聚的合成向量，以及隨機的 Company / Year / Quarter metadata"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    labels = rng.integers(0, n_topics, size=n_docs)
+    vectors = topics[labels] + 1.0 * rng.normal(size=(n_docs, dim)).astype(np.float32)
+    companies = COMPANY_OPTIONS["GB"]
+    metadatas = [
+        {
+            "Company Name": companies[rng.integers(len(companies))],
+            "CALENDAR_YEAR": YEARS[rng.integers(len(YEARS))],
+            "CALENDAR_QTR": QUARTERS[rng.integers(len(QUARTERS))],
+        }
+        for _ in range(n_docs)
+    ]
+    queries = topics[rng.integers(0, n_topics, size=256)] + 1.0 * rng.normal(size=(256, dim)).astype(np.float32)
+    return vectors, metadatas, queries
+
+
+def make_filters(scenario, rng):
+    """產生與 rag_search.update_filters 相同語意的過濾條件"""
+    company = COMPANY_OPTIONS["GB"][rng.integers(len(COMPANY_OPTIONS["GB"]))]
+    year = float(YEARS[rng.integers(len(YEARS))])
+    qtr = QUARTERS[rng.integers(len(QUARTERS))]
+    if scenario == "no filter":
+        return [], []
+    if scenario == "year":
+        return [], [SimpleNamespace(name="CALENDAR_YEAR", value_float=year, op="EQUAL")]
+    if scenario == "company":
+        return [SimpleNamespace(name="Company Name", allow_tokens=[company], deny_tokens=[])], []
+    return ([SimpleNamespace(name="Company Name", allow_tokens=[company], deny_tokens=[]),
+             SimpleNamespace(name="CALENDAR_QTR", allow_tokens=[qtr], deny_tokens=[])],
+            [SimpleNamespace(name="CALENDAR_YEAR", value_float=year, op="EQUAL")])
+
+
+def run(n_docs=50000, dim=256, n_queries=200, k=10, n_probe=None):
+    vectors, metadatas, queries = make_corpus(n_docs, dim)
+    index = LocalVectorIndex(n_probe=n_probe) if n_probe else LocalVectorIndex()
+    index.add(vectors, metadatas)
+    start = time.perf_counter()
+    index.build()
+    build_s = time.perf_counter() - start
+
+    report = {"n_docs": n_docs, "dim": dim, "k": k, "n_probe": index.n_probe,
+              "n_lists": len(index.lists), "build_s": round(build_s, 3), "scenarios": {}}
+    for scenario in ["no filter", "year", "company", "company+year+qtr"]:
+        rng = np.random.default_rng(1)
+        recalls, ann_ms, exact_ms = [], [], []
+        for query in queries[:n_queries]:
+            filters, numeric_filters = make_filters(scenario, rng)
+            start = time.perf_counter()
+            exact = index.brute_force_search(query, k, filters, numeric_filters)
+            exact_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            approx = index.search(query, k, filters, numeric_filters)
+            ann_ms.append((time.perf_counter() - start) * 1000)
+            truth = {row for row, _ in exact}
+            if truth:
+                recalls.append(len(truth & {row for row, _ in approx}) / len(truth))
+        report["scenarios"][scenario] = {
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+            "ann_p50_ms": round(float(np.percentile(ann_ms, 50)), 3),
+            "ann_p95_ms": round(float(np.percentile(ann_ms, 95)), 3),
+            "brute_force_p50_ms": round(float(np.percentile(exact_ms, 50)), 3),
+            "brute_force_p95_ms": round(float(np.percentile(exact_ms, 95)), 3),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-docs", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--n-probe", type=int, default=None)
+    args = parser.parse_args()
+    print(json.dumps(run(args.n_docs, args.dim, args.n_queries, n_probe=args.n_probe), indent=2, ensure_ascii=False))
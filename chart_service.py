@@ -0,0 +1,114 @@
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from config import CHART_CACHE_SIZE, CHART_WORKERS, CHART_DPI
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def render_chart(data, metrics, title=None, fmt="png", dpi=CHART_DPI):
+    """以 Agg backend 畫折線圖 (x 軸為 data 的 index) 並回傳 PNG / SVG bytes；
+    直接建立 Figure，不經過 pyplot 的全域 figure 管理，畫完即釋放"""
+    fig = Figure(figsize=(6.4, 4.0), dpi=dpi)
+    try:
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        labels = [str(label) for label in data.index]
+        for metric in metrics:
+            ax.plot(labels, data[metric].to_numpy(), marker="o", label=metric)
+        ax.legend()
+        if title:
+            ax.set_title(title)
+        ax.grid(alpha=0.3)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format=fmt)
+        return buf.getvalue()
+    finally:
+        fig.clear()
+
+
+class ChartService:
+    """在 worker pool 中繪圖，結果 bytes 以 LRU 快取；key 為 (公司, 期間, 指標, 資料版本, 格式)，
+    資料版本不變時重新整理頁面不會重畫。同一張圖同時被要求多次時只畫一次"""
+
+    def __init__(self, max_size=CHART_CACHE_SIZE, workers=CHART_WORKERS):
+        self.max_size = max_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chart")
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> bytes
+        self._pending = {}  # key -> Future (繪製中)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "render_ms": 0.0}
+
+    def _render(self, key, data, metrics, title, fmt):
+        start = time.perf_counter()
+        try:
+            image = render_chart(data, metrics, title, fmt)
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._pending.pop(key, None)
+            self._cache[key] = image
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.stats["evictions"] += 1
+            self.stats["render_ms"] += elapsed_ms
+        logger.debug("Rendered chart %s in %.1f ms", key[:3], elapsed_ms)
+        return image
+
+    def submit(self, company, period, data, metrics, version, title=None, fmt="png"):
+        """回傳 Future；快取命中時 Future 已完成"""
+        key = (company, period, tuple(metrics), version, fmt)
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                future = Future()
+                future.set_result(image)
+            elif key in self._pending:
+                self.stats["hits"] += 1
+                future = self._pending[key]
+            else:
+                self.stats["misses"] += 1
+                future = self._executor.submit(self._render, key, data, metrics, title, fmt)
+                self._pending[key] = future
+        tracing.annotate(chart_cache_hit=image is not None)
+        return future
+
+    @tracing.traced("chart")
+    def get(self, company, period, data, metrics, version, title=None, fmt="png"):
+        """取得圖檔 bytes (未命中快取時在 worker 中繪製並等待完成)"""
+        return self.submit(company, period, data, metrics, version, title, fmt).result()
+
+    def cache_info(self):
+        with self._lock:
+            return {**self.stats, "render_ms": round(self.stats["render_ms"], 1), "entries": len(self._cache),
+                    "bytes": sum(len(v) for v in self._cache.values())}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+_chart_service = None
+_chart_service_lock = threading.Lock()
+
+
+def get_chart_service():
+    """取得全域共用的 ChartService"""
+    global _chart_service
+    if _chart_service is None:
+        with _chart_service_lock:
+            if _chart_service is None:
+                _chart_service = ChartService()
+    return _chart_service
@@ -0,0 +1,223 @@
+import atexit
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from langgraph.checkpoint.memory import MemorySaver
+from config import (CHECKPOINT_PATH, CHECKPOINT_KEEP_LAST, CHECKPOINT_FLUSH_INTERVAL,
+                    CHECKPOINT_IDLE_TIMEOUT, CHECKPOINT_TTL)
+
+logger = logging.getLogger(__name__)
+
+
+def session_thread_id(username, session_id):
+    """對話的 thread id 由登入的使用者與瀏覽器 session 決定，不同使用者 / 分頁的對話狀態互不相通"""
+    return f"{username or 'anonymous'}:{session_id}"
+
+
+def new_thread_id():
+    """沒有 session 的呼叫 (批次、測試) 各自使用新的 thread"""
+    return session_thread_id(None, uuid.uuid4().hex)
+
+
+class CompactingSaver(MemorySaver):
+    """以記憶體為主的 checkpointer：
+    - 每個對話只保留最後 keep_last 個 checkpoint (連同不再被引用的 channel 值與 pending writes)
+    - 有變動的對話每 flush_interval 秒批次寫入 SQLite (一個對話一列)，重啟後第一次使用時載回記憶體
+    - 閒置超過 idle_timeout 的對話移出記憶體，超過 ttl 的對話從 SQLite 刪除"""
+
+    def __init__(self, path=CHECKPOINT_PATH, keep_last=CHECKPOINT_KEEP_LAST, flush_interval=CHECKPOINT_FLUSH_INTERVAL,
+                 idle_timeout=CHECKPOINT_IDLE_TIMEOUT, ttl=CHECKPOINT_TTL, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep_last = max(1, keep_last)
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._db_lock = threading.Lock()
+        self._last_seen = {}  # 在記憶體中的對話 -> 最後使用時間
+        self._thread_keys = defaultdict(lambda: {"writes": set(), "blobs": set()})
+        self._dirty = set()
+        self._deleted = set()
+        self.stats = {"compacted_checkpoints": 0, "evicted_threads": 0, "loaded_threads": 0, "flushes": 0}
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS checkpoint_threads "
+                               "(thread_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)")
+            self._conn.commit()
+        self._stop = threading.Event()
+        if flush_interval:
+            threading.Thread(target=self._flush_loop, args=(flush_interval,), daemon=True).start()
+        atexit.register(self.close)
+
+    # ---- 記憶體中的對話 ----
+    def _touch(self, thread_id):
+        if thread_id not in self._last_seen:
+            self._load_thread(thread_id)
+        self._last_seen[thread_id] = time.monotonic()
+
+    def _load_thread(self, thread_id):
+        if self._conn is None:
+            return
+        with self._db_lock:
+            row = self._conn.execute("SELECT data FROM checkpoint_threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return
+        data = pickle.loads(row[0])
+        for checkpoint_ns, checkpoints in data["storage"].items():
+            self.storage[thread_id][checkpoint_ns].update(checkpoints)
+        self.writes.update(data["writes"])
+        self.blobs.update(data["blobs"])
+        self._thread_keys[thread_id] = {"writes": set(data["writes"]), "blobs": set(data["blobs"])}
+        self.stats["loaded_threads"] += 1
+
+    def _thread_data(self, thread_id):
+        keys = self._thread_keys[thread_id]
+        return {
+            "storage": {ns: dict(checkpoints) for ns, checkpoints in self.storage.get(thread_id, {}).items() if checkpoints},
+            "writes": {k: dict(self.writes[k]) for k in keys["writes"] if k in self.writes},
+            "blobs": {k: self.blobs[k] for k in keys["blobs"] if k in self.blobs},
+        }
+
+    def _drop_from_memory(self, thread_id):
+        self.storage.pop(thread_id, None)
+        keys = self._thread_keys.pop(thread_id, {"writes": (), "blobs": ()})
+        for k in keys["writes"]:
+            self.writes.pop(k, None)
+        for k in keys["blobs"]:
+            self.blobs.pop(k, None)
+        self._last_seen.pop(thread_id, None)
+
+    def _compact(self, thread_id, checkpoint_ns):
+        """只保留最後 keep_last 個 checkpoint；較舊的 checkpoint、它們的 pending writes，
+        以及版本比保留下來最舊的 checkpoint 還舊的 channel 值一併刪除"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return
+        ids = sorted(checkpoints)
+        keep_from = ids[-self.keep_last]
+        oldest_versions = self.serde.loads_typed(checkpoints[keep_from][0])["channel_versions"]
+        keys = self._thread_keys[thread_id]
+        for checkpoint_id in ids[:-self.keep_last]:
+            del checkpoints[checkpoint_id]
+            write_key = (thread_id, checkpoint_ns, checkpoint_id)
+            self.writes.pop(write_key, None)
+            keys["writes"].discard(write_key)
+        for key in [k for k in keys["blobs"] if k[1] == checkpoint_ns and k[2] in oldest_versions]:
+            kept = oldest_versions[key[2]]
+            # channel 版本在同一個對話中單調遞增，比最舊的保留版本還舊的值已不會被讀取
+            if type(key[3]) is type(kept) and key[3] < kept:
+                self.blobs.pop(key, None)
+                keys["blobs"].discard(key)
+        self.stats["compacted_checkpoints"] += len(ids) - self.keep_last
+
+    # ---- BaseCheckpointSaver ----
+    def get_tuple(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            return iter(list(super().list(config, filter=filter, before=before, limit=limit)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._touch(thread_id)
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            self._thread_keys[thread_id]["blobs"].update(
+                (thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items())
+            self._compact(thread_id, checkpoint_ns)
+            self._dirty.add(thread_id)
+            return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._touch(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+            self._thread_keys[thread_id]["writes"].add(
+                (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"]))
+            self._dirty.add(thread_id)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._drop_from_memory(thread_id)
+            self._dirty.discard(thread_id)
+            self._deleted.add(thread_id)
+
+    # ---- 批次寫入與過期 ----
+    def flush(self):
+        """把有變動的對話一次寫入 SQLite，再把閒置的對話移出記憶體、刪除過期的對話"""
+        with self._lock:
+            dirty = {thread_id: pickle.dumps(self._thread_data(thread_id), protocol=pickle.HIGHEST_PROTOCOL)
+                     for thread_id in self._dirty}
+            deleted = list(self._deleted)
+            self._dirty.clear()
+            self._deleted.clear()
+
+        now = time.time()
+        if self._conn is not None and (dirty or deleted):
+            with self._db_lock, self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO checkpoint_threads (thread_id, data, updated_at) "
+                                       "VALUES (?, ?, ?)", [(t, data, now) for t, data in dirty.items()])
+                self._conn.executemany("DELETE FROM checkpoint_threads WHERE thread_id = ?", [(t,) for t in deleted])
+            self.stats["flushes"] += 1
+
+        if self.idle_timeout is not None:
+            deadline = time.monotonic() - self.idle_timeout
+            with self._lock:
+                # 寫入之後又有變動的對話留到下一次 flush 再移出
+                idle = [t for t, seen in self._last_seen.items() if seen < deadline and t not in self._dirty]
+                for thread_id in idle:
+                    self._drop_from_memory(thread_id)
+                self.stats["evicted_threads"] += len(idle)
+        if self._conn is not None and self.ttl is not None:
+            with self._db_lock, self._conn:
+                self._conn.execute("DELETE FROM checkpoint_threads WHERE updated_at < ?", (now - self.ttl,))
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Checkpoint flush failed: %s", e)
+
+    def close(self):
+        self._stop.set()
+        if self._conn is not None:
+            self.flush()
+
+    def memory_stats(self):
+        with self._lock:
+            return {
+                "threads_in_memory": len(self._last_seen),
+                "checkpoints_in_memory": sum(len(cps) for ns in self.storage.values() for cps in ns.values()),
+                "blobs_in_memory": len(self.blobs),
+                "pending_threads": len(self._dirty),
+                **self.stats,
+            }
+
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer():
+    """所有 Agent 共用的 checkpointer (thread id 已區分對話)，第一次使用時建立"""
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                _checkpointer = CompactingSaver()
+    return _checkpointer
@@ -7,6 +7,30 @@ BUCKET = "tsmccareerhack2025-bsid-grp2-bucket"
 BUCKET_URI = f"gs://{BUCKET}"
 INDEX_ID = "4438785615936356352"
 ENDPOINT_ID = "2966706672111714304"
+RAG_MAX_WORKERS = 4          # 同時執行的 RAG 子查詢上限
+RAG_TOP_K = 10               # 每個子查詢檢索的 chunk 數
+FINAL_CONTEXT_TOKEN_BUDGET = 6000  # 最終回答 prompt 中工具結果的 token 上限 (本地估算)
+RAG_SUBQUERY_TIMEOUT = 60    # 單一 RAG 子查詢逾時秒數 (None 表示不限制)
+SQL_QUERY_TIMEOUT = 120      # 批次執行時單一 SQL 問句 (含 ReAct agent) 的逾時秒數 (None 表示不限制)
+VECTOR_BACKEND = "vertex"    # "vertex": Vertex AI Vector Search；"local": 本地 IVF 索引 (可離線)
+LOCAL_INDEX_PATH = ".cache/local_index"
+LOCAL_INDEX_N_PROBE = 8                  # IVF 每次探測的 list 數
+LOCAL_INDEX_BRUTE_FORCE_THRESHOLD = 4096  # 過濾後候選數低於此值時直接暴力搜尋
+EMBEDDING_CACHE_SIZE = 50000         # query 向量快取筆數上限 (LRU)
+EMBEDDING_CACHE_MMAP_PATH = ".cache/query_embeddings"  # 以 memmap 存到磁碟；None 表示只放記憶體
+EMBEDDING_CACHE_SAVE_EVERY = 256     # 每新增這麼多筆向量就把 key 索引寫回磁碟 (process 被中止時最多損失這些)
+TRANSCRIPT_DIR = "Transcript File"               # 法說會逐字稿 (.txt) 目錄，python ingest.py 匯入
+INGEST_MANIFEST_PATH = ".cache/ingest_manifest.json"  # 已匯入檔案的內容 hash，重新執行時只處理新增 / 變更的檔案
+INGEST_OFFLINE_INDEX_PATH = ".cache/offline/local_index"  # --offline (hash embedding) 使用的索引與 manifest，不會動到正式索引
+INGEST_OFFLINE_MANIFEST_PATH = ".cache/offline/ingest_manifest.json"
+INGEST_CHUNK_SIZE = 1000         # 每個 chunk 的字元數
+INGEST_CHUNK_OVERLAP = 200       # 相鄰 chunk 重疊的字元數
+INGEST_EMBED_BATCH_SIZE = 250    # 每次 embedding 呼叫的 chunk 數 (Vertex AI 單次上限 250)
+# 財年季度 -> 日曆季度的位移 (季)；檔名中的季度為財年季度，例如 Apple FY2022 Q1 = 2021 Q4
+FISCAL_QTR_OFFSET = {
+    "Apple": -1, "Microsoft": -2, "Nvidia": -4, "Marvell": -4, "Cirrus Logic": -3,
+    "Microchip": -3, "Qualcomm": -1, "KLA": -2, "Western Digital": -2,
+}
 
 # ✅ 資料庫設定
 DB_HOST = "34.56.145.52"  
@@ -16,10 +40,62 @@ DATABASE = "postgres"
 # TABLE_NAME = "fin_data" 
 _USER = "postgres"
 _PASSWORD = "postgres"
+METRIC_CUBE_TABLE = "fin_metric_cube"            # 預先計算 QoQ / YoY 與利潤率的指標立方體
+METRIC_CUBE_ENABLED = True
+METRIC_CUBE_REFRESH_INTERVAL = 900               # 秒，背景增量更新 cube 的間隔
+DB_POOL_SIZE = 5        # 常駐連線數
+DB_MAX_OVERFLOW = 10    # 尖峰時可額外建立的連線數
+DB_POOL_TIMEOUT = 30    # 秒，連線池用盡時的最長等待時間
+DB_POOL_RECYCLE = 1800  # 秒，超過此時間的連線會重新建立
+SCHEMA_TABLES = ["fin_data"] + ([METRIC_CUBE_TABLE] if METRIC_CUBE_ENABLED else [])  # 放進 SQL agent prompt 的資料表 (尚未建立的會略過)
+SCHEMA_CACHE_PATH = ".cache/schema_snapshot.json"
+SCHEMA_VERSION_CHECK_INTERVAL = 600              # 秒，背景比對 schema 版本的間隔
+REPORT_CACHE_PATH = ".cache/reports.sqlite"      # Report Mode 預先計算的報表
+REPORT_REFRESH_INTERVAL = 900                    # 秒，背景比對 fin_data 資料指紋、增量更新報表的間隔
+REPORT_METRICS = ["Revenue", "Cost of Goods Sold", "Operating Income", "Operating Expense", "Tax Expense", "Total Asset"]
+CHART_CACHE_SIZE = 256       # Report Mode 圖檔快取張數 (LRU)
+CHART_WORKERS = 2            # 繪圖 worker 數
+CHART_DPI = 100
+
+# ✅ 各角色可查看的公司
+COMPANY_OPTIONS = {
+    "KR": ["Samsung"],
+    "CN": ["Baidu", "Tencent"],
+    "GB": ["Amazon","AMD","Amkor","Apple","Applied Material","Baidu","Broadcom","Cirrus Logic","Google","Himax","Intel","KLA","Marvell","Microchip","Microsoft","Nvidia","ON Semi","Qorvo","Qualcomm","Samsung","STM","Tencent","Texas Instruments","TSMC","Western Digital"]
+}
+
+
+# ✅ LLM 回應快取設定
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = ".cache/llm_cache.sqlite"
+LLM_CACHE_MAX_SIZE = 10000       # SQLite 最多保存筆數
+LLM_CACHE_MEMORY_SIZE = 512      # 記憶體 LRU 筆數
+LLM_CACHE_TTL = 7 * 24 * 3600    # 秒，None 表示永不過期
 
 
 # model 設定
 MODEL_NAME = "gemini-1.5-pro"
 MODEL_PROVIDER = "google_vertexai"
 EMBEDDING_MODEL_NAME = "text-embedding-005"
+EMBEDDING_DIM = 768                  # EMBEDDING_MODEL_NAME 的向量維度 (query 快取載入時比對)
+BATCH_MAX_CONCURRENCY = 8     # Agent.run_batch 每個階段同時進行的 LLM / 工具呼叫上限
+
+
+
+# ✅ 追蹤 / 監控設定
+LOG_LEVEL = "INFO"
+TRACING_ENABLED = False
+TRACE_JSONL_PATH = ".cache/traces.jsonl"      # 每個 span 一行 JSON
+TRACE_METRICS_PATH = ".cache/metrics.prom"    # Prometheus text format，flush 時更新
+TRACE_METRICS_PORT = None                     # 設定後以 HTTP 提供 /metrics
+TRACE_FLUSH_EVERY = 100                       # 累積多少個 span 寫入一次檔案
+
 
+# ✅ 對話狀態 (checkpoint) 設定
+CHECKPOINT_PATH = ".cache/checkpoints.sqlite"  # None 表示只放在記憶體
+CHECKPOINT_KEEP_LAST = 3                       # 每個對話保留的 checkpoint 數
+CHECKPOINT_FLUSH_INTERVAL = 5                  # 秒，批次寫入 SQLite 的間隔
+CHECKPOINT_IDLE_TIMEOUT = 1800                 # 秒，閒置超過此時間的對話移出記憶體 (仍保存在 SQLite)
+CHECKPOINT_TTL = 7 * 24 * 3600                 # 秒，閒置超過此時間的對話從 SQLite 刪除
+CARRIED_STATE_MAX_BYTES = 4096                 # 跨輪保留的對話狀態上限 (前幾輪壓縮成的事實摘要、待補充的問句等)
+HISTORY_FACT_MAX_CHARS = 240                   # 摘要中每一行事實的字元上限
@@ -0,0 +1,161 @@
+import math
+import re
+from config import FINAL_CONTEXT_TOKEN_BUDGET
+
+_CJK_RE = re.compile(r"[　-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+_WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """本地 token 估算：中日韓文字約 1 字 1 token，其餘約 4 個字元 1 token (不需呼叫 tokenizer API)"""
+    text = str(text)
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """截斷到估算 token 數不超過 max_tokens 的最長前綴 (以二分搜尋找長度，截斷時結尾加上 …)"""
+    text = str(text)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid] + "…") <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + "…" if low else ""
+
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+def _label(entry):
+    filters = entry.get("filters") or {}
+    parts = [str(v) for v in (filters.get("Company Name"), filters.get("CALENDAR_YEAR"), filters.get("CALENDAR_QTR")) if v]
+    return f"[{' '.join(parts)}] " if parts else ""
+
+
+def legacy_render(entry):
+    """舊版 tool_results 的字串形式 (整個結果 dict 的 repr，含重複的 source_documents)，用來計算節省的 token"""
+    if entry.get("error"):
+        return f"{entry['tool']} tool reponse : [{entry.get('query')}] failed: {entry['error']}"
+    if entry["tool"] != "RAG_Search":
+        return f"{entry['tool']} tool reponse : {entry.get('answer')}"
+    sources, metadata = entry.get("sources", []), entry.get("metadata", [])
+    documents = [f"Document(metadata={m}, page_content={s!r})" for s, m in zip(sources, metadata)]
+    raw = {"answer": entry.get("answer"), "sources": sources, "metadata": metadata,
+           "source_documents": documents, "extracted_info": entry.get("filters")}
+    return f"{entry['tool']} tool reponse : {raw}"
+
+
+def _ranked_chunks(query, entries):
+    """各子查詢的 chunk 依相關度排序後交錯合併 (每個子查詢輪流取一個)，跨子查詢去除重複"""
+    query_terms = set(_WORD_RE.findall(query.lower()))
+    per_query = []
+    for entry in entries:
+        chunks = []
+        for rank, (text, metadata) in enumerate(zip(entry.get("sources", []), entry.get("metadata", []))):
+            terms = set(_WORD_RE.findall(text.lower()))
+            overlap = len(query_terms & terms) / len(query_terms) if query_terms else 0.0
+            # 檢索排名為主，與使用者問題的字詞重疊為輔
+            chunks.append((1.0 / (rank + 1) + 0.1 * overlap, text, metadata))
+        chunks.sort(key=lambda c: -c[0])
+        per_query.append(chunks)
+
+    seen, ranked = set(), []
+    for depth in range(max((len(c) for c in per_query), default=0)):
+        for chunks in per_query:
+            if depth < len(chunks):
+                score, text, metadata = chunks[depth]
+                key = _normalize(text)
+                if key not in seen:
+                    seen.add(key)
+                    ranked.append((text, metadata))
+    total = sum(len(c) for c in per_query)
+    return ranked, total
+
+
+def build_context(query, tool_results, budget=FINAL_CONTEXT_TOKEN_BUDGET, history=None):
+    """把 tool_results 組成 FINAL_GENERATE_PROMPT 的內容：前幾輪的事實摘要 (history)、SQL 結果與各子查詢的回答優先，
+    再依相關度放入去重後的法說會原文，直到 token 預算用完；超出剩餘預算的第一個回答截斷後放入，不整段捨棄。
+    回傳 (context, report)"""
+    sections, used = [], 0
+
+    def _add(text, truncate=False):
+        nonlocal used
+        tokens = estimate_tokens(text) + 1
+        if used + tokens > budget:
+            if not truncate:
+                return False
+            text = truncate_to_tokens(text, budget - used - 1)
+            if not text:
+                return False
+            tokens = estimate_tokens(text) + 1
+        sections.append(text)
+        used += tokens
+        return True
+
+    if history:
+        _add("### Earlier in this conversation")
+        _add(history, truncate=True)
+    sql_entries = [e for e in tool_results if e["tool"] != "RAG_Search"]
+    rag_entries = [e for e in tool_results if e["tool"] == "RAG_Search"]
+    if sql_entries:
+        _add("### SQL results")
+        for entry in sql_entries:
+            _add(f"- {entry['query']}: failed: {entry['error']}" if entry.get("error") else f"- {entry['answer']}",
+                 truncate=True)
+    if rag_entries:
+        _add("### Earnings call answers")
+        for entry in rag_entries:
+            answer = f"failed: {entry['error']}" if entry.get("error") else entry.get("answer", "")
+            _add(f"- {_label(entry)}{entry['query']}: {answer}", truncate=True)
+
+    chunks, total_chunks = _ranked_chunks(query, [e for e in rag_entries if not e.get("error")])
+    used_chunks = 0
+    if chunks and _add("### Supporting transcript excerpts"):
+        for text, metadata in chunks:
+            source = ", ".join(str(metadata.get(k)) for k in ("Company Name", "CALENDAR_YEAR", "CALENDAR_QTR")
+                               if metadata.get(k) is not None)
+            if _add(f"[{used_chunks + 1}] ({source}) {' '.join(str(text).split())}"):
+                used_chunks += 1
+
+    context = "\n".join(sections)
+    before = estimate_tokens("\n".join(legacy_render(e) for e in tool_results))
+    after = estimate_tokens(context)
+    report = {
+        "tokens_before": before,
+        "tokens_after": after,
+        "tokens_saved": before - after,
+        "chunks_total": total_chunks,
+        "chunks_unique": len(chunks),
+        "chunks_used": used_chunks,
+        "budget": budget,
+    }
+    return context, report
+
+
+# 測試
+if __name__ == "__main__":
+    chunk = "TSMC said N3 demand remained strong and expects AI accelerators to grow strongly next year."
+    results = [
+        {"tool": "sql_db_query", "query": "TSMC revenue 2023 Q2", "answer": "TSMC Revenue in 2023 Q2: USD 15,680 (Million)"},
+        {"tool": "RAG_Search", "query": "What did TSMC say about N3 in 2023 Q2?", "answer": "N3 demand remained strong.",
+         "sources": [chunk, "Gross margin was 54.1%."], "filters": {"Company Name": "TSMC", "CALENDAR_YEAR": "2023", "CALENDAR_QTR": "Q2"},
+         "metadata": [{"Company Name": "TSMC", "CALENDAR_YEAR": 2023, "CALENDAR_QTR": "Q2"}] * 2},
+        {"tool": "RAG_Search", "query": "What did TSMC say about AI in 2023 Q2?", "answer": "AI accelerators will grow.",
+         "sources": [chunk], "filters": {"Company Name": "TSMC", "CALENDAR_YEAR": "2023", "CALENDAR_QTR": "Q2"},
+         "metadata": [{"Company Name": "TSMC", "CALENDAR_YEAR": 2023, "CALENDAR_QTR": "Q2"}]},
+    ]
+    context, report = build_context("What did TSMC say about N3 and AI in 2023 Q2?", results)
+    print(context)
+    print(report)
+
+    # 超出預算的回答截斷後保留，不會整段消失
+    oversized = [{"tool": "sql_db_query", "query": "TSMC revenue 2015-2024", "answer": "TSMC quarterly revenue: " + "USD 15,680 (Million); " * 400}]
+    context, report = build_context("TSMC revenue 2015-2024", oversized, budget=200)
+    assert report["tokens_after"] <= 200 and context.startswith("### SQL results\n- TSMC quarterly revenue") and context.endswith("…"), report
+    print(report)
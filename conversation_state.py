@@ -0,0 +1,84 @@
+import json
+from config import CARRIED_STATE_MAX_BYTES, HISTORY_FACT_MAX_CHARS
+
+# ✅ 每一輪重新產生的欄位：新的一輪開始時清空，回合結束後也不帶到下一輪
+PER_TURN_KEYS = ("tools", "tool_results", "sql_query", "direct_answer", "rag_queries")
+# ✅ 跨輪保留的欄位：總大小受 CARRIED_STATE_MAX_BYTES 限制
+CARRIED_KEYS = ("history_summary", "adjusted_query", "is_first", "is_fiscal", "is_usd", "turn")
+
+
+def size_bytes(value):
+    """以 JSON (UTF-8) 計算的大小，與 checkpoint / session 中實際保存的內容相近"""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _clip(text, max_chars=HISTORY_FACT_MAX_CHARS):
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars - 1].rstrip() + "…"
+
+
+def _first_sentence(text):
+    text = " ".join(str(text).split())
+    for mark in (". ", "。", "! ", "? "):
+        if mark in text:
+            return text[:text.index(mark) + len(mark)].strip()
+    return text
+
+
+def turn_facts(turn, query, final_answer, tool_results):
+    """把一輪問答壓縮成幾行事實：問題與回答的第一句，以及 SQL 查到的數值 (不保留 RAG 原文)"""
+    facts = [_clip(f"Q{turn}: {query} -> {_first_sentence(final_answer)}")]
+    for entry in tool_results or []:
+        if entry.get("tool") != "RAG_Search" and not entry.get("error") and entry.get("answer"):
+            facts.append(_clip(f"Q{turn} data: {entry['answer']}"))
+    return facts
+
+
+def compact_history(history, facts, max_bytes=CARRIED_STATE_MAX_BYTES // 2):
+    """新的事實接在摘要後面；重複的事實只留最新的一筆，超過 max_bytes 時從最舊的開始捨棄"""
+    lines = [line for line in (history or "").splitlines() if line] + list(facts)
+    kept, seen, used = [], set(), 0
+    for line in reversed(lines):
+        key = line.split(": ", 1)[-1]
+        size = size_bytes(line) + 1
+        if key in seen or used + size > max_bytes:
+            continue
+        seen.add(key)
+        kept.append(line)
+        used += size
+    return "\n".join(reversed(kept))
+
+
+def clip_followup(text, max_bytes=CARRIED_STATE_MAX_BYTES // 4):
+    """需要使用者補充資訊時累積的問句：保留第一行 (原始問題) 與最近的補充，不超過 max_bytes"""
+    lines = [line for line in str(text).splitlines() if line.strip()]
+    if not lines or size_bytes(text) <= max_bytes:
+        return text
+    head, kept, used = lines[0], [], size_bytes(lines[0])
+    for line in reversed(lines[1:]):
+        used += size_bytes(line) + 1
+        if used > max_bytes:
+            break
+        kept.append(line)
+    return "\n".join([head] + list(reversed(kept)))
+
+
+def carried_state(state):
+    """下一輪會帶入的狀態 (app 存在 session 中、checkpoint 保留的部分)"""
+    return {key: state[key] for key in CARRIED_KEYS if key in state}
+
+
+def state_report(state):
+    """對話狀態的大小報告：整體、跨輪保留的部分與各欄位的 bytes"""
+    fields = {key: size_bytes(value) for key, value in state.items() if value not in (None, "", [], {})}
+    carried = carried_state(state)
+    return {
+        "turn": state.get("turn", 0),
+        "state_bytes": size_bytes(state),
+        "carried_bytes": size_bytes(carried),
+        "carried_limit_bytes": CARRIED_STATE_MAX_BYTES,
+        "history_facts": len([line for line in (state.get("history_summary") or "").splitlines() if line]),
+        "fields": dict(sorted(fields.items(), key=lambda kv: -kv[1])),
+    }
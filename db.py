@@ -0,0 +1,154 @@
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from config import (DB_HOST, DB_PORT, DATABASE, _USER, _PASSWORD,
+                    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE)
+
+db_url = f'postgresql+psycopg2://{_USER}:{_PASSWORD}@{DB_HOST}:{DB_PORT}/{DATABASE}'
+async_db_url = f'postgresql+asyncpg://{_USER}:{_PASSWORD}@{DB_HOST}:{DB_PORT}/{DATABASE}'
+
+
+class PoolMetrics:
+    """連線池等待時間與飽和度統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self):
+        """目前的計數 (一致的快照)"""
+        with self._lock:
+            return {"checkouts": self.checkouts, "timeouts": self.timeouts,
+                    "wait_total": self.wait_total, "wait_max": self.wait_max}
+
+
+pool_stats = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    """記錄每次取得連線所花等待時間的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record(time.perf_counter() - start)
+        return conn
+
+
+def make_engine(url=db_url):
+    """建立有上限的連線池：pre-ping 檢查失效連線、定期 recycle、限制 overflow"""
+    return create_engine(
+        url,
+        poolclass=MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+# ✅ app 與 SQL tool 共用的連線池
+engine = make_engine()
+
+_async_engine = None
+_async_engine_lock = threading.Lock()
+
+
+def get_async_engine(url=async_db_url):
+    """async 查詢路徑 (asyncpg) 使用的連線池，第一次使用時才建立；連線池設定與同步 engine 相同"""
+    global _async_engine
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import create_async_engine
+                _async_engine = create_async_engine(
+                    url,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=True,
+                )
+    return _async_engine
+
+# ✅ 登入 / 註冊使用的 prepared statements：某條連線第一次執行時才 PREPARE，
+# SQL tool 使用的連線不必負擔，users 資料表有問題時也只影響登入 / 註冊
+PREPARED_STATEMENTS = {
+    "auth_select_user": ("(text)", "SELECT password, role FROM users WHERE username = $1"),
+    "auth_insert_user": ("(text, text, text)", "INSERT INTO users (username, password, role) VALUES ($1, $2, $3)"),
+}
+
+
+def _execute_prepared(conn, name, params):
+    """在這條連線上執行 prepared statement；連線的 info 記錄已 PREPARE 的名稱 (與實體連線同生命週期)"""
+    prepared = conn.info.setdefault("prepared_statements", set())
+    if name not in prepared:
+        arg_types, sql = PREPARED_STATEMENTS[name]
+        conn.exec_driver_sql(f"PREPARE {name} {arg_types} AS {sql}")
+        prepared.add(name)
+    return conn.exec_driver_sql(f"EXECUTE {name}({', '.join(['%s'] * len(params))})", tuple(params))
+
+
+@contextmanager
+def get_connection():
+    """每個請求各自從連線池取得連線，用完歸還；離開時自動 commit，發生例外則 rollback"""
+    with engine.begin() as conn:
+        yield conn
+
+
+def fetch_user(username):
+    """回傳 (hashed_password, role)；使用者不存在時回傳 None"""
+    with get_connection() as conn:
+        return _execute_prepared(conn, "auth_select_user", (username,)).first()
+
+
+def insert_user(username, hashed_password, role):
+    """新增使用者；帳號重複時拋出 sqlalchemy.exc.IntegrityError"""
+    with get_connection() as conn:
+        _execute_prepared(conn, "auth_insert_user", (username, hashed_password, role))
+
+
+def pool_metrics():
+    """連線池狀態：大小、使用中連線、飽和度與等待時間"""
+    pool = engine.pool
+    capacity = pool.size() + DB_MAX_OVERFLOW
+    stats = pool_stats.snapshot()
+    checkouts = stats["checkouts"]
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": pool.checkedout() / capacity if capacity else 0.0,
+        "checkouts": checkouts,
+        "timeouts": stats["timeouts"],
+        "wait_avg_ms": stats["wait_total"] / checkouts * 1000 if checkouts else 0.0,
+        "wait_max_ms": stats["wait_max"] * 1000,
+    }
+
+
+# 測試
+if __name__ == "__main__":
+    with get_connection() as conn:
+        print(conn.execute(text("SELECT 1")).scalar())
+    print(pool_metrics())
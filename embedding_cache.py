@@ -0,0 +1,203 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_MMAP_PATH, EMBEDDING_CACHE_SAVE_EVERY
+
+
+def normalize_text(text):
+    """快取 key 用的正規化：去除前後空白、合併連續空白、轉小寫"""
+    return " ".join(str(text).split()).lower()
+
+
+def key_fingerprint(key, model_name=""):
+    """快取 key 的 64-bit 指紋 (跨 process 固定，包含模型名稱；0 保留給空的 row)"""
+    digest = hashlib.blake2b("\0".join((model_name or "",) + tuple(key)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True) or 1
+
+
+class CachedEmbeddings(Embeddings):
+    """在 embedding model 前加上 query 向量快取：以正規化文字為 key，向量存成 float32 矩陣，LRU 淘汰，未命中者合併成批次呼叫。
+    文件 (embed_documents) 不進快取，匯入大量文件時不會把常用的 query 向量擠掉。
+    磁碟上的快取記錄模型名稱與維度，換了模型 (或維度) 時不載入舊的向量"""
+
+    def __init__(self, base, max_size=EMBEDDING_CACHE_SIZE, mmap_path=EMBEDDING_CACHE_MMAP_PATH,
+                 save_every=EMBEDDING_CACHE_SAVE_EVERY, model_name=None, dim=None):
+        self.base = base
+        self.model_name = model_name or getattr(base, "model_name", None) or type(base).__name__
+        self.dim = dim or getattr(base, "dim", None)  # None 表示由第一個向量決定
+        self.max_size = max_size
+        self.mmap_path = mmap_path
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._slots = OrderedDict()  # (kind, normalized text) -> row index
+        self._free = []
+        self._matrix = None
+        self._row_keys = None  # 每個 row 目前存放的 key 指紋，載入時用來排除索引寫入後被覆寫的 row
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if mmap_path:
+            self._load()
+            atexit.register(self.save)
+
+    # ---------- 儲存 ----------
+    def _allocate(self, dim):
+        if self.mmap_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.mmap_path)), exist_ok=True)
+            self._matrix = np.memmap(self.mmap_path + ".f32", dtype=np.float32, mode="w+",
+                                     shape=(self.max_size, dim))
+            self._row_keys = np.memmap(self.mmap_path + ".keys", dtype=np.int64, mode="w+", shape=(self.max_size,))
+        else:
+            self._matrix = np.zeros((self.max_size, dim), dtype=np.float32)
+            self._row_keys = np.zeros(self.max_size, dtype=np.int64)
+        self._free = list(range(self.max_size - 1, -1, -1))
+
+    def _load(self):
+        index_path = self.mmap_path + ".json"
+        if not all(os.path.exists(self.mmap_path + ext) for ext in (".json", ".f32", ".keys")):
+            return
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if (index["max_size"] != self.max_size or index.get("model") != self.model_name
+                or (self.dim is not None and index["dim"] != self.dim)):
+            return  # 容量、模型或維度改變就重新建立快取
+        self._matrix = np.memmap(self.mmap_path + ".f32", dtype=np.float32, mode="r+",
+                                 shape=(self.max_size, index["dim"]))
+        self._row_keys = np.memmap(self.mmap_path + ".keys", dtype=np.int64, mode="r+", shape=(self.max_size,))
+        used = set()
+        for kind, text, row in index["slots"]:
+            # 索引寫入之後 row 可能已被淘汰並存入別的向量 (之後 process 被中止)，指紋不符的 row 不能使用
+            if self._row_keys[row] == key_fingerprint((kind, text), self.model_name):
+                self._slots[(kind, text)] = row
+                used.add(row)
+        self._free = [row for row in range(self.max_size - 1, -1, -1) if row not in used]
+
+    def save(self):
+        """將 memmap 向量與 key 索引寫回磁碟 (只在設定 mmap_path 時有效)"""
+        if not self.mmap_path or self._matrix is None:
+            return
+        with self._lock:
+            self._matrix.flush()
+            self._row_keys.flush()
+            index = {
+                "max_size": self.max_size,
+                "model": self.model_name,
+                "dim": int(self._matrix.shape[1]),
+                "slots": [[kind, text, row] for (kind, text), row in self._slots.items()],
+            }
+            self._unsaved = 0
+        # 先寫暫存檔再替換，寫到一半被中止也不會留下損壞的索引
+        tmp = self.mmap_path + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, self.mmap_path + ".json")
+
+    def _get(self, key):
+        row = self._slots.get(key)
+        if row is None:
+            return None
+        self._slots.move_to_end(key)
+        return self._matrix[row]
+
+    def _put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            # 模型回傳的維度與快取不同 (未指定 dim 時載入了舊模型的快取)：捨棄舊的向量
+            self._slots.clear()
+            self._allocate(vector.shape[0])
+        row = self._slots.pop(key, None)
+        if row is None:
+            if not self._free:
+                _, row = self._slots.popitem(last=False)  # 淘汰最久未使用的向量
+            else:
+                row = self._free.pop()
+        self._row_keys[row] = 0  # 先標記為空，寫入向量後才記錄新的指紋
+        self._matrix[row] = vector
+        self._row_keys[row] = key_fingerprint(key, self.model_name)
+        self._slots[key] = row
+        self._unsaved += 1
+
+    # ---------- 查詢 ----------
+    def _embed_cached(self, kind, texts, embed_batch):
+        keys = [(kind, normalize_text(t)) for t in texts]
+        results = [None] * len(texts)
+        missing = OrderedDict()  # key -> 原始文字 (同一批內重複的文字只送一次)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._get(key)
+                if vector is not None:
+                    results[i] = vector.tolist()
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, texts[i])
+                    self.misses += 1
+
+        if missing:
+            # ✅ 所有未命中的文字合併成一次批次 embed 呼叫
+            vectors = embed_batch(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                for key, vector in fresh.items():
+                    self._put(key, vector)
+                save = self.mmap_path and self._unsaved >= self.save_every
+            if save:
+                # 定期把 key 索引寫回磁碟，不只依賴 atexit (process 被 SIGKILL 時 atexit 不會執行)
+                self.save()
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = list(fresh[key])
+        return results
+
+    def _embed_query_batch(self, texts):
+        if hasattr(self.base, "embed"):
+            # VertexAIEmbeddings：以 RETRIEVAL_QUERY task type 一次送出多筆 query
+            return self.base.embed(texts, embeddings_task_type="RETRIEVAL_QUERY")
+        return [self.base.embed_query(t) for t in texts]
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_queries(self, texts):
+        """批次 embed 多筆 query，未命中者合併成一次呼叫"""
+        return self._embed_cached("query", texts, self._embed_query_batch)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._slots),
+                "bytes": int(self._matrix.nbytes) if self._matrix is not None else 0,
+            }
+
+
+# 測試
+if __name__ == "__main__":
+    class FakeEmbeddings(Embeddings):
+        def __init__(self):
+            self.calls = 0
+
+        def embed_documents(self, texts):
+            self.calls += 1
+            return [[float(len(t)), 1.0, 0.0] for t in texts]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    fake = FakeEmbeddings()
+    cached = CachedEmbeddings(fake, max_size=2, mmap_path=None)
+    cached.embed_queries(["Apple 2021 Q2", "TSMC 2022 Q3", "apple   2021 q2"])
+    cached.embed_query("Apple 2021 Q2")
+    cached.embed_query("AMD 2022 Q4")  # 淘汰 TSMC
+    cached.embed_query("TSMC 2022 Q3")
+    print("embed calls:", fake.calls, cached.stats())
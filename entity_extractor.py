@@ -0,0 +1,130 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from config import COMPANY_OPTIONS
+
+# ✅ 公司名稱 gazetteer：正式名稱 (與 COMPANY_OPTIONS、向量資料庫的 Company Name 一致) -> 常見說法 / 股票代號
+COMPANY_ALIASES = {
+    "Amazon": ["amazon", "amazon.com", "aws", "amzn"],
+    "AMD": ["amd", "advanced micro devices"],
+    "Amkor": ["amkor", "amkor technology"],
+    "Apple": ["apple", "aapl"],
+    "Applied Material": ["applied material", "applied materials", "amat"],
+    "Baidu": ["baidu", "bidu", "百度"],
+    "Broadcom": ["broadcom", "avgo"],
+    "Cirrus Logic": ["cirrus logic", "cirrus", "crus"],
+    "Google": ["google", "alphabet", "googl", "goog", "谷歌"],
+    "Himax": ["himax", "himx", "奇景"],
+    "Intel": ["intel", "intc", "英特爾"],
+    "KLA": ["kla", "kla-tencor", "kla corporation", "klac"],
+    "Marvell": ["marvell", "mrvl", "邁威爾"],
+    "Microchip": ["microchip", "mchp"],
+    "Microsoft": ["microsoft", "msft", "微軟"],
+    "Nvidia": ["nvidia", "nvda", "輝達"],
+    "ON Semi": ["on semi", "onsemi", "on semiconductor"],
+    "Qorvo": ["qorvo", "qrvo"],
+    "Qualcomm": ["qualcomm", "qcom", "高通"],
+    "Samsung": ["samsung", "samsung electronics", "三星"],
+    "STM": ["stm", "stmicroelectronics", "st micro", "stmicro"],
+    "Tencent": ["tencent", "騰訊"],
+    "Texas Instruments": ["texas instruments", "txn", "德州儀器"],
+    "TSMC": ["tsmc", "taiwan semiconductor", "taiwan semiconductor manufacturing", "台積電", "台積"],
+    "Western Digital": ["western digital", "wdc", "威騰"],
+}
+# 未列在上面的公司至少以正式名稱辨識
+for _company in COMPANY_OPTIONS["GB"]:
+    COMPANY_ALIASES.setdefault(_company, [_company.lower()])
+
+_CANONICAL_OF = {alias: company for company, aliases in COMPANY_ALIASES.items() for alias in aliases}
+# 英數字別名前後不可緊接英數字 (避免 "intel" 命中 "intelligence")；中文別名不受 \b 限制
+_COMPANY_RE = re.compile(
+    r"(?<![A-Za-z0-9])(" + "|".join(re.escape(a) for a in sorted(_CANONICAL_OF, key=len, reverse=True)) + r")(?![A-Za-z0-9])",
+    re.IGNORECASE,
+)
+
+_ORDINALS = {"first": 1, "1st": 1, "second": 2, "2nd": 2, "third": 3, "3rd": 3, "fourth": 4, "4th": 4,
+             "一": 1, "二": 2, "三": 3, "四": 4, "1": 1, "2": 2, "3": 3, "4": 4}
+# 季度與年份的寫法：2022 Q1 / Q1 2022 / 2022Q1 / Q1'22 / 1Q22 / first quarter of 2022 / 2022年第一季 / FY2022
+_PERIOD_RE = re.compile(
+    r"(?<![A-Za-z0-9])(?:"
+    r"(?P<y1>20\d{2})\s*年?\s*[-/]?\s*Q(?P<q1>[1-4])"
+    r"|Q(?P<q2>[1-4])\s*(?:FY|CY)?\s*[-/']?\s*(?P<y2>20\d{2}|\d{2})(?!\d)"
+    r"|(?P<q3>[1-4])Q\s*'?(?P<y3>20\d{2}|\d{2})(?!\d)"
+    r"|Q(?P<q4>[1-4])"
+    r"|(?P<o1>first|1st|second|2nd|third|3rd|fourth|4th)\s+(?:fiscal\s+|calendar\s+)?quarter(?:\s+(?:of\s+)?(?P<y5>20\d{2}))?"
+    r"|(?:(?P<y6>20\d{2})\s*年\s*)?第\s*(?P<o2>[一二三四1-4])\s*季"
+    r"|(?:FY|CY)\s*'?(?P<y7>20\d{2}|\d{2})"
+    r"|(?P<y4>20\d{2})"
+    r")(?![0-9])",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Entities:
+    companies: List[str] = field(default_factory=list)
+    years: List[int] = field(default_factory=list)
+    quarters: List[str] = field(default_factory=list)  # "Q1" ~ "Q4"
+
+    def is_empty(self):
+        return not (self.companies or self.years or self.quarters)
+
+
+def _year(value):
+    if value is None:
+        return None
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def find_companies(query: str) -> List[str]:
+    """依出現順序回傳 query 中提到的公司 (正式名稱，不重複)"""
+    companies = []
+    for m in _COMPANY_RE.finditer(query):
+        company = _CANONICAL_OF[m.group(1).lower()]
+        if company not in companies:
+            companies.append(company)
+    return companies
+
+
+def find_periods(query: str) -> Tuple[List[int], List[str]]:
+    """回傳 query 中提到的年份與季度 (各自依出現順序、不重複)"""
+    years, quarters = [], []
+    for m in _PERIOD_RE.finditer(query):
+        groups = m.groupdict()
+        year = _year(groups["y1"] or groups["y2"] or groups["y3"] or groups["y4"] or groups["y5"] or groups["y6"]
+                     or groups["y7"])
+        qtr = groups["q1"] or groups["q2"] or groups["q3"] or groups["q4"]
+        ordinal = groups["o1"] or groups["o2"]
+        if ordinal:
+            qtr = _ORDINALS[ordinal.lower()]
+        if year is not None and year not in years:
+            years.append(year)
+        if qtr is not None and f"Q{qtr}" not in quarters:
+            quarters.append(f"Q{qtr}")
+    return years, quarters
+
+
+def extract_entities(query: str) -> Entities:
+    years, quarters = find_periods(query)
+    return Entities(find_companies(query), years, quarters)
+
+
+def extract_filters(query: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """回傳與 rag_search.extract_info_from_query 相同格式的 (Company Name, CALENDAR_YEAR, CALENDAR_QTR)；
+    子查詢只涵蓋單一公司 / 期間，有多個時取第一個"""
+    entities = extract_entities(query)
+    company = entities.companies[0] if entities.companies else None
+    year = str(entities.years[0]) if entities.years else None
+    qtr = entities.quarters[0] if entities.quarters else None
+    return company, year, qtr
+
+
+# 測試
+if __name__ == "__main__":
+    for q in ["What did Taiwan Semiconductor say about N3 demand in 2023 Q2?",
+              "Alphabet 1Q22 earnings call cloud growth",
+              "台積電 2022年第三季 法說會重點",
+              "Summarize the fourth quarter of 2021 call for Advanced Micro Devices",
+              "How is artificial intelligence changing chip demand?"]:
+        print(q, "->", extract_entities(q))
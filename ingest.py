@@ -0,0 +1,250 @@
+"""法說會逐字稿匯入：逐一讀取 .txt 檔，由檔名解析公司 / 財年季度 (轉為日曆季度)，切成重疊的 chunk，
+批次 embedding 後連同 Company Name / CALENDAR_YEAR / CALENDAR_QTR metadata 寫入 config.VECTOR_BACKEND 的向量資料庫。
+
+以檔案內容的 hash 記錄在 manifest 中，重新執行時只處理新增或變更的檔案 (chunk id 由檔名決定，變更的檔案會先刪除舊的 chunk)；
+從目錄中移除的檔案，其 chunk 也會從向量資料庫刪除。
+執行方式 (repo 根目錄)：python ingest.py "Transcript File"
+離線 (本地索引 + hash embedding，不需要 GCP)：python ingest.py "Transcript File" --offline
+離線執行預設寫入 config.INGEST_OFFLINE_INDEX_PATH / INGEST_OFFLINE_MANIFEST_PATH，不會動到正式的索引。
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from entity_extractor import extract_entities
+from config import (TRANSCRIPT_DIR, INGEST_MANIFEST_PATH, INGEST_CHUNK_SIZE, INGEST_CHUNK_OVERLAP,
+                    INGEST_EMBED_BATCH_SIZE, FISCAL_QTR_OFFSET, VECTOR_BACKEND, LOCAL_INDEX_PATH,
+                    EMBEDDING_MODEL_NAME, INGEST_OFFLINE_INDEX_PATH, INGEST_OFFLINE_MANIFEST_PATH)
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def parse_transcript_name(filename):
+    """由檔名 (例如 "Apple Inc. (NASDAQ AAPL) Q3 2021 Earnings Conference Call.txt") 解析公司與日曆年 / 季；
+    檔名中的季度為財年季度，依 FISCAL_QTR_OFFSET 轉換。無法解析時回傳 None"""
+    entities = extract_entities(os.path.splitext(filename)[0])
+    if not (entities.companies and entities.years and entities.quarters):
+        return None
+    company = entities.companies[0]
+    period = entities.years[0] * 4 + int(entities.quarters[0][1]) - 1 + FISCAL_QTR_OFFSET.get(company, 0)
+    return {"Company Name": company, "CALENDAR_YEAR": period // 4, "CALENDAR_QTR": f"Q{period % 4 + 1}"}
+
+
+def chunk_ids(filename, n):
+    """chunk id 只由檔名與序號決定，重新匯入同一個檔案時會覆寫相同的 id"""
+    key = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16]
+    return [f"{key}-{i}" for i in range(n)]
+
+
+def iter_transcripts(directory):
+    """依檔名順序逐一讀取 .txt 檔 (一次只把一個檔案放在記憶體)，yield (檔名, 內容, 內容 hash)"""
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(".txt"):
+            with open(entry.path, "rb") as f:
+                data = f.read()
+            yield entry.name, data.decode("utf-8", errors="replace"), hashlib.sha256(data).hexdigest()
+
+
+def peak_rss_mb():
+    """process 的記憶體峰值 (Linux 的 ru_maxrss 單位為 KB、macOS 為 bytes)；無法取得時回傳 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def load_manifest(path):
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"embedding": None, "files": {}}
+
+
+def needs_rebuild(manifest, embedding_name, full=False):
+    """換了 embedding 模型 (或 full) 時舊的向量不能與新的混用，所有逐字稿都要重新匯入"""
+    return full or manifest.get("embedding") != embedding_name
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+class _BatchWriter:
+    """累積 chunk，滿 batch_size 時一次 embedding 並寫入向量資料庫"""
+
+    def __init__(self, store, embedding, batch_size):
+        self.store = store
+        self.embedding = embedding
+        self.batch_size = batch_size
+        self.texts, self.metadatas, self.ids = [], [], []
+        self.embedded = 0
+        self.batches = 0
+
+    def add(self, texts, metadatas, ids):
+        self.texts += texts
+        self.metadatas += metadatas
+        self.ids += ids
+        while len(self.texts) >= self.batch_size:
+            self._write(self.batch_size)
+
+    def flush(self):
+        while self.texts:
+            self._write(self.batch_size)
+
+    @tracing.traced("embedding", "ingest_batch")
+    def _write(self, n):
+        texts, metadatas, ids = self.texts[:n], self.metadatas[:n], self.ids[:n]
+        del self.texts[:n], self.metadatas[:n], self.ids[:n]
+        # VectorSearchVectorStore 的 ids 是 keyword-only 參數
+        self.store.add_texts_with_embeddings(texts, self.embedding.embed_documents(texts), metadatas=metadatas, ids=ids)
+        self.embedded += len(texts)
+        self.batches += 1
+        tracing.annotate(chunks=len(texts))
+
+
+def ingest(directory, store, embedding, embedding_name, manifest_path=INGEST_MANIFEST_PATH,
+           chunk_size=INGEST_CHUNK_SIZE, chunk_overlap=INGEST_CHUNK_OVERLAP, batch_size=INGEST_EMBED_BATCH_SIZE,
+           full=False):
+    """匯入 directory 中的逐字稿，回傳統計報告 (檔案數、chunk 數、docs/sec、記憶體峰值 RSS)"""
+    manifest = load_manifest(manifest_path)
+    stored = manifest["files"]
+    rebuild = needs_rebuild(manifest, embedding_name, full)
+    previous = {} if rebuild else stored
+    if rebuild and stored:
+        logger.info("Embedding changed (%s -> %s) or full rebuild: re-embedding every transcript",
+                    manifest.get("embedding"), embedding_name)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    writer = _BatchWriter(store, embedding, batch_size)
+    files, seen = {}, set()
+    report = {"rebuild": rebuild, "files": 0, "new": 0, "changed": 0, "unchanged": 0, "unparsed": [], "removed": 0, "chunks": 0}
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    for filename, text, digest in iter_transcripts(directory):
+        report["files"] += 1
+        seen.add(filename)
+        old = previous.get(filename)
+        if old and old["sha256"] == digest:
+            files[filename] = old
+            report["unchanged"] += 1
+            continue
+        metadata = parse_transcript_name(filename)
+        if metadata is None:
+            logger.warning("Cannot parse company / quarter from %s, skipped", filename)
+            report["unparsed"].append(filename)
+            continue
+        chunks = splitter.split_text(text)
+        ids = chunk_ids(filename, len(chunks))
+        if filename in stored:
+            # 內容變更後 chunk 數可能變少，多出來的舊 chunk 要刪除 (相同 id 的由寫入時覆寫)
+            store.delete(chunk_ids(filename, stored[filename]["chunks"])[len(chunks):])
+        writer.add(chunks, [dict(metadata) for _ in chunks], ids)
+        files[filename] = {"sha256": digest, "chunks": len(chunks), **metadata}
+        report["changed" if old else "new"] += 1
+        report["chunks"] += len(chunks)
+    writer.flush()
+
+    removed = [name for name in stored if name not in seen]
+    for filename in removed:
+        store.delete(chunk_ids(filename, stored[filename]["chunks"]))
+    report["removed"] = len(removed)
+    elapsed = time.perf_counter() - start
+
+    save_manifest(manifest_path, {"embedding": embedding_name, "files": files})
+    processed = report["new"] + report["changed"]
+    report.update({
+        "embedded_chunks": writer.embedded,
+        "embedding_batches": writer.batches,
+        "elapsed_s": round(elapsed, 3),
+        "docs_per_sec": round(processed / elapsed, 2) if elapsed else None,
+        "chunks_per_sec": round(writer.embedded / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_before_mb": rss_before,
+    })
+    return report
+
+
+def default_paths(offline=False):
+    """(本地索引路徑, manifest 路徑)；離線執行與正式執行分開存放"""
+    if offline:
+        return INGEST_OFFLINE_INDEX_PATH, INGEST_OFFLINE_MANIFEST_PATH
+    return LOCAL_INDEX_PATH, INGEST_MANIFEST_PATH
+
+
+def open_backend(offline=False, backend=None, index_path=None, manifest_path=None, full=False,
+                 embedding=None, embedding_name=None):
+    """回傳 (向量資料庫, embedding 模型, embedding 名稱, 結束時的儲存函式)。
+    offline 使用 hash embedding (或傳入 embedding / embedding_name 指定)，backend 預設為 offline 時 "local"、
+    否則 config.VECTOR_BACKEND；本地索引在 embedding 模型與 manifest 記錄的不同 (或 full) 時從空的索引開始，不載入舊的向量"""
+    backend = backend or ("local" if offline else VECTOR_BACKEND)
+    default_index, default_manifest = default_paths(offline)
+    index_path, manifest_path = index_path or default_index, manifest_path or default_manifest
+    if embedding is not None:
+        name = embedding_name or type(embedding).__name__
+    elif offline:
+        from benchmarks.fakes import HashEmbeddings
+        embedding, name = HashEmbeddings(), "offline-hash-256"
+    else:
+        from langchain_google_vertexai import VertexAIEmbeddings
+        embedding, name = VertexAIEmbeddings(model_name=EMBEDDING_MODEL_NAME), EMBEDDING_MODEL_NAME
+
+    if backend == "local":
+        from local_vector_store import LocalVectorStore
+        if needs_rebuild(load_manifest(manifest_path), name, full):
+            store = LocalVectorStore(embedding)
+        else:
+            store = LocalVectorStore.load(index_path, embedding=embedding)
+
+        def _save():
+            # 載入的向量是 vectors.npy 的 mmap：先寫到暫存目錄再換掉，不會覆寫正在讀取的檔案；
+            # save 會先移除已刪除 / 被覆寫的列
+            store.index.build()
+            tmp = f"{index_path.rstrip(os.sep)}.tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            store.save(tmp)
+            shutil.rmtree(index_path, ignore_errors=True)
+            os.replace(tmp, index_path)
+        return store, embedding, name, _save
+
+    from rag_search import get_vector_store
+    return get_vector_store(), embedding, name, lambda: None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?", default=TRANSCRIPT_DIR, help="directory of .txt transcripts")
+    parser.add_argument("--offline", action="store_true", help="hash embeddings + local index, no GCP access")
+    parser.add_argument("--backend", choices=["local", "vertex"],
+                        help="vector store (default: local with --offline, otherwise config.VECTOR_BACKEND)")
+    parser.add_argument("--index-path", help="local index directory (default depends on --offline)")
+    parser.add_argument("--manifest", help="manifest path (default depends on --offline)")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=INGEST_CHUNK_OVERLAP)
+    parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH_SIZE, help="chunks per embedding call")
+    parser.add_argument("--full", action="store_true", help="re-embed every transcript")
+    args = parser.parse_args()
+    tracing.setup_logging()
+
+    default_index, default_manifest = default_paths(args.offline)
+    manifest_path = args.manifest or default_manifest
+    store, embedding, name, save = open_backend(args.offline, args.backend, args.index_path or default_index,
+                                                manifest_path, args.full)
+    report = ingest(args.directory, store, embedding, name, manifest_path, args.chunk_size, args.chunk_overlap,
+                    args.batch_size, args.full)
+    if report["rebuild"] or report["new"] or report["changed"] or report["removed"]:
+        save()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_SIZE,
+                    LLM_CACHE_MEMORY_SIZE, LLM_CACHE_TTL)
+import tracing
+
+
+class LLMCache:
+    """LLM 回應快取：記憶體 LRU 在前、SQLite 在後，支援 TTL 與筆數上限淘汰"""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_size=LLM_CACHE_MAX_SIZE,
+                 memory_size=LLM_CACHE_MEMORY_SIZE, ttl=LLM_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()  # key -> (response, created_at)
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                   key TEXT PRIMARY KEY,
+                   model TEXT,
+                   template_id TEXT,
+                   response TEXT,
+                   created_at REAL,
+                   last_access REAL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        self._conn.commit()
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, template_id, prompt):
+        """以 (model name, prompt template id, rendered prompt hash) 組成快取 key"""
+        prompt_hash = hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()
+        return f"{model_name}|{template_id}|{prompt_hash}"
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remember(self, key, response, created_at):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _get_memory(self, key, now):
+        entry = self._memory.get(key)
+        if entry is not None:
+            if not self._expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[0]
+            del self._memory[key]
+        return None
+
+    def get_memory(self, key):
+        """只查記憶體 LRU (不碰 SQLite)，可以直接在 event loop 中呼叫；未命中時回傳 None 且不計入 misses"""
+        with self._lock:
+            return self._get_memory(key, time.time())
+
+    def get(self, key):
+        """查詢快取，回傳 response 字串；未命中或已過期回傳 None"""
+        now = time.time()
+        with self._lock:
+            response = self._get_memory(key, now)
+            if response is not None:
+                return response
+
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                response, created_at = row
+                if not self._expired(created_at, now):
+                    self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    self._remember(key, response, created_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return response
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._disk_count -= 1
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        """寫入快取；超過 max_size 時淘汰最久未使用的資料"""
+        now = time.time()
+        model_name, template_id, _ = key.split("|", 2)
+        with self._lock:
+            self._remember(key, response, now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, template_id, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, template_id, response, now, now),
+            )
+            # 筆數為估計值 (覆寫同一 key 也會 +1)，超過上限時才重新精確計算
+            self._disk_count += 1
+            if self.ttl is not None:
+                cursor = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+                self._disk_count -= cursor.rowcount
+            if self._disk_count > self.max_size:
+                self._disk_count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                overflow = self._disk_count - self.max_size
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM llm_cache WHERE key IN "
+                        "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                        (overflow,),
+                    )
+                    self._disk_count -= overflow
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self._disk_count = 0
+
+    def stats(self):
+        """回傳命中/未命中計數"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._disk_count,
+            }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """取得全域共用的 LLMCache"""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def get_model_name(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def _lookup(llm, template_id, prompt, cache):
+    """組出快取 key 並查詢，回傳 (cache, key, 快取內容或 None)"""
+    cache = cache or get_llm_cache()
+    key = LLMCache.make_key(get_model_name(llm), template_id, prompt)
+    cached = cache.get(key)
+    tracing.annotate(template=template_id, cache_hit=cached is not None)
+    return cache, key, cached
+
+
+async def _alookup(llm, template_id, prompt, cache):
+    """_lookup 的 async 版本：記憶體命中直接回傳；SQLite 查詢 (命中時還有 UPDATE / COMMIT) 放到執行緒，不阻塞 event loop"""
+    cache = cache or get_llm_cache()
+    key = LLMCache.make_key(get_model_name(llm), template_id, prompt)
+    cached = cache.get_memory(key)
+    if cached is None:
+        cached = await asyncio.to_thread(cache.get, key)
+    tracing.annotate(template=template_id, cache_hit=cached is not None)
+    return cache, key, cached
+
+
+@tracing.traced("cache")
+def cached_invoke(llm, template_id, prompt, cache=None):
+    """以快取包裝 llm.invoke(prompt)，回傳文字內容 (chat model 與 text LLM 皆可)"""
+    if not LLM_CACHE_ENABLED:
+        response = llm.invoke(prompt)
+        return getattr(response, "content", response)
+
+    cache, key, cached = _lookup(llm, template_id, prompt, cache)
+    if cached is not None:
+        return cached
+
+    response = llm.invoke(prompt)
+    text = getattr(response, "content", response)
+    cache.set(key, text)
+    return text
+
+
+@tracing.traced("cache")
+async def acached_invoke(llm, template_id, prompt, cache=None):
+    """cached_invoke 的 async 版本：以 llm.ainvoke 呼叫模型，等待期間不佔用執行緒"""
+    if not LLM_CACHE_ENABLED:
+        response = await llm.ainvoke(prompt)
+        return getattr(response, "content", response)
+
+    cache, key, cached = await _alookup(llm, template_id, prompt, cache)
+    if cached is not None:
+        return cached
+
+    response = await llm.ainvoke(prompt)
+    text = getattr(response, "content", response)
+    await asyncio.to_thread(cache.set, key, text)
+    return text
+
+
+@tracing.traced("cache")
+def cached_structured_invoke(llm, schema, template_id, prompt, cache=None):
+    """以 llm.with_structured_output(schema) 取得 pydantic 物件；快取中存的是它的 JSON"""
+    structured_llm = llm.with_structured_output(schema)
+    if not LLM_CACHE_ENABLED:
+        return structured_llm.invoke(prompt)
+
+    cache, key, cached = _lookup(llm, template_id, prompt, cache)
+    if cached is not None:
+        return schema.model_validate_json(cached)
+
+    result = structured_llm.invoke(prompt)
+    cache.set(key, result.model_dump_json())
+    return result
+
+
+@tracing.traced("cache")
+async def acached_structured_invoke(llm, schema, template_id, prompt, cache=None):
+    """cached_structured_invoke 的 async 版本"""
+    structured_llm = llm.with_structured_output(schema)
+    if not LLM_CACHE_ENABLED:
+        return await structured_llm.ainvoke(prompt)
+
+    cache, key, cached = await _alookup(llm, template_id, prompt, cache)
+    if cached is not None:
+        return schema.model_validate_json(cached)
+
+    result = await structured_llm.ainvoke(prompt)
+    await asyncio.to_thread(cache.set, key, result.model_dump_json())
+    return result
+
+
+def cached_batch_as_completed(llm, template_id, prompts, max_concurrency, schema=None, use_cache=True, cache=None):
+    """批次版的 cached_invoke / cached_structured_invoke：相同的 prompt 只送一次，未命中快取的 prompt
+    以 llm.batch_as_completed 有限併發呼叫；依完成順序 yield (輸入位置, 結果)，失敗的項目結果為 Exception。
+    template_id 可以是單一字串，或與 prompts 等長、每個 prompt 各自的 template id"""
+    template_ids = [template_id] * len(prompts) if isinstance(template_id, str) else list(template_id)
+    positions = {}
+    for i, key in enumerate(zip(template_ids, prompts)):
+        positions.setdefault(key, []).append(i)
+    unique = list(positions)
+    runnable = llm.with_structured_output(schema) if schema is not None else llm
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    cache = (cache or get_llm_cache()) if use_cache else None
+    # generator 可能在不同的 context 被關閉，因此這個 span 不設為目前的 span，只記錄整體時間與命中數
+    span = tracing.span("batch", "cache", template=",".join(sorted(set(template_ids))),
+                        prompts=len(prompts), unique=len(unique))
+    try:
+        pending, hits = [], 0
+        for key in unique:
+            cached = cache.get(LLMCache.make_key(get_model_name(llm), *key)) if use_cache else None
+            if cached is None:
+                pending.append(key)
+                continue
+            hits += 1
+            result = schema.model_validate_json(cached) if schema is not None else cached
+            for i in positions[key]:
+                yield i, result
+        span.set(cache_hits=hits, llm_calls=len(pending))
+        if not pending:
+            return
+        outputs = runnable.batch_as_completed([prompt for _, prompt in pending],
+                                              config={"max_concurrency": max_concurrency}, return_exceptions=True)
+        for j, output in outputs:
+            key = pending[j]
+            if not isinstance(output, Exception):
+                output = output if schema is not None else getattr(output, "content", output)
+                if use_cache:
+                    cache.set(LLMCache.make_key(get_model_name(llm), *key),
+                              output.model_dump_json() if schema is not None else output)
+            for i in positions[key]:
+                yield i, output
+    finally:
+        span.finish()
+
+
+def cached_batch(llm, template_id, prompts, max_concurrency, schema=None, use_cache=True, cache=None):
+    """cached_batch_as_completed 的結果依輸入順序回傳"""
+    results = [None] * len(prompts)
+    for i, result in cached_batch_as_completed(llm, template_id, prompts, max_concurrency, schema, use_cache, cache):
+        results[i] = result
+    return results
+
+
+# 測試
+if __name__ == "__main__":
+    class FakeLLM:
+        model_name = "fake-llm"
+
+        def __init__(self):
+            self.calls = 0
+
+        def invoke(self, prompt):
+            self.calls += 1
+            return f"response to: {prompt}"
+
+    fake = FakeLLM()
+    cache = LLMCache(path=":memory:", max_size=100, memory_size=10, ttl=60)
+    for _ in range(3):
+        for template_id in ["FIRST_ASKED_PROMPT", "LLM_SQL_SYS_PROMPT", "MULTI_RAG_PROMPT", "RAG_SPLIT_QUERY_PROMPT"]:
+            cached_invoke(fake, template_id, "What is Amazon's Revenue in 2022 Q1?", cache=cache)
+    print("model calls:", fake.calls)  # 4：只有第一輪會呼叫模型
+    print(cache.stats())
@@ -0,0 +1,371 @@
+import json
+import os
+import threading
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from config import LOCAL_INDEX_N_PROBE, LOCAL_INDEX_BRUTE_FORCE_THRESHOLD
+
+# ✅ Vertex Vector Search NumericNamespace 的比較運算
+NUMERIC_OPS = {
+    "EQUAL": np.equal,
+    "NOT_EQUAL": np.not_equal,
+    "LESS": np.less,
+    "LESS_EQUAL": np.less_equal,
+    "GREATER": np.greater,
+    "GREATER_EQUAL": np.greater_equal,
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _numeric_value(numeric_filter):
+    for attr in ("value_float", "value_int", "value_double"):
+        value = getattr(numeric_filter, attr, None)
+        if value is not None:
+            return float(value)
+    raise ValueError(f"NumericNamespace without value: {numeric_filter}")
+
+
+class LocalVectorIndex:
+    """NumPy float32 矩陣上的 IVF 索引，附 metadata 欄位；先以 metadata 過濾，再在候選集合中做 ANN 搜尋"""
+
+    def __init__(self, dim=None, n_lists=None, n_probe=LOCAL_INDEX_N_PROBE,
+                 brute_force_threshold=LOCAL_INDEX_BRUTE_FORCE_THRESHOLD):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.brute_force_threshold = brute_force_threshold
+        self.vectors = np.zeros((0, dim or 0), dtype=np.float32)
+        # metadata 欄位名稱 -> np.ndarray；數值欄位為 float64，字串欄位以 int32 編碼 (-1 表示缺值)
+        self.columns = {}
+        self.vocab = {}  # 字串欄位名稱 -> 編碼對應的 token list
+        self._code_of = {}  # 字串欄位名稱 -> {token: code}
+        self.deleted = np.zeros(0, dtype=bool)
+        self.centroids = None
+        self.assignments = None  # 每一列所屬的 IVF list
+        self.lists = []
+        self._n_indexed = 0  # 已經分配到 IVF list 的列數，其後新增的列以暴力搜尋補上
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return int(self.vectors.shape[0])
+
+    # ---------- 寫入 ----------
+    def add(self, vectors, metadatas=None):
+        """新增向量與 metadata，回傳新增列的 row index"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)  # cosine 相似度：先正規化
+        metadatas = metadatas or [{} for _ in range(len(vectors))]
+
+        with self._lock:
+            if self.dim is None or len(self) == 0:
+                self.dim = vectors.shape[1]
+                self.vectors = self.vectors.reshape(0, self.dim)
+            start = len(self)
+            self.vectors = np.vstack([self.vectors, vectors])
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(vectors), dtype=bool)])
+
+            for name in set(self.columns) | {k for m in metadatas for k in m}:
+                self._append_column(name, start, [m.get(name) for m in metadatas])
+
+            # 新增的資料量超過索引的一成時重建 IVF
+            if self.centroids is not None and len(self) - self._n_indexed > max(1, self._n_indexed // 10):
+                self.build()
+            return list(range(start, len(self)))
+
+    def _code(self, name, value):
+        if value is None:
+            return -1
+        token = str(value)
+        code = self._code_of[name].get(token)
+        if code is None:
+            code = len(self.vocab[name])
+            self.vocab[name].append(token)
+            self._code_of[name][token] = code
+        return code
+
+    def _append_column(self, name, start, values):
+        column = self.columns.get(name)
+        if column is None:
+            if all(_is_number(v) for v in values if v is not None):
+                column = np.full(start, np.nan)
+            else:
+                column = np.full(start, -1, dtype=np.int32)
+                self.vocab[name], self._code_of[name] = [], {}
+        if name not in self.vocab:
+            if all(v is None or _is_number(v) for v in values):
+                self.columns[name] = np.concatenate([column, [np.nan if v is None else float(v) for v in values]])
+                return
+            # 數值欄位出現字串值：整欄改為字串編碼
+            self.vocab[name], self._code_of[name] = [], {}
+            column = np.array([-1 if np.isnan(v) else self._code(name, format(v, "g")) for v in column], dtype=np.int32)
+        new = np.array([self._code(name, v) for v in values], dtype=np.int32)
+        self.columns[name] = np.concatenate([column, new])
+
+    def _float_values(self, name):
+        column = self.columns[name]
+        if name not in self.vocab:
+            return column
+        lookup = np.array([_to_float(t) for t in self.vocab[name]] + [np.nan])
+        return lookup[column]  # code -1 對應最後一個 nan
+
+    def _token_mask(self, name, tokens):
+        column = self.columns[name]
+        if name not in self.vocab:
+            return np.isin(column, [_to_float(t) for t in tokens])
+        codes = [self._code_of[name][t] for t in map(str, tokens) if t in self._code_of[name]]
+        return np.isin(column, codes)
+
+    def delete(self, rows):
+        with self._lock:
+            self.deleted[np.asarray(rows, dtype=int)] = True
+
+    def compact(self):
+        """移除標記為刪除的列，回傳舊 row -> 新 row 的對應 (-1 表示已刪除)；已建立 IVF 時重新分配到原本的 list"""
+        with self._lock:
+            keep = ~self.deleted
+            mapping = np.full(len(self), -1, dtype=np.int64)
+            mapping[keep] = np.arange(int(keep.sum()))
+            if keep.all():
+                return mapping
+            self.vectors = np.ascontiguousarray(self.vectors[keep])
+            self.columns = {name: column[keep] for name, column in self.columns.items()}
+            self.deleted = np.zeros(len(self.vectors), dtype=bool)
+            if self.centroids is not None:
+                self.assignments = np.argmax(self.vectors @ self.centroids.T, axis=1)
+                self.lists = [np.flatnonzero(self.assignments == c) for c in range(len(self.centroids))]
+                self._n_indexed = len(self)
+            return mapping
+
+    def build(self, n_iter=10, seed=42):
+        """以 k-means 訓練 IVF 的 coarse quantizer，並把每一列分配到最近的 list"""
+        with self._lock:
+            n = len(self)
+            if n == 0:
+                return
+            n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+            n_lists = min(n_lists, n)
+            rng = np.random.default_rng(seed)
+            sample = self.vectors[rng.choice(n, size=min(n, n_lists * 64), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+            for _ in range(n_iter):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroid = members.mean(axis=0)
+                        centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+            self.centroids = centroids
+            self.assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            self.lists = [np.flatnonzero(self.assignments == c) for c in range(n_lists)]
+            self._n_indexed = n
+
+    # ---------- 過濾 ----------
+    def filter_mask(self, filter=None, numeric_filter=None):
+        """依 update_filters 產生的 Namespace / NumericNamespace 條件計算可搜尋的列"""
+        mask = ~self.deleted
+        for namespace in filter or []:
+            if namespace.name not in self.columns:
+                return np.zeros(len(self), dtype=bool)
+            allow = list(getattr(namespace, "allow_tokens", None) or [])
+            deny = list(getattr(namespace, "deny_tokens", None) or [])
+            if allow:
+                mask &= self._token_mask(namespace.name, allow)
+            if deny:
+                mask &= ~self._token_mask(namespace.name, deny)
+        for numeric in numeric_filter or []:
+            if numeric.name not in self.columns:
+                return np.zeros(len(self), dtype=bool)
+            op = NUMERIC_OPS[getattr(numeric, "op", None) or "EQUAL"]
+            with np.errstate(invalid="ignore"):
+                mask &= op(self._float_values(numeric.name), _numeric_value(numeric))
+        return mask
+
+    # ---------- 搜尋 ----------
+    def _top_k(self, query, rows, k):
+        if len(rows) == 0:
+            return []
+        scores = self.vectors[rows] @ query
+        if len(rows) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def brute_force_search(self, query, k=10, filter=None, numeric_filter=None):
+        """精確搜尋 (benchmark 的 ground truth)"""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        with self._lock:
+            rows = np.flatnonzero(self.filter_mask(filter, numeric_filter))
+            return self._top_k(query, rows, k)
+
+    def search(self, query, k=10, filter=None, numeric_filter=None, n_probe=None):
+        """先以 metadata 過濾出候選列，再用 IVF 只在探測到的 list 中計算相似度"""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        with self._lock:
+            mask = self.filter_mask(filter, numeric_filter)
+            n_candidates = int(mask.sum())
+            # 過濾後的候選不多 (或尚未建立索引) 時，暴力搜尋又快又精確
+            if self.centroids is None or n_candidates <= self.brute_force_threshold:
+                return self._top_k(query, np.flatnonzero(mask), k)
+
+            order = np.argsort(-(self.centroids @ query))
+            n_probe = n_probe or self.n_probe
+            unindexed = np.arange(self._n_indexed, len(self))
+            unindexed = unindexed[mask[unindexed]]
+            probed = 0
+            rows = unindexed
+            # 探測的 list 中符合條件的列不足 k 筆時，繼續往下一個 list 擴充
+            while probed < len(order) and (probed < n_probe or len(rows) < k):
+                members = self.lists[order[probed]]
+                rows = np.concatenate([rows, members[mask[members]]])
+                probed += 1
+            return self._top_k(query, rows, k)
+
+    # ---------- 存取 ----------
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            np.save(os.path.join(path, "vectors.npy"), self.vectors)
+            np.save(os.path.join(path, "deleted.npy"), self.deleted)
+            if self.centroids is not None:
+                np.save(os.path.join(path, "centroids.npy"), self.centroids)
+                np.save(os.path.join(path, "assignments.npy"), self.assignments[:self._n_indexed])
+            for i, column in enumerate(self.columns.values()):
+                np.save(os.path.join(path, f"column_{i}.npy"), column)
+            with open(os.path.join(path, "columns.json"), "w", encoding="utf-8") as f:
+                json.dump({"n_lists": self.n_lists, "n_probe": self.n_probe,
+                           "columns": list(self.columns), "vocab": self.vocab}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "columns.json"), encoding="utf-8") as f:
+            info = json.load(f)
+        index = cls(n_lists=info["n_lists"], n_probe=info["n_probe"])
+        index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        index.dim = index.vectors.shape[1] if index.vectors.ndim == 2 else None
+        index.deleted = np.load(os.path.join(path, "deleted.npy"))
+        for i, name in enumerate(info["columns"]):
+            index.columns[name] = np.load(os.path.join(path, f"column_{i}.npy"))
+        for name, tokens in info["vocab"].items():
+            index.vocab[name] = list(tokens)
+            index._code_of[name] = {token: code for code, token in enumerate(tokens)}
+        if os.path.exists(os.path.join(path, "centroids.npy")):
+            index.centroids = np.load(os.path.join(path, "centroids.npy"))
+            index.assignments = np.load(os.path.join(path, "assignments.npy"))
+            index.lists = [np.flatnonzero(index.assignments == c) for c in range(len(index.centroids))]
+            index._n_indexed = len(index.assignments)
+        return index
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain VectorStore 介面的本地後端，search kwargs 與 VectorSearchVectorStore 相同 (filter / numeric_filter)"""
+
+    def __init__(self, embedding, index=None):
+        self._embedding = embedding
+        self.index = index or LocalVectorIndex()
+        self.texts = []
+        self.metadatas = []
+        self.ids = []
+        self._row_of = {}
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts_with_embeddings(self, texts, embeddings, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        # 同一個 id 重新寫入時，舊的向量標記為刪除
+        self.delete([i for i in ids if i in self._row_of])
+        rows = self.index.add(embeddings, metadatas)
+        for row, text, metadata, doc_id in zip(rows, texts, metadatas, ids):
+            self.texts.append(text)
+            self.metadatas.append(metadata)
+            self.ids.append(doc_id)
+            self._row_of[doc_id] = row
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_texts_with_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        rows = [self._row_of.pop(i) for i in ids or [] if i in self._row_of]
+        if rows:
+            self.index.delete(rows)
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, numeric_filter=None, **kwargs):
+        hits = self.index.search(embedding, k=k, filter=filter, numeric_filter=numeric_filter)
+        return [(Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]), id=self.ids[row]), score)
+                for row, score in hits]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, numeric_filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k=k, filter=filter, numeric_filter=numeric_filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, numeric_filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter, numeric_filter)]
+
+    def similarity_search(self, query, k=4, filter=None, numeric_filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, numeric_filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.index.build()
+        return store
+
+    def compact(self):
+        """移除已刪除 (或被同一個 id 覆寫) 的列，避免索引隨著更新無限成長"""
+        mapping = self.index.compact()
+        if (mapping >= 0).all():
+            return
+        live = np.flatnonzero(mapping >= 0)
+        self.texts = [self.texts[row] for row in live]
+        self.metadatas = [self.metadatas[row] for row in live]
+        self.ids = [self.ids[row] for row in live]
+        self._row_of = {doc_id: int(mapping[row]) for doc_id, row in self._row_of.items()}
+
+    def save(self, path):
+        """寫入前先 compact，刪除的列不會留在檔案中"""
+        self.compact()
+        self.index.save(path)
+        with open(os.path.join(path, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump({"texts": self.texts, "metadatas": self.metadatas, "ids": self.ids,
+                       "rows": self._row_of}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, embedding):
+        """載入索引；路徑不存在時回傳空的 store"""
+        if not os.path.exists(os.path.join(path, "docs.json")):
+            return cls(embedding)
+        store = cls(embedding, LocalVectorIndex.load(path))
+        with open(os.path.join(path, "docs.json"), encoding="utf-8") as f:
+            docs = json.load(f)
+        store.texts, store.metadatas, store.ids = docs["texts"], docs["metadatas"], docs["ids"]
+        store._row_of = docs["rows"]
+        return store
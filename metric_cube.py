@@ -0,0 +1,169 @@
+import argparse
+import hashlib
+import logging
+import threading
+from sqlalchemy import (Column, Float, Integer, MetaData, PrimaryKeyConstraint, String, Table,
+                        bindparam, text)
+from config import METRIC_CUBE_TABLE
+import tracing
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+# ✅ company_name × index × calendar_year × calendar_qtr 的指標立方體
+cube_table = Table(
+    METRIC_CUBE_TABLE, metadata,
+    Column("company_name", String(128), nullable=False),
+    Column("index", String(64), nullable=False),
+    Column("calendar_year", Integer, nullable=False),
+    Column("calendar_qtr", Integer, nullable=False),
+    Column("usd_value", Float),
+    Column("local_value", Float),
+    Column("local_currency", String(16)),
+    Column("val_unit", String(32)),
+    Column("qoq_abs", Float),  # 與上一季相比 (usd_value)
+    Column("qoq_pct", Float),
+    Column("yoy_abs", Float),  # 與去年同季相比 (usd_value)
+    Column("yoy_pct", Float),
+    PrimaryKeyConstraint("company_name", "index", "calendar_year", "calendar_qtr"),
+)
+meta_table = Table(
+    f"{METRIC_CUBE_TABLE}_meta", metadata,
+    Column("key", String(64), primary_key=True),
+    Column("value", String(64)),
+)
+
+CUBE_DESCRIPTION = f"""Table {METRIC_CUBE_TABLE} is a precomputed view of fin_data, one row per company_name × index × calendar_year × calendar_qtr.
+It has usd_value, local_value, local_currency, val_unit plus qoq_abs / qoq_pct (vs previous quarter) and yoy_abs / yoy_pct (vs same quarter last year).
+Besides the fin_data index values it contains the derived metrics 'Gross Profit Margin' and 'Operating Margin' (in %).
+Prefer it for trend, growth, margin and period-comparison questions: they become a single lookup."""
+
+# 以 CTE 重算指定公司的所有資料列 (含衍生利潤率與 QoQ / YoY 差異)
+REBUILD_SQL = text(f"""
+INSERT INTO {METRIC_CUBE_TABLE}
+    (company_name, "index", calendar_year, calendar_qtr, usd_value, local_value, local_currency, val_unit,
+     qoq_abs, qoq_pct, yoy_abs, yoy_pct)
+WITH raw AS (
+    SELECT company_name, "index", calendar_year, calendar_qtr,
+           MAX(usd_value) AS usd_value, MAX(local_value) AS local_value,
+           MAX(local_currency) AS local_currency, MAX(val_unit) AS val_unit
+    FROM fin_data
+    WHERE company_name IN :companies
+    GROUP BY company_name, "index", calendar_year, calendar_qtr
+),
+base AS (
+    SELECT * FROM raw
+    UNION ALL
+    SELECT r.company_name, 'Gross Profit Margin', r.calendar_year, r.calendar_qtr,
+           (r.usd_value - c.usd_value) * 100.0 / NULLIF(r.usd_value, 0),
+           (r.local_value - c.local_value) * 100.0 / NULLIF(r.local_value, 0), '%', '%'
+    FROM raw r JOIN raw c
+      ON c.company_name = r.company_name AND c.calendar_year = r.calendar_year
+     AND c.calendar_qtr = r.calendar_qtr AND c."index" = 'Cost of Goods Sold'
+    WHERE r."index" = 'Revenue'
+    UNION ALL
+    SELECT r.company_name, 'Operating Margin', r.calendar_year, r.calendar_qtr,
+           o.usd_value * 100.0 / NULLIF(r.usd_value, 0),
+           o.local_value * 100.0 / NULLIF(r.local_value, 0), '%', '%'
+    FROM raw r JOIN raw o
+      ON o.company_name = r.company_name AND o.calendar_year = r.calendar_year
+     AND o.calendar_qtr = r.calendar_qtr AND o."index" = 'Operating Income'
+    WHERE r."index" = 'Revenue'
+)
+SELECT b.company_name, b."index", b.calendar_year, b.calendar_qtr, b.usd_value, b.local_value, b.local_currency, b.val_unit,
+       b.usd_value - q.usd_value, (b.usd_value - q.usd_value) * 100.0 / NULLIF(ABS(q.usd_value), 0),
+       b.usd_value - y.usd_value, (b.usd_value - y.usd_value) * 100.0 / NULLIF(ABS(y.usd_value), 0)
+FROM base b
+LEFT JOIN base q
+  ON q.company_name = b.company_name AND q."index" = b."index"
+ AND ((b.calendar_qtr > 1 AND q.calendar_year = b.calendar_year AND q.calendar_qtr = b.calendar_qtr - 1)
+   OR (b.calendar_qtr = 1 AND q.calendar_year = b.calendar_year - 1 AND q.calendar_qtr = 4))
+LEFT JOIN base y
+  ON y.company_name = b.company_name AND y."index" = b."index"
+ AND y.calendar_year = b.calendar_year - 1 AND y.calendar_qtr = b.calendar_qtr
+""").bindparams(bindparam("companies", expanding=True))
+
+
+# 每家公司的資料指紋：筆數、最大 id，以及以 id 加權的數值 / 期間 / 指標總和，
+# 新增、刪除資料列或修正 (restate) 既有資料列的數值與期間都會改變指紋 (Postgres / SQLite 皆可)
+FINGERPRINT_SQL = text("""
+SELECT company_name, COUNT(*), MAX(id),
+       SUM(COALESCE(usd_value, 0) * (id % 997 + 1)), SUM(COALESCE(local_value, 0) * (id % 991 + 1)),
+       SUM((calendar_year * 4 + calendar_qtr) * (id % 983 + 1)), SUM(LENGTH("index") * (id % 977 + 1))
+FROM fin_data GROUP BY company_name
+""")
+FINGERPRINT_PREFIX = "company:"
+
+
+def company_fingerprints(conn):
+    """{company: fin_data 資料指紋}，新增、修正或刪除資料都會改變 (report_cache 也以此作為報表版本)；
+    浮點總和先取到小數 4 位，避免加總順序造成的誤差讓指紋每次不同"""
+    return {row[0]: hashlib.sha1(repr([round(float(v), 4) if v is not None else None for v in row[1:]]).encode())
+            .hexdigest()[:16] for row in conn.execute(FINGERPRINT_SQL)}
+
+
+def _get_watermarks(conn):
+    rows = conn.execute(meta_table.select().where(meta_table.c.key.like(f"{FINGERPRINT_PREFIX}%")))
+    return {row.key[len(FINGERPRINT_PREFIX):]: row.value for row in rows}
+
+
+def _set_watermarks(conn, fingerprints, removed=()):
+    keys = [FINGERPRINT_PREFIX + company for company in list(fingerprints) + list(removed)]
+    conn.execute(meta_table.delete().where(meta_table.c.key.in_(keys)))
+    if fingerprints:
+        conn.execute(meta_table.insert(), [{"key": FINGERPRINT_PREFIX + company, "value": fingerprint}
+                                           for company, fingerprint in fingerprints.items()])
+
+
+@tracing.traced("sql")
+def refresh_cube(engine, full=False):
+    """增量更新：比對每家公司的資料指紋，只重算有新增、修正或刪除資料的公司；full=True 時全部重建。回傳重算的公司"""
+    metadata.create_all(engine, tables=[cube_table, meta_table])
+    with engine.begin() as conn:
+        current = company_fingerprints(conn)
+        stored = _get_watermarks(conn)
+        changed = {company: fp for company, fp in current.items() if full or stored.get(company) != fp}
+        removed = [company for company in stored if company not in current]
+        if not changed and not removed:
+            return []
+
+        # 新的一季會影響該公司下一季的 QoQ 與隔年的 YoY，因此以公司為單位重算
+        companies = list(changed)
+        conn.execute(cube_table.delete().where(cube_table.c.company_name.in_(companies + removed)))
+        if companies:
+            conn.execute(REBUILD_SQL, {"companies": companies})
+        _set_watermarks(conn, changed, removed)
+    tracing.annotate(companies=len(companies))
+    logger.info("Metric cube refreshed for %d companies (%d removed)", len(companies), len(removed))
+    return companies
+
+
+def start_refresh_loop(engine, interval, ready=None):
+    """背景執行 refresh_cube：啟動後立即一次 (第一次沒有 watermark 時為完整建立)，之後每 interval 秒增量更新，
+    讓新進的 fin_data 資料自動進入 cube；第一次成功後 set ready (threading.Event)"""
+    stop = threading.Event()
+
+    def _loop():
+        while True:
+            try:
+                refresh_cube(engine)
+                if ready is not None:
+                    ready.set()
+            except Exception as e:
+                logger.warning("Metric cube refresh failed: %s", e)
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=_loop, daemon=True).start()
+    return stop
+
+
+if __name__ == "__main__":
+    from db import engine
+
+    parser = argparse.ArgumentParser(description="Refresh the fin_data metric cube")
+    parser.add_argument("--full", action="store_true", help="rebuild every company instead of only changed ones")
+    args = parser.parse_args()
+    tracing.setup_logging()
+    refresh_cube(engine, full=args.full)
@@ -0,0 +1,38 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+from prompt import PLANNER_PROMPT
+from llm_cache import cached_structured_invoke, acached_structured_invoke, cached_batch
+
+
+class RagSubQuery(BaseModel):
+    """一個只涵蓋單一公司 / 年份 / 季度的法說會子查詢，以及它的檢索過濾條件"""
+    query: str = Field(description="Self-contained sub-query for the earnings call transcripts")
+    company_name: Optional[str] = Field(default=None, description="Company name, or null if not mentioned")
+    calendar_year: Optional[int] = Field(default=None, description="Calendar year such as 2022, or null")
+    calendar_qtr: Optional[Literal["Q1", "Q2", "Q3", "Q4"]] = Field(default=None, description="Calendar quarter, or null")
+
+
+class QueryPlan(BaseModel):
+    """planner 的輸出：要用的工具、財年 / 幣值旗標、SQL 問句與 RAG 子查詢"""
+    tools: List[Literal["sql_db_query", "RAG_Search"]] = Field(default_factory=list)
+    fiscal: Optional[bool] = Field(default=None, description="True for fiscal year, False for calendar year, null if not specified")
+    usd: Optional[bool] = Field(default=None, description="True for USD, False for another currency, null if not specified")
+    sql_question: Optional[str] = Field(default=None, description="SQL-ready rewrite of the query, when sql_db_query is used")
+    rag_queries: List[RagSubQuery] = Field(default_factory=list)
+    clarification: Optional[str] = Field(default=None, description="Question to ask the user when the query cannot be answered as is")
+
+
+def plan_query(llm, query: str) -> QueryPlan:
+    """一次 structured output 呼叫產生完整的查詢計畫 (結果以 JSON 快取)"""
+    return cached_structured_invoke(llm, QueryPlan, "PLANNER_PROMPT", PLANNER_PROMPT.format(query=query))
+
+
+async def aplan_query(llm, query: str) -> QueryPlan:
+    """plan_query 的 async 版本"""
+    return await acached_structured_invoke(llm, QueryPlan, "PLANNER_PROMPT", PLANNER_PROMPT.format(query=query))
+
+
+def plan_queries(llm, queries, max_concurrency):
+    """一批問題的計畫：相同的問題只規劃一次，其餘以 llm.batch 有限併發呼叫 (失敗的項目回傳 Exception)"""
+    prompts = [PLANNER_PROMPT.format(query=query) for query in queries]
+    return cached_batch(llm, "PLANNER_PROMPT", prompts, max_concurrency, schema=QueryPlan)
@@ -332,4 +332,45 @@ FINAL_GENERATE_PROMPT = """
 ---
 請根據使用者問題的語言回覆, 英文問問題請用英文回答, 以此類推。
 請根據這些資訊，產生一個完整且清楚的回答，並確保你的回答能讓使用者理解。 
-"""
\ No newline at end of file
+"""
+# 改寫自 langchain hub "langchain-ai/sql-agent-system-prompt"，保存在本地避免啟動時下載；
+# schema 快照會接在後面 (sql_search.build_agent_prompt)，所以不再要求先查資料表清單與 schema
+SQL_AGENT_SYSTEM_PROMPT = """You are an agent designed to interact with a SQL database.
+Given an input question, create a syntactically correct {dialect} query to run, then look at the results of the query and return the answer.
+Unless the user specifies a specific number of examples they wish to obtain, always limit your query to at most {top_k} results.
+You can order the results by a relevant column to return the most interesting examples in the database.
+Never query for all the columns from a specific table, only ask for the relevant columns given the question.
+You have access to tools for interacting with the database.
+Only use the below tools. Only use the information returned by the below tools to construct your final answer.
+You MUST double check your query before executing it. If you get an error while executing a query, rewrite the query and try again.
+
+DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.
+
+The database schema, valid values and data coverage are already provided below, so start by writing the query directly.
+Only look up tables or schemas with the tools if you need a table that is not described below."""
+
+PLANNER_PROMPT = """You are an AI assistant that plans how to answer a user's financial question in a single step.
+
+### User Query:
+{query}
+
+### Available Data Sources:
+1. **Financial Data (SQL Database, tool `sql_db_query`)**: table fin_data with columns company_name, index, calendar_year, calendar_qtr (1-4), usd_value, local_currency, val_unit, local_value.
+   The index column only takes these ENUM values: `Operating Income`, `Cost of Goods Sold`, `Operating Expense`, `Tax Expense`, `Revenue`, `Total Asset`.
+2. **Earnings Call Transcripts (RAG Search, tool `RAG_Search`)**: textual earnings call transcripts linked to a Company Name, Calendar Year and Calendar Quarter.
+
+### Produce the plan:
+1. **tools**: include "sql_db_query" if the query needs financial figures, "RAG_Search" if it needs what was said in earnings calls. Include both if both apply, none if neither applies.
+2. **fiscal**: true if the query mentions a Fiscal Year (FY), false if it refers to a Calendar Year, null if not specified.
+3. **usd**: true if the query asks for USD, false if it asks for another currency (e.g. TWD), null if not specified.
+4. **sql_question** (only when "sql_db_query" is used): rewrite the query into a specific, self-contained question for the SQL database.
+   - Use the exact index ENUM values (wrapped in backticks), the company name, calendar_year and calendar_qtr.
+   - Ask for both USD and local currency values unless the user specified a currency. Include the unit.
+   - Example: "Retrieve Amazon's financial data for 2020, then answer: How did `Operating Expense` change between Q1 and Q2?"
+5. **rag_queries** (only when "RAG_Search" is used): split the query so that each sub-query covers only one company, one calendar year and one calendar quarter.
+   For every sub-query also fill company_name, calendar_year (e.g. 2022) and calendar_qtr (Q1-Q4), or null when not mentioned.
+   Example: "Summarize the earnings call for TSMC and AMD in 2022 Q3" becomes
+   "Summarize the earnings call for TSMC in 2022 Q3." (TSMC, 2022, Q3) and "Summarize the earnings call for AMD in 2022 Q3." (AMD, 2022, Q3).
+6. **clarification**: leave null. Only when the question cannot be answered at all without more information from the user, write one short question to ask the user instead, in the user's language.
+   Do not ask about fiscal vs. calendar year or the currency here; leave fiscal / usd null and the user will be asked about them.
+"""
@@ -1,46 +1,126 @@
+import asyncio
+import logging
 import os
+from functools import lru_cache
 from google.cloud import aiplatform
 from langchain_google_vertexai import VertexAI, VertexAIEmbeddings, VectorSearchVectorStore
-from langchain.chains import RetrievalQA
-from vertexai.preview.generative_models import GenerativeModel
-from langchain.tools import Tool
+from langchain.chains.question_answering import load_qa_chain
+from langchain.tools import StructuredTool
+from pydantic import BaseModel, Field
+from typing import Optional
 import re
 from langchain_core.documents import Document
 from config import (PROJECT_ID, REGION, BUCKET, INDEX_ID, 
                     ENDPOINT_ID, BUCKET_URI, 
-                    MODEL_NAME, EMBEDDING_MODEL_NAME
+                    MODEL_NAME, EMBEDDING_MODEL_NAME, EMBEDDING_DIM,
+                    VECTOR_BACKEND, LOCAL_INDEX_PATH, RAG_TOP_K
                     )
 from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import (
     Namespace,
     NumericNamespace,
 )
 from prompt import RAG_SPLIT_QUERY_PROMPT
+from llm_cache import cached_invoke, acached_invoke
+from entity_extractor import extract_filters as extract_entity_filters
+from embedding_cache import CachedEmbeddings
+from local_vector_store import LocalVectorStore
+import tracing
 
-aiplatform.init(project=PROJECT_ID, location=REGION, staging_bucket=BUCKET_URI)
+logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def get_embedding_model():
+    """query 向量快取：重複的子查詢不必再呼叫 embedding API"""
+    return CachedEmbeddings(VertexAIEmbeddings(model_name=EMBEDDING_MODEL_NAME),
+                            model_name=EMBEDDING_MODEL_NAME, dim=EMBEDDING_DIM)
 
-my_index = aiplatform.MatchingEngineIndex(INDEX_ID)
-my_index_endpoint = aiplatform.MatchingEngineIndexEndpoint(ENDPOINT_ID)
 
-embedding_model = VertexAIEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+# 注入的資源 (benchmark / 離線測試用)，未設定時使用 Vertex AI
+_vector_store_override = None
+_qa_llm_override = None
 
-# ✅ 建立向量資料庫
-vector_store = VectorSearchVectorStore.from_components(
-    project_id=PROJECT_ID,
-    region=REGION,
-    gcs_bucket_name=BUCKET,
-    index_id=my_index.name,
-    endpoint_id=my_index_endpoint.name,
-    embedding=embedding_model,
-)
-retriever = vector_store.as_retriever()
 
+def set_rag_resources(vector_store=None, qa_llm=None):
+    """以指定的向量資料庫 / QA 模型取代預設的 Vertex AI 資源"""
+    global _vector_store_override, _qa_llm_override
+    _vector_store_override = vector_store
+    _qa_llm_override = qa_llm
+    get_qa_chain.cache_clear()
+
+
+def get_vector_store():
+    """建立向量資料庫 (依 config.VECTOR_BACKEND 選擇後端)；第一次檢索時才連線，import 時不做網路 I/O"""
+    if _vector_store_override is not None:
+        return _vector_store_override
+    return _build_vector_store()
+
+
+@lru_cache(maxsize=None)
+def _build_vector_store():
+    if VECTOR_BACKEND == "local":
+        return LocalVectorStore.load(LOCAL_INDEX_PATH, embedding=get_embedding_model())
+
+    aiplatform.init(project=PROJECT_ID, location=REGION, staging_bucket=BUCKET_URI)
+
+    my_index = aiplatform.MatchingEngineIndex(INDEX_ID)
+    my_index_endpoint = aiplatform.MatchingEngineIndexEndpoint(ENDPOINT_ID)
+
+    return VectorSearchVectorStore.from_components(
+        project_id=PROJECT_ID,
+        region=REGION,
+        gcs_bucket_name=BUCKET,
+        index_id=my_index.name,
+        endpoint_id=my_index_endpoint.name,
+        embedding=get_embedding_model(),
+    )
+
+
+def get_qa_llm():
+    """QA 與擷取共用的模型 client，整個 process 只建立一次"""
+    if _qa_llm_override is not None:
+        return _qa_llm_override
+    return _build_qa_llm()
+
+
+@lru_cache(maxsize=None)
+def _build_qa_llm():
+    return VertexAI(model_name=MODEL_NAME)
+
+
+@lru_cache(maxsize=None)
+def get_qa_chain():
+    """stuff QA chain (與原本 RetrievalQA chain_type="stuff" 相同的 prompt)，只建立一次；
+    檢索由呼叫端帶入各自的過濾條件完成，chain 本身沒有每次請求的狀態，可同時被多個請求使用"""
+    return load_qa_chain(get_qa_llm(), chain_type="stuff")
+
+@tracing.traced("extract")
 def extract_info_from_query(llm, query: str):
     
-    """使用 Gemini 1.5 Pro 解析 query，提取 Company Name、CALENDAR_YEAR 和 CALENDAR_QTR"""
+    """解析 query，提取 Company Name、CALENDAR_YEAR 和 CALENDAR_QTR；先用本地規則，完全找不到時才呼叫 Gemini"""
+    extracted = extract_entity_filters(query)
+    tracing.annotate(llm_fallback=not any(extracted))
+    if any(extracted):
+        return extracted
 
     prompt = RAG_SPLIT_QUERY_PROMPT.format(query=query)
-    response = llm.invoke(prompt)
+    response = cached_invoke(llm, "RAG_SPLIT_QUERY_PROMPT", prompt)
+    return _parse_extracted_info(response)
+
+
+@tracing.traced("extract")
+async def aextract_info_from_query(llm, query: str):
+    """extract_info_from_query 的 async 版本"""
+    extracted = extract_entity_filters(query)
+    tracing.annotate(llm_fallback=not any(extracted))
+    if any(extracted):
+        return extracted
+
+    prompt = RAG_SPLIT_QUERY_PROMPT.format(query=query)
+    response = await acached_invoke(llm, "RAG_SPLIT_QUERY_PROMPT", prompt)
+    return _parse_extracted_info(response)
+
+
+def _parse_extracted_info(response):
     extracted_text = response.strip()
 
     # 正則表達式解析
@@ -67,42 +147,72 @@ def update_filters(company_name, calendar_year, calendar_qtr):
 
     return filters, numeric_filters
 
-def query_rag_tool(query: str):
-    """使用 Vertex AI Vector Search 進行檢索，並使用 Gemini 1.5 Pro 解析 Query"""
-    llm = VertexAI(model_name=MODEL_NAME)
+class RagSearchInput(BaseModel):
+    query: str = Field(description="Question about an earnings call transcript")
+    company_name: Optional[str] = Field(default=None, description="Company name filter")
+    calendar_year: Optional[int] = Field(default=None, description="Calendar year filter, e.g. 2022")
+    calendar_qtr: Optional[str] = Field(default=None, description="Calendar quarter filter: Q1, Q2, Q3 or Q4")
+    extract_filters: bool = Field(default=True, description="Extract the filters from the query (local rules, LLM as fallback); "
+                                                            "set False when the caller already resolved them")
 
-    # 🔍 使用 Gemini 解析 Query，提取資訊
-    company_name, calendar_year, calendar_qtr = extract_info_from_query(llm, query)
 
-    print(f"Extracted Info:\n - Company Name: {company_name}\n - CALENDAR_YEAR: {calendar_year}\n - CALENDAR_QTR: {calendar_qtr}")
+@tracing.traced("tool")
+def query_rag_tool(query: str, company_name: Optional[str] = None, calendar_year: Optional[int] = None,
+                   calendar_qtr: Optional[str] = None, extract_filters: bool = True):
+    """使用 Vertex AI Vector Search 進行檢索；過濾條件由 planner 提供，未提供時才解析 Query"""
+    llm = get_qa_llm()
 
-    # 📌 設定檢索條件（如果有）
-    filters, numeric_filters = update_filters(company_name, calendar_year, calendar_qtr)
+    if extract_filters:
+        # 🔍 解析 Query，提取資訊
+        company_name, calendar_year, calendar_qtr = extract_info_from_query(llm, query)
 
-    print(filters, numeric_filters)
-    retriever.search_kwargs = {
-    "k": 10,
-    "filter": filters if filters else None,  # ✅ 確保 `filter` 只出現一次
-    "numeric_filter": numeric_filters if numeric_filters else None,  # ✅ 正確加入數值篩選
-    }
+    logger.info("Extracted Info: Company Name=%s, CALENDAR_YEAR=%s, CALENDAR_QTR=%s", company_name, calendar_year, calendar_qtr)
+
+    # 📌 設定檢索條件（如果有），只作為這次呼叫的參數，不寫入共用物件
+    search_kwargs = build_search_kwargs(company_name, calendar_year, calendar_qtr)
+    logger.debug("Search kwargs: %s", search_kwargs)
 
     # 🔍 進行檢索並回答
-    retrieval_qa = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        return_source_documents=True,
-    )
+    with tracing.span("similarity_search", "vector", k=search_kwargs["k"]) as span:
+        source_docs = get_vector_store().similarity_search(query, **search_kwargs)
+        span.set(chunks=len(source_docs))
+    response = get_qa_chain().invoke({"input_documents": source_docs, "question": query})
+    return _rag_result(response["output_text"], source_docs, company_name, calendar_year, calendar_qtr)
+
 
-    response = retrieval_qa({"query": query})
-    result = response["result"]
+@tracing.traced("tool")
+async def aquery_rag_tool(query: str, company_name: Optional[str] = None, calendar_year: Optional[int] = None,
+                          calendar_qtr: Optional[str] = None, extract_filters: bool = True):
+    """query_rag_tool 的 async 版本"""
+    llm = get_qa_llm()
+    if extract_filters:
+        company_name, calendar_year, calendar_qtr = await aextract_info_from_query(llm, query)
+    search_kwargs = build_search_kwargs(company_name, calendar_year, calendar_qtr)
 
+    # 第一次使用時連線到向量資料庫，放到執行緒中避免阻塞 event loop
+    vector_store = await asyncio.to_thread(get_vector_store)
+    with tracing.span("similarity_search", "vector", k=search_kwargs["k"]) as span:
+        source_docs = await vector_store.asimilarity_search(query, **search_kwargs)
+        span.set(chunks=len(source_docs))
+    response = await get_qa_chain().ainvoke({"input_documents": source_docs, "question": query})
+    return _rag_result(response["output_text"], source_docs, company_name, calendar_year, calendar_qtr)
+
+
+def build_search_kwargs(company_name, calendar_year, calendar_qtr, k=RAG_TOP_K):
+    """每次檢索各自的 k 與過濾條件"""
+    filters, numeric_filters = update_filters(company_name, calendar_year, calendar_qtr)
+    return {
+        "k": k,
+        "filter": filters if filters else None,  # ✅ 確保 `filter` 只出現一次
+        "numeric_filter": numeric_filters if numeric_filters else None,  # ✅ 正確加入數值篩選
+    }
+
+
+def _rag_result(result, source_docs, company_name, calendar_year, calendar_qtr):
     # 取得來源文件
-    source_docs = response["source_documents"]
     sources = [doc.page_content if isinstance(doc, Document) else str(doc) for doc in source_docs]
     metadata_list = [doc.metadata if isinstance(doc, Document) else str(doc) for doc in source_docs]
 
-
     return {
         "answer": result,
         "sources": sources,
@@ -116,9 +226,11 @@ def query_rag_tool(query: str):
     }
 
 # ✅ 建立 RAG Tool
-rag_tool = Tool(
+rag_tool = StructuredTool.from_function(
     name="RAG_Search",
     func=query_rag_tool,
+    coroutine=aquery_rag_tool,
+    args_schema=RagSearchInput,
     description="Retrieves relevant documents using Vertex AI Vector Search and answers queries."
 )
 
@@ -0,0 +1,188 @@
+import argparse
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+from sqlalchemy import bindparam, text
+from metric_cube import company_fingerprints
+from config import COMPANY_OPTIONS, REPORT_CACHE_PATH, REPORT_METRICS, REPORT_REFRESH_INTERVAL
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# ✅ 以條件彙總一次把 fin_data 轉成 company × year × quarter 一列、每個指標一欄 (Postgres / SQLite 皆可)
+PIVOT_SQL = text("SELECT company_name, calendar_year, calendar_qtr, "
+                 + ", ".join(f"MAX(CASE WHEN \"index\" = '{metric}' THEN usd_value END) AS \"{metric}\""
+                             for metric in REPORT_METRICS)
+                 + ", MAX(val_unit) AS val_unit FROM fin_data WHERE company_name IN :companies"
+                 " GROUP BY company_name, calendar_year, calendar_qtr").bindparams(bindparam("companies", expanding=True))
+# fin_data 沒有營業外收支與利息，最後一項只扣除所得稅，因此不稱為淨利率
+MARGIN_COLUMNS = ["Gross Profit Margin (%)", "Operating Margin (%)", "After-tax Operating Margin (%)"]
+# 報表欄位或快取表結構改變時遞增，舊格式的快取會被整批重建
+REPORT_FORMAT = 3
+
+
+def all_companies():
+    """COMPANY_OPTIONS 中所有角色可見的公司"""
+    return sorted({company for companies in COMPANY_OPTIONS.values() for company in companies})
+
+
+def build_reports(df):
+    """pivot 結果加上利潤率與營收 QoQ / YoY (整個 DataFrame 一次向量化計算)，依公司拆成各自的報表"""
+    df = df.astype({metric: float for metric in REPORT_METRICS})
+    df["calendar_year"] = df["calendar_year"].astype(int)
+    df["calendar_qtr"] = df["calendar_qtr"].astype(int)
+    df = df.sort_values(["company_name", "calendar_year", "calendar_qtr"]).reset_index(drop=True)
+    revenue = df["Revenue"].where(df["Revenue"] != 0)
+    df["Gross Profit Margin (%)"] = (df["Revenue"] - df["Cost of Goods Sold"]) * 100 / revenue
+    df["Operating Margin (%)"] = df["Operating Income"] * 100 / revenue
+    df["After-tax Operating Margin (%)"] = (df["Operating Income"] - df["Tax Expense"]) * 100 / revenue
+    # 以期間序號比對上一季與去年同季，資料缺季時不會誤把較早的季度當成上一季
+    period = df["calendar_year"] * 4 + df["calendar_qtr"] - 1
+    indexed = pd.Series(df["Revenue"].values, index=pd.MultiIndex.from_arrays([df["company_name"], period]))
+    for column, lag in (("Revenue QoQ (%)", 1), ("Revenue YoY (%)", 4)):
+        previous = pd.Series(indexed.reindex(pd.MultiIndex.from_arrays([df["company_name"], period - lag])).values,
+                             index=df.index)
+        df[column] = (df["Revenue"] - previous) * 100 / previous.abs().where(previous != 0)
+    df["period"] = df["calendar_year"].astype(str) + " Q" + df["calendar_qtr"].astype(str)
+    df = df.round(2)
+    return {company: group.drop(columns="company_name").reset_index(drop=True)
+            for company, group in df.groupby("company_name", sort=False)}
+
+
+def report_unit(report):
+    """報表金額的單位 (fin_data.val_unit，例如 "Million")；沒有資料時回傳 None"""
+    units = report["val_unit"].dropna() if "val_unit" in report else ()
+    return units.iloc[-1] if len(units) else None
+
+
+class ReportCache:
+    """預先計算的公司財務報表：SQLite 保存 (每家公司一列)，讀取時只查記憶體；
+    報表版本是 metric_cube.company_fingerprints 的資料指紋，refresh 只重算 fin_data 有新增、修正或刪除資料的公司，
+    開啟報表不會查資料庫或呼叫 LLM"""
+
+    def __init__(self, path=REPORT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reports = {}  # company -> (DataFrame, version)
+        self._loaded = False
+        self._loaded_mtime = None
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != REPORT_FORMAT:
+            # 舊格式 (欄位或表結構不同) 的報表不能沿用，重建空表後由下一次 refresh 全部重新產生
+            self._conn.execute("DROP TABLE IF EXISTS reports")
+            self._conn.execute(f"PRAGMA user_version = {REPORT_FORMAT}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS reports (company TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                           "version TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.commit()
+        self._refresh_stop = None
+
+    def _mtime(self):
+        return os.path.getmtime(self.path) if self.path != ":memory:" and os.path.exists(self.path) else None
+
+    def _load(self):
+        """SQLite 檔案有更新 (例如 CLI 在另一個 process refresh) 時重新載入記憶體"""
+        mtime = self._mtime()
+        if self._loaded and mtime == self._loaded_mtime:
+            return
+        with self._lock:
+            rows = self._conn.execute("SELECT company, data, version FROM reports").fetchall()
+            self._reports = {company: (pd.read_json(io.StringIO(data), orient="split"), version)
+                             for company, data, version in rows}
+            self._loaded, self._loaded_mtime = True, mtime
+
+    def get(self, company):
+        """回傳 (報表 DataFrame, 資料版本)；尚未產生時回傳 (None, None)"""
+        self._load()
+        return self._reports.get(company, (None, None))
+
+    def companies(self):
+        self._load()
+        return sorted(self._reports)
+
+    @tracing.traced("sql")
+    def refresh(self, engine, companies=None, full=False):
+        """比對每家公司的 fin_data 資料指紋，只對有新增、修正或刪除資料的公司做一次 pivot 查詢並更新快取；
+        fin_data 中已沒有資料的公司移除報表。回傳更新的公司"""
+        companies = list(companies or all_companies())
+        with self._lock:
+            stored = dict(self._conn.execute("SELECT company, version FROM reports").fetchall())
+        with engine.connect() as conn:
+            fingerprints = company_fingerprints(conn)
+            changed = [c for c in companies if c in fingerprints and (full or stored.get(c) != fingerprints[c])]
+            removed = [c for c in companies if c in stored and c not in fingerprints]
+            if not changed and not removed:
+                return []
+            rows = conn.execute(PIVOT_SQL, {"companies": changed}).fetchall() if changed else []
+
+        reports = {}
+        if rows:
+            df = pd.DataFrame(rows, columns=["company_name", "calendar_year", "calendar_qtr"] + REPORT_METRICS + ["val_unit"])
+            # 版本直接使用資料指紋：圖表快取 (chart_service) 以此為 key，資料修正後不會沿用舊圖
+            reports = {company: (report, fingerprints[company]) for company, report in build_reports(df).items()}
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("DELETE FROM reports WHERE company = ?", [(company,) for company in removed])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reports (company, data, version, updated_at) VALUES (?, ?, ?, ?)",
+                [(company, report.to_json(orient="split", index=False), version, now)
+                 for company, (report, version) in reports.items()])
+            self._conn.commit()
+            for company in removed:
+                self._reports.pop(company, None)
+            self._reports.update(reports)
+            self._loaded, self._loaded_mtime = True, self._mtime()
+        tracing.annotate(companies=len(reports))
+        logger.info("Report cache refreshed for %d companies (%d removed)", len(reports), len(removed))
+        return sorted(reports)
+
+    def start_refresh_loop(self, engine, interval=REPORT_REFRESH_INTERVAL):
+        """背景執行 refresh：啟動時立即一次，之後每 interval 秒比對資料指紋，fin_data 有變動時自動更新報表。
+        重複呼叫只會啟動一個執行緒"""
+        with self._lock:
+            if self._refresh_stop is not None:
+                return self._refresh_stop
+            stop = self._refresh_stop = threading.Event()
+
+        def _loop():
+            while True:
+                try:
+                    self.refresh(engine)
+                except Exception as e:
+                    logger.warning("Report cache refresh failed: %s", e)
+                if stop.wait(interval):
+                    return
+
+        threading.Thread(target=_loop, daemon=True, name="report-refresh").start()
+        return stop
+
+
+_report_cache = None
+_report_cache_lock = threading.Lock()
+
+
+def get_report_cache():
+    """取得全域共用的 ReportCache"""
+    global _report_cache
+    if _report_cache is None:
+        with _report_cache_lock:
+            if _report_cache is None:
+                _report_cache = ReportCache()
+    return _report_cache
+
+
+if __name__ == "__main__":
+    from db import engine
+
+    parser = argparse.ArgumentParser(description="Precompute the Report Mode reports from fin_data")
+    parser.add_argument("--full", action="store_true", help="rebuild every company instead of only those with changed rows")
+    parser.add_argument("--companies", nargs="*", help="only refresh these companies")
+    args = parser.parse_args()
+    tracing.setup_logging()
+    updated = get_report_cache().refresh(engine, args.companies, full=args.full)
+    print(f"Updated {len(updated)} reports: {', '.join(updated)}")
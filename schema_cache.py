@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy import inspect, text
+from langchain.tools import Tool
+from langchain_community.utilities.sql_database import SQLDatabase
+from config import SCHEMA_TABLES, SCHEMA_CACHE_PATH, SCHEMA_VERSION_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+# 快照中由資料推導的部分 (公司清單、年份範圍、index 值) 以這些彙總值判斷是否過期
+DATA_FINGERPRINT_SQL = text("SELECT COUNT(*), MAX(id), MIN(calendar_year), MAX(calendar_year), "
+                            "COUNT(DISTINCT company_name), COUNT(DISTINCT \"index\") FROM fin_data")
+
+
+def schema_version(engine, tables=SCHEMA_TABLES):
+    """以資料表欄位定義 (欄位名稱 / 型別 / nullable) 與 fin_data 的資料指紋計算快照版本：
+    新增公司、年份或資料列時版本也會改變"""
+    inspector = inspect(engine)
+    columns = {
+        table: [(c["name"], str(c["type"]), bool(c.get("nullable", True))) for c in inspector.get_columns(table)]
+        for table in tables if inspector.has_table(table)
+    }
+    if "fin_data" in columns:
+        with engine.connect() as conn:
+            columns["_data"] = [str(value) for value in conn.execute(DATA_FINGERPRINT_SQL).one()]
+    return hashlib.sha256(json.dumps(columns, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def build_snapshot(db, engine, tables=SCHEMA_TABLES):
+    """一次性擷取 DDL、index 的 ENUM 值、公司清單與年份範圍；資料庫中不存在的資料表 (例如尚未建立的 cube) 略過"""
+    inspector = inspect(engine)
+    tables = [table for table in tables if inspector.has_table(table)]
+    if not set(tables) <= set(db.get_usable_table_names()):
+        # SQLDatabase 只認得建立時 catalog 中的資料表；之後才建立的 (例如背景建立的 cube) 要重新讀取
+        db = SQLDatabase(engine)
+    snapshot = {
+        "version": schema_version(engine, tables),
+        "created_at": time.time(),
+        "tables": list(tables),
+        "ddl": {table: db.get_table_info([table]) for table in tables},
+    }
+    with engine.connect() as conn:
+        snapshot["index_values"] = [r[0] for r in conn.execute(text('SELECT DISTINCT "index" FROM fin_data ORDER BY 1'))]
+        snapshot["companies"] = [r[0] for r in conn.execute(text("SELECT DISTINCT company_name FROM fin_data ORDER BY 1"))]
+        year_min, year_max = conn.execute(text("SELECT MIN(calendar_year), MAX(calendar_year) FROM fin_data")).one()
+    snapshot["year_range"] = [year_min, year_max]
+    return snapshot
+
+
+class SchemaCache:
+    """fin_data schema 快照：啟動時建立一次、存成有版本的 JSON，背景定期比對版本 (schema 與資料指紋)，改變時才重建"""
+
+    def __init__(self, db, engine, path=SCHEMA_CACHE_PATH, check_interval=SCHEMA_VERSION_CHECK_INTERVAL):
+        self.db = db
+        self.engine = engine
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _load_file(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def _save_file(self, snapshot):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+
+    def refresh(self, force=False):
+        """比對 schema 版本，版本不同 (或 force) 時重新建立快照"""
+        version = schema_version(self.engine)
+        current = self._snapshot or self._load_file()
+        if force or current is None or current.get("version") != version:
+            logger.info("Building schema snapshot: %s -> %s", current and current.get("version"), version)
+            current = build_snapshot(self.db, self.engine)
+            self._save_file(current)
+        with self._lock:
+            self._snapshot = current
+            self._last_check = time.time()
+        return current
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Schema refresh failed, keep using cached snapshot: %s", e)
+        finally:
+            self._refreshing = False
+
+    def get(self):
+        """取得快照；第一次呼叫時同步建立，之後的版本檢查都在背景執行，不會阻塞查詢"""
+        if self._snapshot is None:
+            return self.refresh()
+        if time.time() - self._last_check > self.check_interval and not self._refreshing:
+            self._refreshing = True
+            self._last_check = time.time()
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self._snapshot
+
+    def prompt_context(self):
+        """注入 SQL agent system prompt 的 schema 說明"""
+        snapshot = self.get()
+        ddl = "\n\n".join(snapshot["ddl"].values())
+        return (
+            f"### Database schema (version {snapshot['version']})\n"
+            f"{ddl}\n\n"
+            f"- Valid values of \"index\": {', '.join(snapshot['index_values'])}\n"
+            f"- Companies in fin_data: {', '.join(snapshot['companies'])}\n"
+            f"- calendar_year range: {snapshot['year_range'][0]} - {snapshot['year_range'][1]}\n"
+            "The schema above is complete and up to date: do not call sql_db_list_tables or sql_db_schema "
+            "unless you need a table that is not listed."
+        )
+
+    def list_tables(self, _=""):
+        return ", ".join(self.get()["tables"])
+
+    def table_info(self, table_names):
+        snapshot = self.get()
+        names = [t.strip() for t in str(table_names).split(",") if t.strip()]
+        missing = [t for t in names if t not in snapshot["ddl"]]
+        if missing:
+            return f"Error: table_names {missing} not found in database"
+        return "\n\n".join(snapshot["ddl"][t] for t in names)
+
+    def get_tools(self):
+        """由快照提供的 sql_db_list_tables / sql_db_schema，取代會即時查詢 catalog 的 toolkit 工具"""
+        return [
+            Tool(
+                name="sql_db_list_tables",
+                func=self.list_tables,
+                description="Input is an empty string, output is a comma-separated list of tables in the database.",
+            ),
+            Tool(
+                name="sql_db_schema",
+                func=self.table_info,
+                description="Input to this tool is a comma-separated list of tables, output is the schema and sample rows for those tables. "
+                            "Example Input: table1, table2, table3",
+            ),
+        ]
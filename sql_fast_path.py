@@ -0,0 +1,250 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from sqlalchemy import bindparam, text
+from config import METRIC_CUBE_ENABLED, METRIC_CUBE_TABLE
+from entity_extractor import find_companies
+import tracing
+
+# ✅ fin_data.index 的 ENUM 值與常見說法
+METRIC_ALIASES = {
+    "Revenue": ["revenue", "revenues", "net sales", "sales"],
+    "Cost of Goods Sold": ["cost of goods sold", "cogs", "cost of revenue", "cost of sales"],
+    "Operating Income": ["operating income", "operating profit"],
+    "Operating Expense": ["operating expense", "operating expenses", "opex"],
+    "Tax Expense": ["tax expense", "tax expenses", "income tax expense"],
+    "Total Asset": ["total asset", "total assets"],
+    # 衍生指標：由 Revenue / Cost of Goods Sold / Operating Income 計算
+    "Gross Profit Margin": ["gross profit margin", "gross margin"],
+    "Operating Margin": ["operating margin"],
+}
+DERIVED_METRICS = {
+    "Gross Profit Margin": ["Revenue", "Cost of Goods Sold"],
+    "Operating Margin": ["Revenue", "Operating Income"],
+}
+
+_METRIC_RE = re.compile(
+    r"\b(" + "|".join(re.escape(a) for a in sorted({a for v in METRIC_ALIASES.values() for a in v}, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+_METRIC_OF_ALIAS = {alias: metric for metric, aliases in METRIC_ALIASES.items() for alias in aliases}
+_PERIOD_RE = re.compile(r"\b(?:(?P<y1>20\d{2})\s*Q(?P<q1>[1-4])|Q(?P<q2>[1-4])\s*(?P<y2>20\d{2})|Q(?P<q3>[1-4]))\b", re.IGNORECASE)
+_FISCAL_RE = re.compile(r"\b(fiscal|FY\s*\d{0,4})\b", re.IGNORECASE)
+_TREND_RE = re.compile(r"\b(increase|increased|decrease|decreased|grow|grew|decline|declined|rise|rose|drop|dropped|change|changed)\b", re.IGNORECASE)
+_COMPARE_RE = re.compile(r"\b(higher|lower|more|less|greater|compared|than|versus|vs)\b", re.IGNORECASE)
+
+SQL_FETCH = text(
+    'SELECT company_name, "index", calendar_year, calendar_qtr, usd_value, local_value, local_currency, val_unit '
+    'FROM fin_data '
+    'WHERE LOWER(company_name) = LOWER(:company) AND "index" IN :metrics AND calendar_year IN :years'
+).bindparams(bindparam("metrics", expanding=True), bindparam("years", expanding=True))
+# ✅ metric cube 已含衍生利潤率，以主鍵一次查出所有需要的期間
+SQL_FETCH_CUBE = text(
+    'SELECT company_name, "index", calendar_year, calendar_qtr, usd_value, local_value, local_currency, val_unit '
+    f'FROM {METRIC_CUBE_TABLE} '
+    'WHERE company_name = :company AND "index" IN :metrics AND calendar_year IN :years'
+).bindparams(bindparam("metrics", expanding=True), bindparam("years", expanding=True))
+
+
+@dataclass
+class FastPathQuestion:
+    company: str
+    metrics: List[str]
+    periods: List[Tuple[int, int]]  # [(calendar_year, calendar_qtr)]
+    shape: str  # "single" | "trend" | "comparison"
+    base_metrics: List[str] = field(default_factory=list)
+
+
+def parse_periods(query):
+    """解析 '2022 Q1' / 'Q1 2022' / 'Q1' (沿用前一個年份) 形式的期間"""
+    periods = []
+    last_year = None
+    for m in _PERIOD_RE.finditer(query):
+        year = m.group("y1") or m.group("y2")
+        qtr = m.group("q1") or m.group("q2") or m.group("q3")
+        if year:
+            last_year = int(year)
+        elif last_year is None:
+            return None  # 只有季度沒有年份，無法確定
+        period = (last_year, int(qtr))
+        if period not in periods:
+            periods.append(period)
+    return periods
+
+
+def previous_quarter(period):
+    year, qtr = period
+    return (year, qtr - 1) if qtr > 1 else (year - 1, 4)
+
+
+def parse_question(query: str) -> Optional[FastPathQuestion]:
+    """辨識「公司 + 指標 + 期間」的標準問句 (單一數值 / 趨勢 / 時間比較)；無法確定時回傳 None"""
+    if _FISCAL_RE.search(query):
+        return None  # fin_data 以 calendar year 為準，財年問題交給完整的 agent
+
+    companies = find_companies(query)  # 含別名，例如 Alphabet -> Google
+    if len(companies) != 1:
+        return None
+    company = companies[0]
+
+    metrics = []
+    for m in _METRIC_RE.finditer(query):
+        metric = _METRIC_OF_ALIAS[m.group(1).lower()]
+        if metric not in metrics:
+            metrics.append(metric)
+    periods = parse_periods(query)
+    if not metrics or not periods:
+        return None
+    # 使用者以 `...` 指定的指標必須全部能辨識，否則 (例如拼錯) 交給 agent 處理
+    for quoted in re.findall(r"`([^`]+)`", query):
+        if not _METRIC_RE.fullmatch(quoted.strip()):
+            return None
+
+    if len(periods) == 2 and _COMPARE_RE.search(query):
+        shape = "comparison"
+    elif len(periods) == 1 and _TREND_RE.search(query):
+        shape = "trend"
+        periods = [previous_quarter(periods[0]), periods[0]]
+    elif len(periods) == 1 and not _COMPARE_RE.search(query):
+        shape = "single"
+    else:
+        return None
+    if shape != "single" and len(metrics) != 1:
+        return None
+
+    base_metrics = []
+    for metric in metrics:
+        for base in DERIVED_METRICS.get(metric, [metric]):
+            if base not in base_metrics:
+                base_metrics.append(base)
+    return FastPathQuestion(company, metrics, periods, shape, base_metrics)
+
+
+def _fmt(value):
+    return f"{value:,.4f}".rstrip("0").rstrip(".")
+
+
+def _index_rows(rows):
+    return {(row["index"], int(row["calendar_year"]), int(row["calendar_qtr"])): row for row in rows}
+
+
+@tracing.traced("sql")
+def fetch_values(engine, question: FastPathQuestion, use_cube=METRIC_CUBE_ENABLED):
+    """以參數化 SQL 直接查詢 (use_cube 時先查 metric cube，cube 尚未建立時傳入 False 只查 fin_data)，
+    回傳 {(metric, year, qtr): row}"""
+    years = sorted({year for year, _ in question.periods})
+    with engine.connect() as conn:
+        if use_cube:
+            rows = conn.execute(SQL_FETCH_CUBE, {"company": question.company,
+                                                 "metrics": question.metrics, "years": years}).mappings().all()
+            if rows:
+                tracing.annotate(table="cube", rows=len(rows))
+                return _index_rows(rows)
+        rows = conn.execute(SQL_FETCH, {"company": question.company,
+                                        "metrics": question.base_metrics, "years": years}).mappings().all()
+    tracing.annotate(table="fin_data", rows=len(rows))
+    return _index_rows(rows)
+
+
+@tracing.traced("sql")
+async def afetch_values(async_engine, question: FastPathQuestion, use_cube=METRIC_CUBE_ENABLED):
+    """fetch_values 的 async 版本 (AsyncEngine)"""
+    years = sorted({year for year, _ in question.periods})
+    async with async_engine.connect() as conn:
+        if use_cube:
+            result = await conn.execute(SQL_FETCH_CUBE, {"company": question.company,
+                                                         "metrics": question.metrics, "years": years})
+            rows = result.mappings().all()
+            if rows:
+                tracing.annotate(table="cube", rows=len(rows))
+                return _index_rows(rows)
+        result = await conn.execute(SQL_FETCH, {"company": question.company,
+                                                "metrics": question.base_metrics, "years": years})
+        rows = result.mappings().all()
+    tracing.annotate(table="fin_data", rows=len(rows))
+    return _index_rows(rows)
+
+
+def _metric_value(values, metric, period):
+    """取得指標值 (usd, local, currency, unit)；衍生指標回傳百分比"""
+    year, qtr = period
+    row = values.get((metric, year, qtr))
+    if row is not None and row["val_unit"] == "%":
+        # metric cube 中預先算好的衍生利潤率
+        if row["usd_value"] is None:
+            return None
+        return {"usd": float(row["usd_value"]), "local": None, "currency": "%", "unit": "%"}
+    if metric in DERIVED_METRICS:
+        revenue = values.get(("Revenue", year, qtr))
+        other = values.get((DERIVED_METRICS[metric][1], year, qtr))
+        if revenue is None or other is None or not revenue["usd_value"]:
+            return None
+        if metric == "Gross Profit Margin":
+            ratio = (float(revenue["usd_value"]) - float(other["usd_value"])) / float(revenue["usd_value"])
+        else:
+            ratio = float(other["usd_value"]) / float(revenue["usd_value"])
+        return {"usd": ratio * 100, "local": None, "currency": "%", "unit": "%"}
+    if row is None or row["usd_value"] is None:
+        return None
+    return {"usd": float(row["usd_value"]),
+            "local": float(row["local_value"]) if row["local_value"] is not None else None,
+            "currency": row["local_currency"], "unit": row["val_unit"]}
+
+
+def _describe(value):
+    if value["unit"] == "%":
+        return f"{_fmt(value['usd'])}%"
+    text_value = f"USD {_fmt(value['usd'])} ({value['unit']})"
+    if value["local"] is not None and value["currency"] and value["currency"] != "USD":
+        text_value += f", {value['currency']} {_fmt(value['local'])} ({value['unit']})"
+    return text_value
+
+
+def answer_question(engine, query: str, use_cube=METRIC_CUBE_ENABLED) -> Optional[str]:
+    """fast path：可解析且資料齊全時直接回傳答案文字，否則回傳 None 交給 SQL ReAct agent"""
+    question = parse_question(query)
+    if question is None:
+        return None
+    return format_answer(question, fetch_values(engine, question, use_cube))
+
+
+async def aanswer_question(async_engine, query: str, use_cube=METRIC_CUBE_ENABLED) -> Optional[str]:
+    """answer_question 的 async 版本"""
+    question = parse_question(query)
+    if question is None:
+        return None
+    return format_answer(question, await afetch_values(async_engine, question, use_cube))
+
+
+def format_answer(question: FastPathQuestion, values) -> Optional[str]:
+    """將查到的數值組成回答；任何期間缺資料時回傳 None"""
+    lines = []
+    for metric in question.metrics:
+        found = [_metric_value(values, metric, period) for period in question.periods]
+        if any(v is None for v in found):
+            return None  # 資料不齊全，交給完整的 agent 處理
+        if question.shape == "single":
+            (year, qtr), value = question.periods[0], found[0]
+            lines.append(f"{question.company} {metric} in {year} Q{qtr}: {_describe(value)}")
+            continue
+
+        (y0, q0), (y1, q1) = question.periods
+        first, second = found
+        diff = second["usd"] - first["usd"]
+        if question.shape == "trend":
+            direction = "increased" if diff > 0 else "decreased" if diff < 0 else "was unchanged"
+            line = (f"{question.company} {metric} {direction} in {y1} Q{q1}: "
+                    f"{_describe(second)} vs {_describe(first)} in {y0} Q{q0}")
+        else:
+            relation = "higher than" if first["usd"] > second["usd"] else "lower than" if first["usd"] < second["usd"] else "equal to"
+            line = (f"{question.company} {metric} in {y0} Q{q0} ({_describe(first)}) is {relation} "
+                    f"{y1} Q{q1} ({_describe(second)})")
+            diff = -diff
+        if first["unit"] == "%":
+            line += f" (change: {diff:+.2f} percentage points)"
+        else:
+            base = first["usd"] if question.shape == "trend" else second["usd"]
+            pct = f", {diff / abs(base) * 100:+.2f}%" if base else ""
+            line += f" (change: USD {diff:+,.2f}{pct})"
+        lines.append(line)
+    return "\n".join(lines)
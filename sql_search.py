@@ -1,50 +1,169 @@
+import asyncio
+import threading
+from functools import lru_cache
 from vertexai import init
-from sqlalchemy import create_engine
 from langchain.chat_models import init_chat_model
 from langchain_community.utilities.sql_database import SQLDatabase
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langchain import hub
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.prebuilt import create_react_agent
 from langchain.tools import Tool
-from config import DB_HOST, DB_PORT, DATABASE, _USER, _PASSWORD, PROJECT_ID, REGION, MODEL_NAME, MODEL_PROVIDER
+from db import engine, get_async_engine  # ✅ 與 app 共用 db.py 的連線池
+from sql_fast_path import answer_question, aanswer_question
+from schema_cache import SchemaCache
+from metric_cube import CUBE_DESCRIPTION, start_refresh_loop
+from prompt import SQL_AGENT_SYSTEM_PROMPT
+import tracing
+from config import (PROJECT_ID, REGION, MODEL_NAME, MODEL_PROVIDER,
+                    METRIC_CUBE_ENABLED, METRIC_CUBE_TABLE, METRIC_CUBE_REFRESH_INTERVAL)
 
 
-init(project=PROJECT_ID, location=REGION)
-llm = init_chat_model(MODEL_NAME, model_provider=MODEL_PROVIDER)
+# 注入的資源 (benchmark / 離線測試用)，未設定時使用 db.py 的連線池與 Vertex AI
+_engine_override = None
+_async_engine_override = None
+_llm_override = None
 
-# ✅ 建立 SQLAlchemy 連線
-db_url = f'postgresql+psycopg2://{_USER}:{_PASSWORD}@{DB_HOST}:{DB_PORT}/{DATABASE}'
-engine = create_engine(db_url)
 
-# ✅ 創建 SQL Database 工具
-db = SQLDatabase(engine)
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)  # llm 由 agent.py 負責初始化
-tools = toolkit.get_tools()
+def set_sql_resources(sql_engine=None, async_engine=None, llm=None):
+    """以指定的 engine (例如本地 SQLite 的 fin_data) / 模型取代預設資源；不帶參數則恢復預設"""
+    global _engine_override, _async_engine_override, _llm_override, _cube_started, _cube_ready, _cube_stop
+    _engine_override = sql_engine
+    _async_engine_override = async_engine
+    _llm_override = llm
+    # 新的 engine 需要重新建立 metric cube，舊 engine 的背景更新停止
+    if _cube_stop is not None:
+        _cube_stop.set()
+    _cube_started, _cube_ready, _cube_stop = False, threading.Event(), None
+    get_db.cache_clear()
+    get_schema_cache.cache_clear()
+    get_agent_executor.cache_clear()
 
-prompt_template = hub.pull("langchain-ai/sql-agent-system-prompt")
-system_message = prompt_template.format(dialect="PostgreSQL", top_k=5)
 
-# init langGraph
-agent_executor = create_react_agent(llm, tools, prompt=system_message)
+def get_engine():
+    return _engine_override if _engine_override is not None else engine
+
+
+# ✅ 所有需要連線 / 建立模型的資源都延遲到第一次使用時才初始化，import 本模組不做任何網路 I/O
+def get_llm():
+    if _llm_override is not None:
+        return _llm_override
+    return _build_llm()
+
+
+@lru_cache(maxsize=None)
+def _build_llm():
+    init(project=PROJECT_ID, location=REGION)
+    return init_chat_model(MODEL_NAME, model_provider=MODEL_PROVIDER)
+
+
+@lru_cache(maxsize=None)
+def get_db():
+    """SQL Database 包裝 (建立時會讀取 catalog)"""
+    return SQLDatabase(get_engine())
+
+
+@lru_cache(maxsize=None)
+def get_schema_cache():
+    """schema 快照：第一次使用時建立，list tables / schema 工具改由快照回答，不再即時查詢 catalog"""
+    if _engine_override is not None:
+        schema_cache = SchemaCache(get_db(), get_engine(), path=None)  # 注入的 engine 不寫入正式的快照檔
+    else:
+        schema_cache = SchemaCache(get_db(), engine)
+    schema_cache.get()
+    return schema_cache
+
+
+_cube_lock = threading.Lock()
+_cube_started = False
+_cube_ready = threading.Event()  # 第一次 refresh 完成後 set，之前 fast path 只查 fin_data
+_cube_stop = None
+
+
+def start_metric_cube():
+    """metric cube：在背景執行緒中立即建立 / 增量更新，之後定期更新；不阻塞呼叫端 (agent 建立時與每次查詢都會呼叫)"""
+    global _cube_started, _cube_stop
+    if not METRIC_CUBE_ENABLED or _cube_started:
+        return
+    with _cube_lock:
+        if not _cube_started:
+            _cube_stop = start_refresh_loop(get_engine(), METRIC_CUBE_REFRESH_INTERVAL, ready=_cube_ready)
+            _cube_started = True
+
+
+def cube_ready(timeout=0):
+    """metric cube 是否已建立 (可以讀取)；timeout > 0 時最多等待 timeout 秒"""
+    return METRIC_CUBE_ENABLED and _cube_ready.wait(timeout)
+
+
+# ✅ 本地保存的 SQL agent system prompt (原本以 hub.pull 在啟動時從網路下載)
+system_message = SQL_AGENT_SYSTEM_PROMPT.format(dialect="PostgreSQL", top_k=5)
+
+
+def build_agent_prompt(state):
+    """每次呼叫時把目前的 schema 快照放進 system prompt (快照更新後自動生效)；
+    cube 的說明只在快照中已有 cube 資料表時加入，cube 尚未建立時不會引導 LLM 查詢不存在的資料表"""
+    schema_cache = get_schema_cache()
+    content = system_message + "\n\n" + schema_cache.prompt_context()
+    if METRIC_CUBE_TABLE in schema_cache.get()["tables"]:
+        content += "\n\n" + CUBE_DESCRIPTION
+    return [SystemMessage(content=content)] + state["messages"]
+
+
+@lru_cache(maxsize=None)
+def get_agent_executor():
+    """init langGraph SQL ReAct agent"""
+    llm = get_llm()
+    toolkit = SQLDatabaseToolkit(db=get_db(), llm=llm)
+    tools = [t for t in toolkit.get_tools() if t.name not in ("sql_db_list_tables", "sql_db_schema")] + get_schema_cache().get_tools()
+    return create_react_agent(llm, tools, prompt=build_agent_prompt)
 
 # ✅ 建立 SQL 查詢工具
+@tracing.traced("tool")
 def sql_query_tool(query: str) -> dict:
     """透過 SQL Agent 生成 SQL 並執行，並回傳包含 structured_response 的 dict"""
+    start_metric_cube()
+    # ✅ 標準問句 (公司 + 指標 + 期間) 直接走參數化 SQL，不經過 ReAct agent
+    fast_answer = answer_question(get_engine(), query, use_cube=cube_ready())
+    tracing.annotate(fast_path=fast_answer is not None)
+    if fast_answer is not None:
+        return {"structured_response": fast_answer, "fast_path": True}
+
     # 使用 invoke 並傳入正確格式的輸入（字典格式的 state）
-    response = agent_executor.invoke({"messages": [HumanMessage(content=query)]})
-    
+    response = get_agent_executor().invoke({"messages": [HumanMessage(content=query)]})
+    return {"structured_response": _agent_output(response)}
+
+
+@tracing.traced("tool")
+async def asql_query_tool(query: str) -> dict:
+    """sql_query_tool 的 async 版本：fast path 走 asyncpg，ReAct agent 以 ainvoke 執行"""
+    start_metric_cube()
+    async_engine = _async_engine_override if _engine_override is not None else get_async_engine()
+    if async_engine is None:
+        # 注入的 engine 沒有對應的 async engine 時，fast path 以執行緒執行同步查詢
+        fast_answer = await asyncio.to_thread(answer_question, get_engine(), query, cube_ready())
+    else:
+        fast_answer = await aanswer_question(async_engine, query, use_cube=cube_ready())
+    tracing.annotate(fast_path=fast_answer is not None)
+    if fast_answer is not None:
+        return {"structured_response": fast_answer, "fast_path": True}
+
+    # 第一次建立 agent 會讀取 catalog，放到執行緒中避免阻塞 event loop
+    agent_executor = await asyncio.to_thread(get_agent_executor)
+    response = await agent_executor.ainvoke({"messages": [HumanMessage(content=query)]})
+    return {"structured_response": _agent_output(response)}
+
+
+def _agent_output(response):
     # 提取最終答案 (根據實際回傳結構調整)
     if "messages" in response:
-        output = response["messages"][-1].content
-    else:
-        output = str(response)
-    
-    return {"structured_response": output}
+        return response["messages"][-1].content
+    return str(response)
+
 
 sql_tool = Tool(
     name="sql_db_query",
     func=sql_query_tool,
+    coroutine=asql_query_tool,
     description="用來查詢 SQL 數據庫，請輸入財務相關的問題，系統會自動轉換為 SQL 語句並執行。"
 )
 
@@ -60,7 +179,7 @@ def get_sql_tools():
 if __name__ == "__main__":
     question = "show 5 first rows in the `fin_data` table."
 
-    for step in agent_executor.stream(
+    for step in get_agent_executor().stream(
         {"messages": [{"role": "user", "content": question}]},
         stream_mode="values",
     ):
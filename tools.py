@@ -1,3 +1,13 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
 
 def decide_tools(query: str):
     """根據 Query 選擇 SQL 或 RAG 工具"""
@@ -44,11 +54,63 @@ def fix_rag_result(text):
         queries_end = text.find("]", queries_start)
         queries = text[queries_start:queries_end].replace('"', '').split(",\n        ")
 
-        print(" - Company Name:", company_names)
-        print(" - CALENDAR_YEAR:", calendar_years)
-        print(" - CALENDAR_QTR:", calendar_qtrs)
-        print("\nMultiple Values Exist:", multiple_values_exist)
-        print("\nSplit Queries:")
-        for q in queries:
-            print(" -", q.strip())
-        return {"Company Name": company_names, "CALENDAR_YEAR": calendar_years, "CALENDAR_QTR": calendar_qtrs, "Multiple Values Exist": multiple_values_exist, "Split Queries": queries}
\ No newline at end of file
+        logger.debug("Company Name: %s, CALENDAR_YEAR: %s, CALENDAR_QTR: %s", company_names, calendar_years, calendar_qtrs)
+        logger.debug("Multiple Values Exist: %s, Split Queries: %s", multiple_values_exist, [q.strip() for q in queries])
+        return {"Company Name": company_names, "CALENDAR_YEAR": calendar_years, "CALENDAR_QTR": calendar_qtrs, "Multiple Values Exist": multiple_values_exist, "Split Queries": queries}
+
+def run_in_parallel(func, items, max_workers=4, timeout=None):
+    """以有限併發執行 func(item)，結果依輸入順序回傳；逾時或發生錯誤的項目以 Exception 物件回傳"""
+    items = list(items)
+    if not items:
+        return []
+
+    started = [threading.Event() for _ in items]
+    start_times = [None] * len(items)
+
+    def _run(i, item):
+        start_times[i] = time.monotonic()
+        started[i].set()
+        return func(item)
+
+    results = []
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        # 每個工作各自複製呼叫端的 context，子查詢的 span 才會接在目前節點的 span 之下
+        futures = [executor.submit(contextvars.copy_context().run, _run, i, item) for i, item in enumerate(items)]
+        for i, future in enumerate(futures):
+            try:
+                if timeout is None:
+                    results.append(future.result())
+                    continue
+                # ✅ 逾時從子查詢真正開始執行時起算，排隊等待的時間不計入
+                #    (若工作執行緒全被卡住，排隊超過 timeout 仍未開始也視為逾時)
+                if not started[i].wait(timeout):
+                    raise FutureTimeoutError()
+                remaining = timeout - (time.monotonic() - start_times[i])
+                results.append(future.result(timeout=max(remaining, 0)))
+            except FutureTimeoutError:
+                future.cancel()
+                results.append(TimeoutError(f"sub-query timed out after {timeout}s: {items[i]!r}"))
+            except Exception as e:
+                results.append(e)
+    finally:
+        # 逾時的執行緒無法強制中止，不等待它們結束以免拖慢回應
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+async def arun_in_parallel(afunc, items, max_concurrency=4, timeout=None):
+    """run_in_parallel 的 async 版本：以 Semaphore 限制併發數，逾時從取得執行名額時起算"""
+    items = list(items)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(item):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(afunc(item), timeout)
+            except asyncio.TimeoutError:
+                return TimeoutError(f"sub-query timed out after {timeout}s: {item!r}")
+            except Exception as e:
+                return e
+
+    return await asyncio.gather(*(_run(item) for item in items))
@@ -0,0 +1,334 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from langchain_core.callbacks import BaseCallbackHandler
+from context_builder import estimate_tokens
+from config import (LOG_LEVEL, TRACE_JSONL_PATH, TRACE_METRICS_PATH, TRACE_METRICS_PORT,
+                    TRACE_FLUSH_EVERY)
+
+logger = logging.getLogger(__name__)
+
+# Prometheus histogram 的 bucket 上限 (秒)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_tracer = None  # 未啟用時為 None：span() / traced() 只做一次判斷，幾乎沒有額外成本
+
+
+def setup_logging(level=LOG_LEVEL):
+    """取代原本散落的 print：統一格式、依等級輸出到 stderr"""
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+class _NoopSpan:
+    """追蹤未啟用時回傳的共用 span，所有操作都不做事"""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """一段計時的工作 (graph 節點、LLM / 工具 / SQL / 向量檢索呼叫)；以 with 使用時成為子 span 的 parent"""
+    __slots__ = ("name", "kind", "attrs", "trace_id", "span_id", "parent_id", "start_time", "_start", "_token", "_done")
+
+    def __init__(self, name, kind, attrs=None, parent=None):
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs or {}
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = None
+        self._done = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def finish(self, error=None):
+        if self._done:
+            return
+        self._done = True
+        record = {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "name": self.name, "kind": self.kind, "start": round(self.start_time, 6),
+            "duration_ms": round((time.perf_counter() - self._start) * 1000, 3),
+            "status": "error" if error is not None else "ok", "attrs": self.attrs,
+        }
+        if error is not None:
+            record["error"] = repr(error)
+        tracer = _tracer
+        if tracer is not None:
+            tracer.export(record)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.finish(exc)
+        return False
+
+
+class Metrics:
+    """依 (kind, name) 彙總 span：次數、錯誤數、延遲 histogram，以及數值屬性 (token、列數、chunk 數、快取命中) 的總和"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.duration_sum = defaultdict(float)
+        self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self.attr_sum = defaultdict(float)
+
+    def record(self, record):
+        key = (record["kind"], record["name"])
+        seconds = record["duration_ms"] / 1000
+        with self._lock:
+            self.count[key] += 1
+            self.errors[key] += record["status"] == "error"
+            self.duration_sum[key] += seconds
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[key][i] += 1
+            for attr, value in record["attrs"].items():
+                if isinstance(value, (bool, int, float)):
+                    self.attr_sum[key + (attr,)] += value
+
+    def prometheus_text(self):
+        def _labels(kind, name, **extra):
+            pairs = {"kind": kind, "name": name, **extra}
+            return ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs.items())
+
+        lines = ["# HELP agent_span_duration_seconds Duration of agent spans (graph nodes, LLM, tool, SQL and vector calls).",
+                 "# TYPE agent_span_duration_seconds histogram"]
+        with self._lock:
+            for key in sorted(self.count):
+                for bound, n in zip(DURATION_BUCKETS, self.buckets[key]):
+                    lines.append(f"agent_span_duration_seconds_bucket{{{_labels(*key, le=bound)}}} {n}")
+                lines.append(f'agent_span_duration_seconds_bucket{{{_labels(*key, le="+Inf")}}} {self.count[key]}')
+                lines.append(f"agent_span_duration_seconds_sum{{{_labels(*key)}}} {self.duration_sum[key]:.6f}")
+                lines.append(f"agent_span_duration_seconds_count{{{_labels(*key)}}} {self.count[key]}")
+            lines += ["# HELP agent_span_errors_total Spans that ended with an exception.",
+                      "# TYPE agent_span_errors_total counter"]
+            lines += [f"agent_span_errors_total{{{_labels(*key)}}} {self.errors[key]}" for key in sorted(self.count)]
+            lines += ["# HELP agent_span_attribute_total Sum of numeric span attributes (tokens, rows, chunks, cache hits).",
+                      "# TYPE agent_span_attribute_total counter"]
+            lines += [f"agent_span_attribute_total{{{_labels(kind, name, attribute=attr)}}} {value:g}"
+                      for (kind, name, attr), value in sorted(self.attr_sum.items())]
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """收集結束的 span：寫入 JSONL (批次寫入) 並更新 Prometheus 指標"""
+
+    def __init__(self, jsonl_path=TRACE_JSONL_PATH, metrics_path=TRACE_METRICS_PATH, flush_every=TRACE_FLUSH_EVERY):
+        self.jsonl_path = jsonl_path
+        self.metrics_path = metrics_path
+        self.flush_every = flush_every
+        self.metrics = Metrics()
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        self.metrics.record(record)
+        if not self.jsonl_path:
+            return
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) < self.flush_every:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+            if buffer and self.jsonl_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in buffer)
+            if self.metrics_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+                tmp_path = f"{self.metrics_path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(self.metrics.prometheus_text())
+                os.replace(tmp_path, self.metrics_path)
+
+
+def current_span():
+    span = _current_span.get()
+    return span if span is not None and _tracer is not None else NOOP_SPAN
+
+
+def span(name, kind, parent=None, **attrs):
+    """建立 span (with 區塊內為目前的 span)；未啟用追蹤時回傳 NOOP_SPAN"""
+    if _tracer is None:
+        return NOOP_SPAN
+    return Span(name, kind, attrs, parent if parent is not None else _current_span.get())
+
+
+def annotate(**attrs):
+    """在目前的 span 加上屬性 (列數、chunk 數、是否命中快取…)"""
+    if _tracer is not None:
+        current_span().set(**attrs)
+
+
+def traced(kind, name=None):
+    """把整個函式包成一個 span 的 decorator (sync / async 皆可)"""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def _async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await func(*args, **kwargs)
+                with span(span_name, kind):
+                    return await func(*args, **kwargs)
+            return _async_wrapper
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(span_name, kind):
+                return func(*args, **kwargs)
+        return _wrapper
+    return decorator
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """把 LangChain 的 LLM 與工具呼叫轉成 span (含 token 數)；包含 QA chain、SQL ReAct agent 內部的呼叫"""
+    run_inline = True  # 在呼叫端的執行緒 / context 執行，parent span 才正確
+    ignore_chain = True
+    ignore_retriever = True
+
+    def __init__(self):
+        self._spans = {}
+
+    def _start(self, run_id, name, kind, **attrs):
+        if _tracer is not None:
+            self._spans[run_id] = Span(name, kind, attrs, _current_span.get())
+
+    def _end(self, run_id, error=None, **attrs):
+        span_ = self._spans.pop(run_id, None)
+        if span_ is not None:
+            span_.set(**attrs).finish(error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, kwargs.get("name") or (serialized or {}).get("name") or "llm", "llm",
+                    prompt_tokens=sum(estimate_tokens(p) for p in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, kwargs.get("name") or (serialized or {}).get("name") or "chat_model", "llm",
+                    prompt_tokens=sum(estimate_tokens(m.content) for batch in messages for m in batch))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        attrs = {}
+        generations = [g for batch in response.generations for g in batch]
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        message_usage = getattr(getattr(generations[0], "message", None), "usage_metadata", None) if generations else None
+        if message_usage:
+            attrs = {"prompt_tokens": message_usage.get("input_tokens", 0),
+                     "completion_tokens": message_usage.get("output_tokens", 0)}
+        elif usage:
+            attrs = {"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0)}
+        else:
+            # 模型沒有回報用量時以本地估算 (prompt 的估算已在 start 時記錄)
+            attrs = {"completion_tokens": sum(estimate_tokens(g.text) for g in generations)}
+        self._end(run_id, **attrs)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, kwargs.get("name") or (serialized or {}).get("name") or "tool", "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+_callback_hook_registered = False
+
+
+def enable_tracing(jsonl_path=TRACE_JSONL_PATH, metrics_path=TRACE_METRICS_PATH, metrics_port=TRACE_METRICS_PORT):
+    """開始記錄 span；LangChain 的 LLM / 工具呼叫透過 configure hook 自動加入 callback"""
+    global _tracer, _callback_hook_registered
+    _tracer = Tracer(jsonl_path, metrics_path)
+    if not _callback_hook_registered:
+        from langchain_core.tracers.context import register_configure_hook
+        # 以 default 值註冊，所有執行緒 (包含工作執行緒) 的 callback manager 都會帶上這個 handler
+        register_configure_hook(contextvars.ContextVar("agent_tracing_callback", default=TracingCallbackHandler()),
+                                inheritable=True)
+        atexit.register(flush)
+        _callback_hook_registered = True
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    logger.info("Tracing enabled: spans -> %s, metrics -> %s", jsonl_path, metrics_path)
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    flush()
+    _tracer = None
+
+
+def flush():
+    if _tracer is not None:
+        _tracer.flush()
+
+
+def prometheus_text():
+    return _tracer.metrics.prometheus_text() if _tracer is not None else ""
+
+
+def start_metrics_server(port):
+    """在背景執行緒以 HTTP 提供 /metrics (Prometheus text format)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Serving metrics on :%d/metrics", port)
+    return server